@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+cache.py
+
+This file contains the size bounded on-disk cache used by the planning.py script
+to keep results between sessions
+"""
+
+# import modules
+from defs import *
+from os import makedirs, listdir, remove, replace, utime, path, getpid, stat
+from glob import glob, escape
+import hashlib
+
+
+class DiskCache:
+    """A directory of cached files addressed by a content key. Every file read or written is
+    touched, and when the directory grows past its size cap the least recently used files are
+    removed until it fits.
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        """Create the cache, the directory is created on first write.
+
+        :param directory: The cache directory, ~ is expanded.
+        :type directory: str
+        :param max_bytes: The size cap of the cache in bytes.
+        :type max_bytes: int
+        """
+        self.directory = path.expanduser(directory)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Combine the parts of a key into a file name safe hex digest.
+
+        :return: The key.
+        :rtype: str
+        """
+        return hashlib.blake2b("\x00".join(str(part) for part in parts).encode(), digest_size=16).hexdigest()
+
+    def path(self, key: str, suffix: str) -> str:
+        """Get the path of the cache file of a key.
+
+        :param key: The key of the file.
+        :type key: str
+        :param suffix: The file extension, such as ".npz".
+        :type suffix: str
+        :return: The path of the file.
+        :rtype: str
+        """
+        return path.join(self.directory, key + suffix)
+
+    def get(self, key: str, suffix: str) -> str | None:
+        """Get the path of a cached file and mark it as recently used.
+
+        :param key: The key of the file.
+        :type key: str
+        :param suffix: The file extension.
+        :type suffix: str
+        :return: The path of the file, or None if it is not cached.
+        :rtype: str | None
+        """
+        file_name = self.path(key, suffix)
+        if not path.isfile(file_name):
+            return None
+        try:
+            utime(file_name)
+        except OSError:
+            return None
+        return file_name
+
+    def put(self, key: str, suffix: str, write) -> str:
+        """Write a file into the cache and evict the least recently used files over the cap.
+        The file is written under a temporary name and moved into place, so readers never see
+        a partial file.
+
+        :param key: The key of the file.
+        :type key: str
+        :param suffix: The file extension.
+        :type suffix: str
+        :param write: Called with the temporary path to write the file to.
+        :type write: Callable[[str], None]
+        :return: The path of the file.
+        :rtype: str
+        """
+        makedirs(self.directory, exist_ok=True)
+        file_name = self.path(key, suffix)
+        temp_name = path.join(self.directory, f".{key}.{getpid()}.tmp{suffix}")
+        try:
+            write(temp_name)
+            replace(temp_name, file_name)
+        finally:
+            if path.exists(temp_name):
+                remove(temp_name)
+        self.evict(keep=file_name)
+        return file_name
+
+    def files(self) -> list[tuple[str, int, float]]:
+        """List the cached files, least recently used first.
+
+        :return: The path, size and last use time of every cached file.
+        :rtype: list[tuple[str, int, float]]
+        """
+        if not path.isdir(self.directory):
+            return []
+        files = []
+        for name in listdir(self.directory):
+            file_name = path.join(self.directory, name)
+            if name.startswith(".") or not path.isfile(file_name):
+                continue
+            try:
+                files.append((file_name, path.getsize(file_name), path.getmtime(file_name)))
+            except OSError:
+                continue
+        return sorted(files, key=lambda file: file[2])
+
+    def size(self) -> int:
+        """Get the total size of the cached files in bytes.
+
+        :return: The size of the cache.
+        :rtype: int
+        """
+        return sum(size for _, size, _ in self.files())
+
+    def evict(self, keep: str = None) -> int:
+        """Remove the least recently used files until the cache fits its size cap.
+
+        :param keep: A file that is never removed, such as the file just written, defaults to None.
+        :type keep: str, optional
+        :return: The number of files removed.
+        :rtype: int
+        """
+        files = self.files()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for file_name, size, _ in files:
+            if total <= self.max_bytes:
+                break
+            if file_name == keep:
+                continue
+            try:
+                remove(file_name)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self) -> int:
+        """Remove every cached file.
+
+        :return: The number of files removed.
+        :rtype: int
+        """
+        removed = 0
+        for file_name, _, _ in self.files():
+            try:
+                remove(file_name)
+                removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def info(self) -> dict:
+        """Describe the cache.
+
+        :return: The directory, number of files, total size and size cap of the cache.
+        :rtype: dict
+        """
+        files = self.files()
+        return {
+            "directory": self.directory,
+            "files": len(files),
+            "bytes": sum(size for _, size, _ in files),
+            "max_bytes": self.max_bytes,
+        }
+
+
+def file_signature(file: str, sample_bytes: int = 1024**2) -> tuple:
+    """Describe the contents of a file so a cached result made from it can be told apart from
+    one made from a changed file. The signature holds the absolute path and, for the file and the
+    files beside it that share its name such as the .dbf and .prj of a shapefile, the size, the
+    modification time and a hash of the first and last sample_bytes. Hashing only the ends keeps
+    the signature of a large file cheap.
+
+    :param file: The file name.
+    :type file: str
+    :param sample_bytes: The bytes hashed at each end of every file, defaults to 1 MB.
+    :type sample_bytes: int, optional
+    :return: The signature, to be passed to :meth:`DiskCache.key`.
+    :rtype: tuple
+    """
+    file = path.abspath(file)
+    signature = [file]
+    for name in sorted(set(glob(escape(path.splitext(file)[0]) + ".*")) | {file}):
+        info = stat(name)
+        digest = hashlib.blake2b(digest_size=16)
+        with open(name, "rb") as f:
+            digest.update(f.read(sample_bytes))
+            if info.st_size > sample_bytes:
+                f.seek(max(sample_bytes, info.st_size - sample_bytes))
+                digest.update(f.read())
+        signature.append((path.basename(name), info.st_size, info.st_mtime_ns, digest.hexdigest()))
+    return tuple(signature)
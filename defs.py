@@ -26,6 +26,40 @@ DEFAULT_RESULTS_FILE_NAME = "marxan_results"
 GPKG_DRIVER = "GPKG"
 SHAPE_DRIVER = "shp"
 
+# loading
+LOAD_THREADS = 8  # the most files read at the same time
+
+# grid generation
+GRID_TILE_SIZE = 100000  # approximate number of hexagons per tile when streaming a grid to file
+
+# tile manifest
+TILE_HEARTBEAT = 60  # seconds between refreshes of the claim of a tile while it is calculated
+
+# overlap calculation
+OVERLAP_CHUNKS_PER_CORE = 8  # the planning grid is split into this many spatially compact chunks per core
+OVERLAP_BACKENDS = ["auto", "serial", "thread", "process"]
+OVERLAP_BACKEND = "auto"  # auto picks serial, thread or process from the size of the job
+OVERLAP_SERIAL_MAX_WORK = 50000  # planning units + feature vertices below which auto runs serially
+OVERLAP_THREAD_MAX_WORK = 5000000  # planning units + feature vertices below which auto uses threads
+OVERLAP_MAX_VERTICES = 2000  # features with more vertices are split into pieces before the overlap
+OVERLAP_MAX_SPLIT_DEPTH = 16  # the most times a piece of a feature is halved
+OVERLAP_LATTICE = True  # cut features along the lattice of generated grids instead of intersecting each hexagon
+OVERLAP_RASTER_RESOLUTION = 8  # pixels across each half row cell of a hexagon in approximate raster overlap
+OVERLAP_RASTER_BATCH = 2**22  # the most pixels rasterized at once
+STREAM_BATCH_SIZE = 10000  # features read at a time when streaming a conservation layer from file
+OVERLAP_ENGINE_VERSION = 2  # change when the overlap results change so cached results are not reused
+
+# on-disk caches
+CACHE_DIR = "~/.planning_cache"
+OVERLAP_CACHE_DIR = CACHE_DIR + "/overlap"
+OVERLAP_CACHE_MAX_BYTES = 1024**3  # least recently used results are removed past this size
+OVERLAP_CHECKPOINT = True  # save each finished chunk so an interrupted overlap calculation can resume
+OVERLAP_CHECKPOINT_MIN_WORK = OVERLAP_THREAD_MAX_WORK  # planning units + feature vertices below which no checkpoint is saved
+OVERLAP_CHECKPOINT_DIR = CACHE_DIR + "/checkpoints"
+LAYER_CACHE = True  # keep loaded conservation layers projected to the target CRS as GeoParquet
+LAYER_CACHE_DIR = CACHE_DIR + "/layers"
+LAYER_CACHE_MAX_BYTES = 4 * 1024**3  # least recently used layers are removed past this size
+
 # Message formatting
 COLOUR = False
 RED = "\033[1;31m"
@@ -83,6 +117,8 @@ DEFAULT_GRID_INPUT = 1
 DEFAULT_LOAD_CONSERVATION_INPUT = 1
 DEFAULT_QUEURY_INPUT = 1
 DEFAULT_PLOT_INPUT = 9
+DEFAULT_CACHE_INPUT = 1
+DEFAULT_OVERLAP_INPUT = 1
 DEFAULT_QUIT = 'n'
 
 
@@ -95,11 +131,13 @@ NAME = "NAME"
 PUID = "GRID_ID"  # grid id field name for planning unit grid, this must be present in the planning unit grid
 GEOMETRY = "geometry"
 MAP_COLUMN = "ID"
+LOAD_COLUMNS = [ID]  # the attribute columns read with a conservation layer, others are read when they are filtered on
 
 # marxan csv header names
 SPECIES = "species"
 PU = "pu"
 AMOUNT = "amount"
+MAX_ERROR = "max_error"  # the bound on the area error of an approximate overlap amount
 
 
 
@@ -0,0 +1,767 @@
+# -*- coding: utf-8 -*-
+"""
+hexgrid.py
+
+This file contains the NumPy backed hexagon grid engine for the planning.py script
+"""
+
+# import modules
+from defs import *
+from os import environ
+environ["USE_PYGEOS"] = "0"
+from math import sqrt, ceil, cos, sin, radians
+from typing import Iterator
+import numpy as np
+import shapely
+import pandas as pd
+import geopandas as gpd
+
+# Unit hexagon vertex offsets, the same six angles as the original per cell hexagon code
+HEX_UNIT_OFFSETS = np.array([[cos(radians(angle)), sin(radians(angle))] for angle in range(0, 360, 60)])
+
+
+def hex_side(area: float) -> float:
+    """Calculate the edge length of a regular hexagon from its area.
+
+    :param area: The area of the hexagon.
+    :type area: float
+    :return: The length of the hexagon's edge.
+    :rtype: float
+    """
+    return sqrt(area / (1.5 * sqrt(3)))
+
+
+def _steps(start: float, step: float, end: float) -> np.ndarray:
+    """Return the values start, start + step, ... that are less than end. The values
+    are accumulated with a sequential cumulative sum so they are identical to the
+    values produced by the ``+=`` loops of the original per cell grid code.
+
+    :param start: The first value.
+    :type start: float
+    :param step: The step between values.
+    :type step: float
+    :param end: The exclusive end value.
+    :type end: float
+    :return: The array of values.
+    :rtype: np.ndarray
+    """
+    n = max(int(ceil((end - start) / step)) + 1, 1)
+    values = np.cumsum(np.concatenate(([start], np.full(n, step))))
+    return values[values < end]
+
+
+def _ramp(counts: np.ndarray) -> np.ndarray:
+    """Return 0..n-1 for every n in counts, concatenated into one array.
+
+    :param counts: The length of each ramp.
+    :type counts: np.ndarray
+    :return: The concatenated ramps.
+    :rtype: np.ndarray
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+class HexLattice:
+    """Analytic index of the regular hexagon lattice of the generated planning grids.
+    Every hexagon is identified by its (col, row) position in the lattice, and by its
+    lattice id which numbers the hexagons column by column, bottom to top, starting at 1.
+    For a grid that keeps every hexagon the lattice id is the GRID_ID. For a grid clipped
+    to a shape, ids holds the lattice id of each kept hexagon in GRID_ID order, so lookups
+    still return the grid's GRID_ID. Points and bounding boxes are mapped to hexagons with
+    arithmetic only, no spatial index over the hexagon polygons is required.
+    """
+
+    def __init__(
+        self, side: float, col_x: np.ndarray, rows: list[np.ndarray], parity0: int, ids: np.ndarray = None
+    ):
+        """Create the lattice index, normally done with :meth:`from_bounds`.
+
+        :param side: The length of the hexagon's edge.
+        :type side: float
+        :param col_x: The x coordinate of each column.
+        :type col_x: np.ndarray
+        :param rows: The y coordinates of the rows for columns of parity 0 and 1.
+        :type rows: list[np.ndarray]
+        :param parity0: The parity of the first column.
+        :type parity0: int
+        :param ids: The sorted lattice ids of the hexagons kept in the grid, defaults to None for all.
+        :type ids: np.ndarray, optional
+        """
+        self.side = side
+        self.h_step = 1.5 * side
+        self.v_step = sqrt(3) * side
+        self.col_x = col_x
+        self.rows = rows
+        self.parity0 = parity0
+        self.n_rows = np.array([len(rows[0]), len(rows[1])])
+        self.ids = ids
+
+    @classmethod
+    def from_bounds(cls, bbx, area: float) -> "HexLattice":
+        """Create the lattice covering the bounding box, using the same start offsets
+        and steps as the original per cell grid code.
+
+        :param bbx: The bounding box as (xmin, ymin, xmax, ymax).
+        :type bbx: array_like
+        :param area: The area of each hexagon.
+        :type area: float
+        :return: The lattice index.
+        :rtype: HexLattice
+        """
+        side = hex_side(area)
+        v_step = sqrt(3) * side
+        h_step = 1.5 * side
+
+        x_min = min(bbx[0], bbx[2])
+        x_max = max(bbx[0], bbx[2])
+        y_min = min(bbx[1], bbx[3])
+        y_max = max(bbx[1], bbx[3])
+
+        h_skip = ceil(x_min / h_step) - 1
+        h_start = h_skip * h_step
+
+        v_skip = ceil(y_min / v_step) - 1
+        v_start = v_skip * v_step
+
+        h_end = x_max + h_step
+        v_end = y_max + v_step
+
+        if v_start - (v_step / 2.0) < y_min:
+            v_start_array = [v_start + (v_step / 2.0), v_start]
+        else:
+            v_start_array = [v_start - (v_step / 2.0), v_start]
+
+        # columns alternate between the two vertical start offsets
+        col_x = _steps(h_start, h_step, h_end)
+        rows = [_steps(v_start_array[0], v_step, v_end), _steps(v_start_array[1], v_step, v_end)]
+
+        return cls(side, col_x, rows, int(abs(h_skip) % 2))
+
+    @property
+    def n_cols(self) -> int:
+        """The number of columns in the lattice."""
+        return len(self.col_x)
+
+    @property
+    def size(self) -> int:
+        """The number of hexagons in the full lattice."""
+        return int(self.column_offsets(self.n_cols))
+
+    @property
+    def cell_area(self) -> float:
+        """The area of each hexagon."""
+        return 1.5 * sqrt(3) * self.side**2
+
+    def __len__(self) -> int:
+        return self.size if self.ids is None else len(self.ids)
+
+    def parity(self, cols: np.ndarray) -> np.ndarray:
+        """Return the parity of the columns, which selects their row offsets.
+
+        :param cols: The column numbers.
+        :type cols: np.ndarray
+        :return: The parity (0 or 1) of each column.
+        :rtype: np.ndarray
+        """
+        return (self.parity0 + np.asarray(cols)) % 2
+
+    def column_offsets(self, cols: np.ndarray) -> np.ndarray:
+        """Return the number of hexagons in the lattice before each column.
+
+        :param cols: The column numbers.
+        :type cols: np.ndarray
+        :return: The lattice id of the first hexagon in each column, minus 1.
+        :rtype: np.ndarray
+        """
+        cols = np.asarray(cols, dtype=np.int64)
+        return (cols // 2) * self.n_rows.sum() + (cols % 2) * self.n_rows[self.parity0]
+
+    def cell_to_lattice_id(self, cols: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Convert (col, row) lattice positions to lattice ids.
+
+        :param cols: The column numbers.
+        :type cols: np.ndarray
+        :param rows: The row numbers.
+        :type rows: np.ndarray
+        :return: The lattice ids, 0 for positions outside the lattice.
+        :rtype: np.ndarray
+        """
+        cols = np.asarray(cols, dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int64)
+        valid = (cols >= 0) & (cols < self.n_cols) & (rows >= 0)
+        valid &= rows < self.n_rows[self.parity(cols)]
+        return np.where(valid, self.column_offsets(cols) + rows + 1, 0)
+
+    def lattice_id_to_cell(self, lattice_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Convert lattice ids to (col, row) lattice positions.
+
+        :param lattice_ids: The lattice ids.
+        :type lattice_ids: np.ndarray
+        :return: The column and row numbers.
+        :rtype: tuple[np.ndarray, np.ndarray]
+        """
+        pair, rem = np.divmod(np.asarray(lattice_ids, dtype=np.int64) - 1, self.n_rows.sum())
+        first = self.n_rows[self.parity0]
+        second = rem >= first
+        return (2 * pair + second, rem - second * first)
+
+    def to_grid_id(self, lattice_ids: np.ndarray) -> np.ndarray:
+        """Convert lattice ids to the GRID_IDs of the grid.
+
+        :param lattice_ids: The lattice ids.
+        :type lattice_ids: np.ndarray
+        :return: The GRID_IDs, 0 for hexagons that are not part of the grid.
+        :rtype: np.ndarray
+        """
+        lattice_ids = np.asarray(lattice_ids, dtype=np.int64)
+        if self.ids is None:
+            return lattice_ids
+        if not len(self.ids):
+            return np.zeros_like(lattice_ids)
+        pos = np.clip(np.searchsorted(self.ids, lattice_ids), 0, len(self.ids) - 1)
+        return np.where((self.ids[pos] == lattice_ids) & (lattice_ids > 0), pos + 1, 0)
+
+    def to_lattice_id(self, grid_ids: np.ndarray) -> np.ndarray:
+        """Convert GRID_IDs of the grid to lattice ids.
+
+        :param grid_ids: The GRID_IDs.
+        :type grid_ids: np.ndarray
+        :return: The lattice ids.
+        :rtype: np.ndarray
+        """
+        grid_ids = np.asarray(grid_ids, dtype=np.int64)
+        return grid_ids if self.ids is None else self.ids[grid_ids - 1]
+
+    def column_centers(self, start: int = 0, stop: int = None) -> tuple[np.ndarray, np.ndarray]:
+        """Return the centers of all hexagons in a range of columns, column by column,
+        bottom to top.
+
+        :param start: The first column, defaults to 0.
+        :type start: int, optional
+        :param stop: The column to stop before, defaults to None for the last column.
+        :type stop: int, optional
+        :return: The x and y coordinate arrays of the hexagon centers.
+        :rtype: tuple[np.ndarray, np.ndarray]
+        """
+        col_x = self.col_x[start:stop]
+        parity = self.parity(np.arange(start, start + len(col_x)))
+        x = np.repeat(col_x, self.n_rows[parity])
+        y = np.concatenate([self.rows[p] for p in parity]) if len(col_x) else np.empty(0)
+        return (x, y)
+
+    def centers(self, grid_ids: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        """Return the centers of hexagons in the grid.
+
+        :param grid_ids: The GRID_IDs, defaults to None for all hexagons in GRID_ID order.
+        :type grid_ids: np.ndarray, optional
+        :return: The x and y coordinate arrays of the hexagon centers.
+        :rtype: tuple[np.ndarray, np.ndarray]
+        """
+        if grid_ids is None and self.ids is None:
+            return self.column_centers()
+        lattice_ids = self.ids if grid_ids is None else self.to_lattice_id(grid_ids)
+        cols, rows = self.lattice_id_to_cell(lattice_ids)
+        parity = self.parity(cols)
+        y = np.empty(len(cols))
+        for p in (0, 1):
+            sel = parity == p
+            y[sel] = self.rows[p][rows[sel]]
+        return (self.col_x[cols], y)
+
+    def point_to_cell(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Find the (col, row) of the hexagon containing each point. Hexagons are the
+        Voronoi cells of the lattice centers, so the nearest center in the two columns
+        either side of the point is the containing hexagon.
+
+        :param x: The x coordinates of the points.
+        :type x: np.ndarray
+        :param y: The y coordinates of the points.
+        :type y: np.ndarray
+        :return: The column and row numbers, -1 for points outside the lattice.
+        :rtype: tuple[np.ndarray, np.ndarray]
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if not self.n_cols:
+            return (np.full(x.shape, -1), np.full(x.shape, -1))
+        x0 = self.col_x[0]
+        y0 = np.array([r[0] if len(r) else np.nan for r in self.rows])
+        c0 = np.floor((x - x0) / self.h_step)
+        c0 = np.where(np.isfinite(c0), c0, -2).astype(np.int64)
+
+        best_d = np.full(x.shape, np.inf)
+        best_c = np.full(x.shape, -1, dtype=np.int64)
+        best_r = np.full(x.shape, -1, dtype=np.int64)
+        for c in (c0, c0 + 1):
+            start = y0[self.parity(c)]
+            r = np.rint((y - start) / self.v_step)
+            r = np.where(np.isfinite(r), r, -1).astype(np.int64)
+            d = (x - (x0 + c * self.h_step)) ** 2 + (y - (start + r * self.v_step)) ** 2
+            take = d < best_d
+            best_d = np.where(take, d, best_d)
+            best_c = np.where(take, c, best_c)
+            best_r = np.where(take, r, best_r)
+
+        outside = self.cell_to_lattice_id(best_c, best_r) == 0
+        return (np.where(outside, -1, best_c), np.where(outside, -1, best_r))
+
+    def point_to_grid_id(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Find the GRID_ID of the hexagon containing each point.
+
+        :param x: The x coordinates of the points.
+        :type x: np.ndarray
+        :param y: The y coordinates of the points.
+        :type y: np.ndarray
+        :return: The GRID_IDs, 0 for points outside the grid.
+        :rtype: np.ndarray
+        """
+        return self.to_grid_id(self.cell_to_lattice_id(*self.point_to_cell(x, y)))
+
+    def bbox_to_lattice_ids(
+        self, bounds: np.ndarray, col_range: tuple[int, int] = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Expand bounding boxes to the lattice ids of every hexagon whose own bounding
+        box intersects them. Each box covers a contiguous range of rows in each of a
+        contiguous range of columns, so the candidates are calculated directly.
+
+        :param bounds: The bounding boxes as an (n, 4) array of (xmin, ymin, xmax, ymax).
+        :type bounds: np.ndarray
+        :param col_range: Only return hexagons in the columns [start, stop), defaults to None for all.
+        :type col_range: tuple[int, int], optional
+        :return: The index of the bounding box and the lattice id for each candidate pair.
+        :rtype: tuple[np.ndarray, np.ndarray]
+        """
+        bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+        start, stop = col_range if col_range else (0, self.n_cols)
+        box_idx = np.flatnonzero(~np.isnan(bounds).any(axis=1))
+        if not self.n_cols or not len(box_idx):
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        bounds = bounds[box_idx]
+        eps = self.side * 1e-9
+
+        # contiguous range of columns for each box
+        x0 = self.col_x[0]
+        c_lo = np.ceil((bounds[:, 0] - self.side - eps - x0) / self.h_step)
+        c_hi = np.floor((bounds[:, 2] + self.side + eps - x0) / self.h_step)
+        c_lo = np.maximum(c_lo, start).astype(np.int64)
+        c_hi = np.minimum(c_hi, stop - 1).astype(np.int64)
+        n = np.maximum(c_hi - c_lo + 1, 0)
+        box = np.repeat(np.arange(len(bounds)), n)
+        cols = np.repeat(c_lo, n) + _ramp(n)
+
+        # contiguous range of rows in each column
+        parity = self.parity(cols)
+        y0 = np.array([r[0] if len(r) else 0.0 for r in self.rows])[parity]
+        half = self.v_step / 2.0
+        r_lo = np.ceil((bounds[box, 1] - half - eps - y0) / self.v_step)
+        r_hi = np.floor((bounds[box, 3] + half + eps - y0) / self.v_step)
+        r_lo = np.maximum(r_lo, 0).astype(np.int64)
+        r_hi = np.minimum(r_hi, self.n_rows[parity] - 1).astype(np.int64)
+        m = np.maximum(r_hi - r_lo + 1, 0)
+        rows = np.repeat(r_lo, m) + _ramp(m)
+        cols = np.repeat(cols, m)
+        box = np.repeat(box, m)
+
+        return (box_idx[box], self.column_offsets(cols) + rows + 1)
+
+    def query(self, geoms: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Find the candidate hexagons of the grid for each geometry from its bounding box,
+        the lattice equivalent of an STRtree query without a predicate.
+
+        :param geoms: The geometries to find candidate hexagons for.
+        :type geoms: np.ndarray
+        :return: The index of the geometry and the GRID_ID for each candidate pair.
+        :rtype: tuple[np.ndarray, np.ndarray]
+        """
+        geom_idx, lattice_ids = self.bbox_to_lattice_ids(shapely.bounds(np.asarray(geoms, dtype=object)))
+        grid_ids = self.to_grid_id(lattice_ids)
+        keep = grid_ids > 0
+        return (geom_idx[keep], grid_ids[keep])
+
+    def subset(self, mask: np.ndarray) -> "HexLattice":
+        """Return the lattice index for the grid made of the hexagons selected by mask,
+        renumbered from 1 in GRID_ID order.
+
+        :param mask: A boolean mask over the hexagons of the grid in GRID_ID order.
+        :type mask: np.ndarray
+        :return: The lattice index of the selected hexagons.
+        :rtype: HexLattice
+        """
+        ids = np.arange(1, self.size + 1) if self.ids is None else self.ids
+        return HexLattice(self.side, self.col_x, self.rows, self.parity0, ids[mask])
+
+
+def hexgrid_centers(bbx, area: float) -> tuple[np.ndarray, np.ndarray, float]:
+    """Calculate the centers of all hexagons covering the bounding box as arrays.
+    The centers are ordered column by column, bottom to top, exactly like the
+    centers of the original per cell grid code, so the GRID_ID numbering is unchanged.
+
+    :param bbx: The bounding box as (xmin, ymin, xmax, ymax).
+    :type bbx: array_like
+    :param area: The area of each hexagon.
+    :type area: float
+    :return: The x and y coordinate arrays of the hexagon centers, and the hexagon edge length.
+    :rtype: tuple[np.ndarray, np.ndarray, float]
+    """
+    lattice = HexLattice.from_bounds(bbx, area)
+    x, y = lattice.column_centers()
+    return (x, y, lattice.side)
+
+
+def hexagons(x: np.ndarray, y: np.ndarray, side: float) -> np.ndarray:
+    """Build the hexagon polygons for all centers in a single vectorized shapely call.
+
+    :param x: The x coordinates of the hexagon centers.
+    :type x: np.ndarray
+    :param y: The y coordinates of the hexagon centers.
+    :type y: np.ndarray
+    :param side: The length of the hexagon's edge.
+    :type side: float
+    :return: An array of shapely polygons.
+    :rtype: np.ndarray
+    """
+    coords = np.empty((len(x), 6, 2))
+    coords[:, :, 0] = x[:, None] + HEX_UNIT_OFFSETS[:, 0] * side
+    coords[:, :, 1] = y[:, None] + HEX_UNIT_OFFSETS[:, 1] * side
+    return shapely.polygons(coords)
+
+
+def shape_parts(shapes: np.ndarray) -> np.ndarray:
+    """Split the shapes into prepared single part geometries for use with shape_mask().
+    Missing and empty geometries are dropped.
+
+    :param shapes: The shapes to split.
+    :type shapes: np.ndarray
+    :return: The prepared single part geometries.
+    :rtype: np.ndarray
+    """
+    shapes = np.asarray(shapes, dtype=object)
+    shapes = shapes[~(shapely.is_missing(shapes) | shapely.is_empty(shapes))]
+    # split multipart shapes so each part has a tight bounding box
+    parts = shapely.get_parts(shapes)
+    shapely.prepare(parts)
+    return parts
+
+
+def shape_mask(
+    x: np.ndarray, y: np.ndarray, side: float, parts: np.ndarray, candidates: tuple[np.ndarray, np.ndarray]
+) -> np.ndarray:
+    """Find the hexagons that intersect any of the shape parts, without clipping any geometry.
+    Candidate (shape part, hexagon) pairs normally come from the lattice index. Hexagons whose
+    center lies inside a prepared shape part are accepted with a cheap point test, only the
+    remaining candidates on the shape boundary are built as polygons for an exact intersects test.
+
+    :param x: The x coordinates of the hexagon centers.
+    :type x: np.ndarray
+    :param y: The y coordinates of the hexagon centers.
+    :type y: np.ndarray
+    :param side: The length of the hexagon's edge.
+    :type side: float
+    :param parts: The prepared shape parts returned by shape_parts().
+    :type parts: np.ndarray
+    :param candidates: The shape part index and hexagon index of each candidate pair.
+    :type candidates: tuple[np.ndarray, np.ndarray]
+    :return: A boolean mask that is True for every hexagon intersecting a shape.
+    :rtype: np.ndarray
+    """
+    mask = np.zeros(len(x), dtype=bool)
+    if not len(parts) or not len(x):
+        return mask
+    part_idx, hex_idx = candidates
+
+    # a hexagon whose center is inside the shape intersects it
+    inside = shapely.contains_xy(parts[part_idx], x[hex_idx], y[hex_idx])
+    mask[hex_idx[inside]] = True
+
+    # exact test only for boundary candidates not already accepted
+    check = ~inside & ~mask[hex_idx]
+    part_idx, hex_idx = part_idx[check], hex_idx[check]
+    hits = shapely.intersects(parts[part_idx], hexagons(x[hex_idx], y[hex_idx], side))
+    mask[hex_idx[hits]] = True
+
+    return mask
+
+
+class PlanningGrid:
+    """Compact planning unit grid generated on a hexagon lattice. Only the float64 hexagon
+    center arrays and the lattice index are stored, the GRID_ID of each hexagon is its
+    position in the arrays plus 1. Polygons are built on demand, in chunks, when a
+    consumer such as plotting, saving or the overlap calculation needs them.
+    """
+
+    __slots__ = ("x", "y", "lattice", "crs", "name")
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, lattice: HexLattice, crs, name: str = ""):
+        """Create the planning grid, normally done with :meth:`from_bounds`.
+
+        :param x: The x coordinates of the hexagon centers in GRID_ID order.
+        :type x: np.ndarray
+        :param y: The y coordinates of the hexagon centers in GRID_ID order.
+        :type y: np.ndarray
+        :param lattice: The lattice index of the grid.
+        :type lattice: HexLattice
+        :param crs: The CRS of the grid.
+        :type crs: any
+        :param name: The name of the grid, defaults to "".
+        :type name: str, optional
+        """
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.lattice = lattice
+        self.crs = crs
+        self.name = name
+
+    @classmethod
+    def from_bounds(cls, bbx, area: float, crs, shapes: np.ndarray = None) -> "PlanningGrid":
+        """Create the planning grid covering the bounding box. If shapes are given only
+        the hexagons intersecting the shapes are kept.
+
+        :param bbx: The bounding box as (xmin, ymin, xmax, ymax).
+        :type bbx: array_like
+        :param area: The area of each hexagon.
+        :type area: float
+        :param crs: The CRS of the grid.
+        :type crs: any
+        :param shapes: The shapes to select the hexagons with, defaults to None.
+        :type shapes: np.ndarray, optional
+        :return: The planning grid.
+        :rtype: PlanningGrid
+        """
+        lattice = HexLattice.from_bounds(bbx, area)
+        x, y = lattice.column_centers()
+        grid = cls(x, y, lattice, crs)
+        if shapes is not None:
+            parts = shape_parts(shapes)
+            part_idx, lattice_ids = lattice.bbox_to_lattice_ids(shapely.bounds(parts))
+            grid = grid.subset(shape_mask(x, y, lattice.side, parts, (part_idx, lattice_ids - 1)))
+        return grid
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    @property
+    def empty(self) -> bool:
+        """True if the grid has no hexagons."""
+        return not len(self.x)
+
+    @property
+    def side(self) -> float:
+        """The length of the hexagon's edge."""
+        return self.lattice.side
+
+    @property
+    def puids(self) -> np.ndarray:
+        """The GRID_ID of every hexagon."""
+        return np.arange(1, len(self.x) + 1)
+
+    @property
+    def total_bounds(self) -> np.ndarray:
+        """The bounds of all hexagons as (xmin, ymin, xmax, ymax)."""
+        if self.empty:
+            return np.full(4, np.nan)
+        half = self.lattice.v_step / 2.0
+        return np.array([self.x.min() - self.side, self.y.min() - half, self.x.max() + self.side, self.y.max() + half])
+
+    def geometry(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """Build the hexagon polygons for a range of the grid.
+
+        :param start: The index of the first hexagon, defaults to 0.
+        :type start: int, optional
+        :param stop: The index to stop before, defaults to None for the end of the grid.
+        :type stop: int, optional
+        :return: An array of shapely polygons.
+        :rtype: np.ndarray
+        """
+        return hexagons(self.x[start:stop], self.y[start:stop], self.side)
+
+    def iter_chunks(self, chunk_size: int = GRID_TILE_SIZE) -> Iterator[gpd.GeoDataFrame]:
+        """Materialize the grid as GeoDataFrames of at most chunk_size hexagons at a time.
+
+        :param chunk_size: The maximum number of hexagons per chunk, defaults to GRID_TILE_SIZE.
+        :type chunk_size: int, optional
+        :yield: The planning unit grid chunks with the GRID_ID column.
+        :rtype: Iterator[gpd.GeoDataFrame]
+        """
+        for start in range(0, len(self.x), chunk_size):
+            stop = min(start + chunk_size, len(self.x))
+            chunk = gpd.GeoDataFrame({PUID: np.arange(start + 1, stop + 1)}, geometry=self.geometry(start, stop), crs=self.crs)
+            chunk.index = pd.RangeIndex(start, stop)
+            yield chunk
+
+    def take(self, index: np.ndarray) -> gpd.GeoDataFrame:
+        """Materialize the hexagons at the given positions as a GeoDataFrame.
+
+        :param index: The positions of the hexagons in the grid.
+        :type index: np.ndarray
+        :return: The selected hexagons with the GRID_ID column, indexed by position, with the
+                 lattice attribute set.
+        :rtype: gpd.GeoDataFrame
+        """
+        index = np.asarray(index, dtype=np.int64)
+        hexes = hexagons(self.x[index], self.y[index], self.side)
+        gdf = gpd.GeoDataFrame({PUID: index + 1}, geometry=hexes, index=index, crs=self.crs)
+        gdf.lattice = self.lattice
+        return gdf
+
+    def to_gdf(self) -> gpd.GeoDataFrame:
+        """Materialize the whole grid as a GeoDataFrame, with the name and lattice attributes set.
+
+        :return: The planning unit grid.
+        :rtype: gpd.GeoDataFrame
+        """
+        gdf = gpd.GeoDataFrame(geometry=self.geometry(), crs=self.crs)
+        gdf[PUID] = gdf.index + 1
+        gdf.name = self.name
+        gdf.lattice = self.lattice
+        return gdf
+
+    def subset(self, mask: np.ndarray) -> "PlanningGrid":
+        """Return the grid made of the hexagons selected by mask, renumbered from 1 in GRID_ID order.
+
+        :param mask: A boolean mask over the hexagons of the grid.
+        :type mask: np.ndarray
+        :return: The selected planning grid.
+        :rtype: PlanningGrid
+        """
+        return PlanningGrid(self.x[mask], self.y[mask], self.lattice.subset(mask), self.crs, self.name)
+
+
+def grid_gdf(grid: PlanningGrid | gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Return the planning unit grid as a GeoDataFrame, materializing a PlanningGrid.
+
+    :param grid: The planning unit grid.
+    :type grid: PlanningGrid | gpd.GeoDataFrame
+    :return: The planning unit grid as a GeoDataFrame.
+    :rtype: gpd.GeoDataFrame
+    """
+    return grid.to_gdf() if isinstance(grid, PlanningGrid) else grid
+
+
+def grid_centers(grid: PlanningGrid | gpd.GeoDataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """Return the center of each planning unit, the bounding box center for grids loaded from file.
+
+    :param grid: The planning unit grid.
+    :type grid: PlanningGrid | gpd.GeoDataFrame
+    :return: The x and y coordinate arrays of the planning unit centers.
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    if isinstance(grid, PlanningGrid):
+        return (grid.x, grid.y)
+    bounds = shapely.bounds(np.asarray(grid.geometry.values))
+    return ((bounds[:, 0] + bounds[:, 2]) / 2.0, (bounds[:, 1] + bounds[:, 3]) / 2.0)
+
+
+def grid_take(grid: PlanningGrid | gpd.GeoDataFrame, index: np.ndarray) -> gpd.GeoDataFrame:
+    """Return the planning units at the given positions as a GeoDataFrame.
+
+    :param grid: The planning unit grid.
+    :type grid: PlanningGrid | gpd.GeoDataFrame
+    :param index: The positions of the planning units in the grid.
+    :type index: np.ndarray
+    :return: The selected planning units.
+    :rtype: gpd.GeoDataFrame
+    """
+    return grid.take(index) if isinstance(grid, PlanningGrid) else grid.iloc[index]
+
+
+def build_hexgrid(bbx, area: float, crs, shapes: np.ndarray = None) -> gpd.GeoDataFrame:
+    """Create a hexagonal planning unit grid covering the bounding box as a GeoDataFrame.
+    If shapes are given only the hexagons intersecting the shapes are kept. A unique
+    GRID_ID starting at 1 is assigned to each hexagon. The lattice index of the grid
+    is kept with it as the lattice attribute.
+
+    :param bbx: The bounding box as (xmin, ymin, xmax, ymax).
+    :type bbx: array_like
+    :param area: The area of each hexagon.
+    :type area: float
+    :param crs: The CRS of the grid.
+    :type crs: any
+    :param shapes: The shapes to select the hexagons with, defaults to None.
+    :type shapes: np.ndarray, optional
+    :return: The planning unit grid.
+    :rtype: gpd.GeoDataFrame
+    """
+    return PlanningGrid.from_bounds(bbx, area, crs, shapes).to_gdf()
+
+
+def iter_hexgrid_tiles(
+    bbx, area: float, crs, shapes: np.ndarray = None, tile_size: int = GRID_TILE_SIZE
+) -> Iterator[gpd.GeoDataFrame]:
+    """Generate the planning unit grid in tiles instead of all at once. Each tile is a
+    band of whole lattice columns holding roughly tile_size hexagons. Bands follow the
+    column by column GRID_ID order, so the GRID_ID of every hexagon, including the
+    renumbered ids of a grid clipped to shapes, is the same as from build_hexgrid().
+    Only one tile of polygons is held in memory at a time.
+
+    :param bbx: The bounding box as (xmin, ymin, xmax, ymax).
+    :type bbx: array_like
+    :param area: The area of each hexagon.
+    :type area: float
+    :param crs: The CRS of the grid.
+    :type crs: any
+    :param shapes: The shapes to select the hexagons with, defaults to None.
+    :type shapes: np.ndarray, optional
+    :param tile_size: The approximate number of hexagons per tile, defaults to GRID_TILE_SIZE.
+    :type tile_size: int, optional
+    :yield: The planning unit grid tiles.
+    :rtype: Iterator[gpd.GeoDataFrame]
+    """
+    lattice = HexLattice.from_bounds(bbx, area)
+    if shapes is not None:
+        parts = shape_parts(shapes)
+        part_bounds = shapely.bounds(parts)
+    cols_per_tile = max(1, tile_size // max(lattice.n_rows.max(), 1))
+    next_id = 1
+
+    for start in range(0, lattice.n_cols, cols_per_tile):
+        stop = min(start + cols_per_tile, lattice.n_cols)
+        x, y = lattice.column_centers(start, stop)
+        hexes = hexagons(x, y, lattice.side)
+        if shapes is not None:
+            part_idx, lattice_ids = lattice.bbox_to_lattice_ids(part_bounds, (start, stop))
+            hex_idx = lattice_ids - 1 - lattice.column_offsets(start)
+            hexes = hexes[shape_mask(x, y, lattice.side, parts, (part_idx, hex_idx))]
+        tile = gpd.GeoDataFrame(geometry=hexes, crs=crs)
+        tile[PUID] = np.arange(next_id, next_id + len(hexes))
+        next_id += len(hexes)
+        yield tile
+
+
+def write_hexgrid_gpkg(
+    file_name: str,
+    bbx,
+    area: float,
+    crs,
+    shapes: np.ndarray = None,
+    layer: str = None,
+    tile_size: int = GRID_TILE_SIZE,
+) -> int:
+    """Stream the planning unit grid tile by tile into a GeoPackage layer. Each tile is
+    appended to the layer as soon as it is generated, so peak memory is bounded by the
+    tile size rather than by the extent of the grid.
+
+    :param file_name: The GeoPackage file to write to. An existing layer is overwritten.
+    :type file_name: str
+    :param bbx: The bounding box as (xmin, ymin, xmax, ymax).
+    :type bbx: array_like
+    :param area: The area of each hexagon.
+    :type area: float
+    :param crs: The CRS of the grid.
+    :type crs: any
+    :param shapes: The shapes to select the hexagons with, defaults to None.
+    :type shapes: np.ndarray, optional
+    :param layer: The name of the layer, defaults to None which uses the file name.
+    :type layer: str, optional
+    :param tile_size: The approximate number of hexagons per tile, defaults to GRID_TILE_SIZE.
+    :type tile_size: int, optional
+    :return: The number of hexagons written.
+    :rtype: int
+    """
+    written = 0
+    for tile in iter_hexgrid_tiles(bbx, area, crs, shapes, tile_size):
+        if tile.empty:
+            continue
+        tile.to_file(file_name, layer=layer, driver=GPKG_DRIVER, mode="a" if written else "w")
+        written += len(tile)
+    return written
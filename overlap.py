@@ -0,0 +1,1354 @@
+# -*- coding: utf-8 -*-
+"""
+overlap.py
+
+This file contains the overlap engine used by the planning.py script to calculate
+the area of each conservation feature within each planning unit
+"""
+
+# import modules
+from defs import *
+from os import environ, makedirs, listdir, path, replace
+environ["USE_PYGEOS"] = "0"
+import hashlib
+import weakref
+import numpy as np
+import shapely
+import pandas as pd
+import geopandas as gpd
+from cache import DiskCache
+from hexgrid import HexLattice, hexagons, _ramp
+
+
+def candidate_pairs(
+    hexes: np.ndarray, features: np.ndarray, lattice: HexLattice = None, grid_ids: np.ndarray = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Find every (hexagon, feature) pair that intersects. The hexagons of a generated grid in
+    its bounding box are found for each feature by :meth:`~hexgrid.HexLattice.query` with
+    arithmetic only, the hexagons of other grids with one bulk STRtree query built over the
+    hexagons. Each feature is then tested against the hexagons in its bounding box.
+
+    :param hexes: The planning unit polygons.
+    :type hexes: np.ndarray
+    :param features: The conservation feature geometries.
+    :type features: np.ndarray
+    :param lattice: The lattice of the generated grid the hexagons are taken from, defaults to None.
+    :type lattice: HexLattice, optional
+    :param grid_ids: The GRID_ID of each hexagon, needed with a lattice, defaults to None.
+    :type grid_ids: np.ndarray, optional
+    :return: The hexagon index and feature index of each intersecting pair.
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    if lattice is None:
+        tree = shapely.STRtree(hexes)
+        feature_idx, hex_idx = tree.query(features, predicate="intersects")
+        return (hex_idx, feature_idx)
+    feature_idx, candidate_ids = lattice.query(features)
+    # keep the candidates that are among the given hexagons
+    order = np.argsort(grid_ids, kind="stable")
+    sorted_ids = np.asarray(grid_ids)[order]
+    found = np.clip(np.searchsorted(sorted_ids, candidate_ids), 0, max(len(sorted_ids) - 1, 0))
+    given = sorted_ids[found] == candidate_ids if len(sorted_ids) else np.zeros(len(candidate_ids), dtype=bool)
+    hex_idx, feature_idx = order[found[given]], feature_idx[given]
+    hit = shapely.intersects(features[feature_idx], hexes[hex_idx])
+    return (hex_idx[hit], feature_idx[hit])
+
+
+def grid_lattice(grid: gpd.GeoDataFrame) -> HexLattice | None:
+    """Get the lattice of a generated grid materialized by :meth:`~hexgrid.PlanningGrid.take` or
+    :meth:`~hexgrid.PlanningGrid.to_gdf`, whose GRID_IDs index the lattice.
+
+    :param grid: The planning unit grid.
+    :type grid: gpd.GeoDataFrame
+    :return: The lattice, or None for grids loaded from file or changed since.
+    :rtype: HexLattice | None
+    """
+    lattice = getattr(grid, "lattice", None)
+    if not isinstance(lattice, HexLattice) or PUID not in grid.columns or grid[PUID].dtype.kind not in "iu":
+        return None
+    return lattice
+
+
+def _pair_frame(grid: gpd.GeoDataFrame, layer: gpd.GeoDataFrame, hex_idx: np.ndarray, feature_idx: np.ndarray) -> pd.DataFrame:
+    """Build the attribute columns of the intersection rows, grid columns first then layer
+    columns, with the same _1 and _2 suffixes gpd.overlay adds to shared column names.
+
+    :param grid: The planning unit grid.
+    :type grid: gpd.GeoDataFrame
+    :param layer: The conservation layer.
+    :type layer: gpd.GeoDataFrame
+    :param hex_idx: The position of the planning unit of each row.
+    :type hex_idx: np.ndarray
+    :param feature_idx: The position of the conservation feature of each row.
+    :type feature_idx: np.ndarray
+    :return: The attribute columns of the rows.
+    :rtype: pd.DataFrame
+    """
+    left = pd.DataFrame(grid.drop(columns=grid.geometry.name)).iloc[hex_idx].reset_index(drop=True)
+    right = pd.DataFrame(layer.drop(columns=layer.geometry.name)).iloc[feature_idx].reset_index(drop=True)
+    common = set(left.columns) & set(right.columns)
+    left = left.rename(columns={c: f"{c}_1" for c in common})
+    right = right.rename(columns={c: f"{c}_2" for c in common})
+    return pd.concat([left, right], axis=1)
+
+
+def overlap_pairs(
+    hexes: np.ndarray,
+    features: np.ndarray,
+    cell_area: float = None,
+    geometries: bool = False,
+    prepare: bool = True,
+    lattice: HexLattice = None,
+    grid_ids: np.ndarray = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Find the overlapping (planning unit, feature) pairs and their area of overlap. Candidate
+    pairs come from :func:`~candidate_pairs` and the intersections and areas are calculated in vectorized
+    shapely calls. Planning units that lie completely inside a feature are found with a prepared
+    containment test and take the planning unit area directly, the exact intersection only runs
+    for planning units on a feature boundary.
+
+    :param hexes: The planning unit polygons.
+    :type hexes: np.ndarray
+    :param features: The conservation feature geometries.
+    :type features: np.ndarray
+    :param cell_area: The area of every planning unit when they are all the same size, such as
+                      a lattice grid, defaults to None which calculates the area of each unit.
+    :type cell_area: float, optional
+    :param geometries: Also return the intersection geometries, defaults to False.
+    :type geometries: bool, optional
+    :param prepare: Prepare the features and keep them prepared for later calls, defaults to True.
+                    GEOS builds the internals of a prepared geometry lazily on first use, so
+                    features shared by several threads must not be prepared. Each test then
+                    prepares a temporary copy of the feature in the calling thread.
+    :type prepare: bool, optional
+    :param lattice: The lattice of a generated grid, see :func:`~candidate_pairs`, defaults to None.
+    :type lattice: HexLattice, optional
+    :param grid_ids: The GRID_ID of each planning unit, needed with a lattice, defaults to None.
+    :type grid_ids: np.ndarray, optional
+    :return: The planning unit index, feature index and area of each overlapping pair, and the
+             intersection geometries, or None if geometries is False.
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+    """
+    if prepare:
+        shapely.prepare(features)
+    hex_idx, feature_idx = candidate_pairs(hexes, features, lattice, grid_ids)
+
+    # planning units fully inside a feature are their own intersection
+    inside = shapely.contains_properly(features[feature_idx], hexes[hex_idx])
+    boundary = ~inside
+
+    geometry = hexes[hex_idx]
+    area = np.empty(len(hex_idx))
+    area[inside] = cell_area if cell_area else shapely.area(geometry[inside])
+    geometry[boundary] = shapely.intersection(geometry[boundary], features[feature_idx[boundary]])
+    area[boundary] = shapely.area(geometry[boundary])
+
+    # pairs that only touch along an edge or at a point have no area
+    keep = area > 0
+    hex_idx, feature_idx, area = hex_idx[keep], feature_idx[keep], area[keep]
+    if not geometries:
+        return (hex_idx, feature_idx, area, None)
+    geometry = geometry[keep]
+
+    # like gpd.overlay only the polygonal parts of mixed geometry collections are kept
+    collections = np.flatnonzero(shapely.get_type_id(geometry) == 7)
+    if len(collections):
+        parts, idx = shapely.get_parts(geometry[collections], return_index=True)
+        parts, sub_idx = shapely.get_parts(parts, return_index=True)
+        idx = idx[sub_idx]
+        polygons = shapely.get_type_id(parts) == 3
+        geometry[collections] = shapely.multipolygons(parts[polygons], indices=idx[polygons])
+
+    return (hex_idx, feature_idx, area, geometry)
+
+
+def valid_features(features: np.ndarray) -> np.ndarray:
+    """Make the invalid feature geometries valid, like gpd.overlay does before it intersects, so a
+    self-intersecting ring does not give a wrong containment test or intersection. Only the
+    polygonal parts of a repaired feature are kept, the repair can leave lines where a ring
+    touched itself. Valid features are returned as they are.
+
+    :param features: The conservation feature geometries.
+    :type features: np.ndarray
+    :return: The features, with the invalid ones replaced by valid polygons.
+    :rtype: np.ndarray
+    """
+    features = np.asarray(features)
+    invalid = np.flatnonzero(~shapely.is_valid(features) & ~shapely.is_missing(features))
+    if not len(invalid):
+        return features
+    features = features.copy()
+    repaired = shapely.make_valid(features[invalid])
+    parts, idx = shapely.get_parts(repaired, return_index=True)
+    parts, sub_idx = shapely.get_parts(parts, return_index=True)
+    idx = idx[sub_idx]
+    polygons = shapely.get_type_id(parts) == 3
+    # a feature without any polygonal part is left empty
+    empty = np.full(len(invalid), shapely.MultiPolygon(), dtype=object)
+    repaired = shapely.multipolygons(parts[polygons], indices=idx[polygons], out=empty)
+    features[invalid] = repaired
+    return features
+
+
+def split_features(features: np.ndarray, max_vertices: int = OVERLAP_MAX_VERTICES) -> tuple[np.ndarray, np.ndarray]:
+    """Split the features with more than max_vertices vertices into axis aligned pieces, so a
+    planning unit is never intersected with a whole detailed coastline. Each heavy feature is
+    halved across the longer side of its bounding box with a rectangle clip, which only walks the
+    vertices once, until every piece is small enough. The pieces cover the feature exactly so the
+    area of overlap of a planning unit is the sum of the areas of overlap of the pieces.
+
+    :param features: The conservation feature geometries.
+    :type features: np.ndarray
+    :param max_vertices: The most vertices of a piece, defaults to OVERLAP_MAX_VERTICES.
+    :type max_vertices: int, optional
+    :return: The features and pieces, and the position of the feature of each.
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    features = np.asarray(features)
+    heavy = shapely.get_num_coordinates(features) > max_vertices
+    if not max_vertices or not heavy.any():
+        return (features, np.arange(len(features)))
+
+    pieces = [features[~heavy]]
+    source = [np.flatnonzero(~heavy)]
+    todo = features[heavy]
+    todo_source = np.flatnonzero(heavy)
+    for _ in range(OVERLAP_MAX_SPLIT_DEPTH):
+        # halve each piece across the longer side of its bounding box, clip_by_rect only takes
+        # one rectangle at a time but there are only a few heavy pieces
+        halves = np.empty(2 * len(todo), dtype=object)
+        for i, (piece, (xmin, ymin, xmax, ymax)) in enumerate(zip(todo, shapely.bounds(todo))):
+            if xmax - xmin >= ymax - ymin:
+                xmid = (xmin + xmax) / 2
+                halves[i] = shapely.clip_by_rect(piece, xmin, ymin, xmid, ymax)
+                halves[len(todo) + i] = shapely.clip_by_rect(piece, xmid, ymin, xmax, ymax)
+            else:
+                ymid = (ymin + ymax) / 2
+                halves[i] = shapely.clip_by_rect(piece, xmin, ymin, xmax, ymid)
+                halves[len(todo) + i] = shapely.clip_by_rect(piece, xmin, ymid, xmax, ymax)
+        # keep only the polygons, the cut line can leave slivers of lines or points
+        parts, part_idx = shapely.get_parts(halves, return_index=True)
+        polygons = shapely.get_type_id(parts) == 3
+        parts = parts[polygons]
+        part_source = np.concatenate([todo_source, todo_source])[part_idx[polygons]]
+        done = shapely.get_num_coordinates(parts) <= max_vertices
+        pieces.append(parts[done])
+        source.append(part_source[done])
+        todo, todo_source = parts[~done], part_source[~done]
+        if not len(todo):
+            break
+    pieces.append(todo)
+    source.append(todo_source)
+    return (np.concatenate(pieces), np.concatenate(source))
+
+
+def merge_pieces(
+    hex_idx: np.ndarray, feature_idx: np.ndarray, area: np.ndarray, geometry: np.ndarray = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Merge the overlap of the pieces of a feature with a planning unit into one overlap,
+    adding up the areas and merging the intersection geometries.
+
+    :param hex_idx: The planning unit index of each overlap.
+    :type hex_idx: np.ndarray
+    :param feature_idx: The feature index of each overlap.
+    :type feature_idx: np.ndarray
+    :param area: The area of each overlap.
+    :type area: np.ndarray
+    :param geometry: The intersection geometry of each overlap, defaults to None.
+    :type geometry: np.ndarray, optional
+    :return: The planning unit index, feature index, area and geometry, or None, of each
+             distinct (planning unit, feature) pair.
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+    """
+    order = np.lexsort((hex_idx, feature_idx))
+    hex_idx, feature_idx, area = hex_idx[order], feature_idx[order], area[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (hex_idx[1:] != hex_idx[:-1]) | (feature_idx[1:] != feature_idx[:-1])
+    if first.all():
+        return (hex_idx, feature_idx, area, None if geometry is None else geometry[order])
+    group = np.cumsum(first) - 1
+    merged_area = np.bincount(group, weights=area)
+    merged_geometry = None
+    if geometry is not None:
+        geometry = geometry[order]
+        merged_geometry = geometry[first]
+        starts = np.flatnonzero(first)
+        sizes = np.diff(np.append(starts, len(order)))
+        for g in np.flatnonzero(sizes > 1):
+            merged_geometry[g] = shapely.union_all(geometry[starts[g] : starts[g] + sizes[g]])
+    return (hex_idx[first], feature_idx[first], merged_area, merged_geometry)
+
+
+def _lattice_cell_hexes(lattice: HexLattice, cols: np.ndarray, bands: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Find the two hexagons that cover each cell of the lattice cut used by :func:`~lattice_overlap`.
+    Cell (col, band) spans column col's strip from its left vertex to the right end of its top and
+    bottom edges, and half a row from one row center line to the next. The hexagon of column col
+    whose center is on one of the cell's horizontal edges covers all but the triangle in the left
+    corner, which belongs to the hexagon of column col - 1 centered on the other edge.
+
+    :param lattice: The lattice of the planning grid.
+    :type lattice: HexLattice
+    :param cols: The column of each cell.
+    :type cols: np.ndarray
+    :param bands: The half row band of each cell.
+    :type bands: np.ndarray
+    :return: The x and y coordinates of the center of the hexagon of column col, its lattice id,
+             and the lattice id of the hexagon of column col - 1, ids are 0 outside the lattice.
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+    """
+    half = lattice.v_step / 2
+    y0 = np.array([lattice.rows[0][0], lattice.rows[1][0]])
+    band_y0 = y0.min() - half
+    x = lattice.col_x[0] + cols * lattice.h_step
+    y_lo = band_y0 + bands * half
+    parity = lattice.parity(cols)
+    # the bottom edge of the cell is either a row center line of column col or of column col - 1
+    on_center = np.rint((y_lo - y0[parity]) / half).astype(np.int64) % 2 == 0
+    y = np.where(on_center, y_lo, y_lo + half)
+    y_left = np.where(on_center, y_lo + half, y_lo)
+    row = np.rint((y - y0[parity]) / lattice.v_step).astype(np.int64)
+    row_left = np.rint((y_left - y0[1 - parity]) / lattice.v_step).astype(np.int64)
+    return (x, y, lattice.cell_to_lattice_id(cols, row), lattice.cell_to_lattice_id(cols - 1, row_left))
+
+
+def _lattice_cell_ranges(
+    lattice: HexLattice, features: np.ndarray, bounds: np.ndarray = None
+) -> tuple[float, float, np.ndarray, np.ndarray]:
+    """Find the range of lattice cells, see :func:`~_lattice_cell_hexes`, covering each feature.
+
+    :param lattice: The lattice of the planning grid.
+    :type lattice: HexLattice
+    :param features: The conservation feature geometries.
+    :type features: np.ndarray
+    :param bounds: Only cover the features within these bounds, defaults to None for the whole lattice.
+    :type bounds: np.ndarray, optional
+    :return: The x coordinate of the left of column 0's cells, the y coordinate of the bottom of
+             band 0, the index of the features that reach into the lattice, and the first column,
+             last column, first band and last band of the cells of each of them.
+    :rtype: tuple[float, float, np.ndarray, np.ndarray]
+    """
+    h_step = lattice.h_step
+    half = lattice.v_step / 2
+    band_x0 = lattice.col_x[0] - lattice.side
+    band_y0 = min(lattice.rows[0][0], lattice.rows[1][0]) - half
+    n_bands = int(np.ceil((max(lattice.rows[0][-1], lattice.rows[1][-1]) + half - band_y0) / half))
+    limits = np.array([band_x0, band_y0, band_x0 + (lattice.n_cols + 1) * h_step, band_y0 + n_bands * half])
+    if bounds is not None:
+        limits = np.array([max(limits[0], bounds[0]), max(limits[1], bounds[1]), min(limits[2], bounds[2]), min(limits[3], bounds[3])])
+
+    feature_bounds = shapely.bounds(np.asarray(features)).reshape(-1, 4)
+    xmin = np.maximum(feature_bounds[:, 0], limits[0])
+    ymin = np.maximum(feature_bounds[:, 1], limits[1])
+    xmax = np.minimum(feature_bounds[:, 2], limits[2])
+    ymax = np.minimum(feature_bounds[:, 3], limits[3])
+    # missing and empty features have nan bounds and are dropped here
+    todo = np.flatnonzero((xmin < xmax) & (ymin < ymax))
+    cells = np.stack(
+        [
+            np.maximum(np.floor((xmin[todo] - band_x0) / h_step), 0),
+            np.minimum(np.ceil((xmax[todo] - band_x0) / h_step), lattice.n_cols + 1) - 1,
+            np.maximum(np.floor((ymin[todo] - band_y0) / half), 0),
+            np.minimum(np.ceil((ymax[todo] - band_y0) / half), n_bands) - 1,
+        ],
+        axis=1,
+    ).astype(np.int64)
+    return (band_x0, band_y0, todo, cells)
+
+
+def lattice_overlap(
+    lattice: HexLattice, features: np.ndarray, bounds: np.ndarray = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Calculate the area of overlap of the features with the hexagons of a lattice grid by cutting
+    each feature along the lattice once, instead of intersecting it with every hexagon. The lattice
+    is cut into cells of one column strip by half a row, each covered by exactly two hexagons. A
+    feature is halved with rectangle clips along the cell lines, and any part that fills its
+    rectangle is attributed to the hexagons of all its cells arithmetically, so only the cells on
+    the edge of a feature are intersected with a single hexagon. The rest of an edge cell's piece
+    belongs to the other hexagon of the cell.
+
+    :param lattice: The lattice of the planning grid.
+    :type lattice: HexLattice
+    :param features: The conservation feature geometries.
+    :type features: np.ndarray
+    :param bounds: Only calculate the overlap within these bounds, which are widened to whole cells,
+                   defaults to None for the whole lattice.
+    :type bounds: np.ndarray, optional
+    :return: The GRID_ID, feature index and area of overlap of each overlapping pair, sorted by
+             feature and GRID_ID.
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    h_step = lattice.h_step
+    half = lattice.v_step / 2
+    band_x0, band_y0, todo, cells = _lattice_cell_ranges(lattice, features, bounds)
+    pieces = np.asarray(features)[todo]
+    piece_feature = todo
+
+    blocks, block_feature = [], []
+    leaves, leaf_feature, leaf_cells = [], [], []
+    while len(pieces):
+        # one sweep level, every piece is clipped to its cell range at once
+        x0, x1 = band_x0 + cells[:, 0] * h_step, band_x0 + (cells[:, 1] + 1) * h_step
+        y0, y1 = band_y0 + cells[:, 2] * half, band_y0 + (cells[:, 3] + 1) * half
+        # shapely.clip_by_rect only takes scalar bounds, so each piece is clipped to its own rectangle,
+        # which is much faster than an intersection with a box
+        clipped = np.empty(len(pieces), dtype=object)
+        for i, piece in enumerate(pieces):
+            clipped[i] = shapely.clip_by_rect(piece, x0[i], y0[i], x1[i], y1[i])
+        pieces = clipped
+        area = shapely.area(pieces)
+        # a piece that fills its rectangle is split between the hexagons of its cells arithmetically
+        full = area >= (x1 - x0) * (y1 - y0) * (1 - 1e-10)
+        leaf = ~full & (area > 0) & (cells[:, 0] == cells[:, 1]) & (cells[:, 2] == cells[:, 3])
+        blocks.append(cells[full])
+        block_feature.append(piece_feature[full])
+        leaves.append(pieces[leaf])
+        leaf_feature.append(piece_feature[leaf])
+        leaf_cells.append(cells[leaf, ::2])
+
+        # halve the rest across the longer side of their cell range
+        split = ~full & ~leaf & (area > 0)
+        pieces, piece_feature, cells = pieces[split], piece_feature[split], cells[split]
+        by_col = (cells[:, 1] - cells[:, 0] + 1) * h_step >= (cells[:, 3] - cells[:, 2] + 1) * half
+        lo, hi = np.where(by_col, 0, 2), np.where(by_col, 1, 3)
+        rows = np.arange(len(cells))
+        mid = (cells[rows, lo] + cells[rows, hi] + 1) // 2
+        first, second = cells.copy(), cells.copy()
+        first[rows, hi] = mid - 1
+        second[rows, lo] = mid
+        pieces = np.concatenate([pieces, pieces])
+        piece_feature = np.concatenate([piece_feature, piece_feature])
+        cells = np.concatenate([first, second])
+
+    blocks, block_feature = np.concatenate(blocks), np.concatenate(block_feature)
+    leaves, leaf_feature, leaf_cells = np.concatenate(leaves), np.concatenate(leaf_feature), np.concatenate(leaf_cells)
+
+    # the hexagon of the column covers all of a full cell except the triangle in its left corner
+    triangle = lattice.side * half / 4
+    cell_area = h_step * half
+    block_bands = blocks[:, 3] - blocks[:, 2] + 1
+    size = (blocks[:, 1] - blocks[:, 0] + 1) * block_bands
+    offset = _ramp(size)
+    block_bands = np.repeat(block_bands, size)
+    # only the leaves that reach into the triangle left of the column's hexagon need an intersection
+    x, y, _, _ = _lattice_cell_hexes(lattice, leaf_cells[:, 0], leaf_cells[:, 1])
+    hex_area = shapely.area(leaves)
+    cut = shapely.bounds(leaves)[:, 0] < x - lattice.side / 2
+    hex_area[cut] = shapely.area(shapely.intersection(leaves[cut], hexagons(x[cut], y[cut], lattice.side)))
+
+    feature_idx = np.concatenate([np.repeat(block_feature, size), leaf_feature])
+    cols = np.concatenate([np.repeat(blocks[:, 0], size) + offset // block_bands, leaf_cells[:, 0]])
+    bands = np.concatenate([np.repeat(blocks[:, 2], size) + offset % block_bands, leaf_cells[:, 1]])
+    area = np.concatenate(
+        [
+            np.full(size.sum(), cell_area - triangle),
+            hex_area,
+            np.full(size.sum(), triangle),
+            np.maximum(shapely.area(leaves) - hex_area, 0),
+        ]
+    )
+    _, _, lattice_id, left_id = _lattice_cell_hexes(lattice, cols, bands)
+    grid_id = lattice.to_grid_id(np.concatenate([lattice_id, left_id]))
+    feature_idx = np.concatenate([feature_idx, feature_idx])
+    keep = grid_id > 0
+    grid_id, feature_idx, area, _ = merge_pieces(grid_id[keep], feature_idx[keep], area[keep])
+    # the remainders of the edge cells leave rounding slivers on hexagons the feature only touches
+    keep = area > lattice.cell_area * 1e-12
+    return (grid_id[keep], feature_idx[keep], area[keep])
+
+
+def intersect_layer(
+    grid: gpd.GeoDataFrame,
+    layer: gpd.GeoDataFrame,
+    cell_area: float = None,
+    max_vertices: int = OVERLAP_MAX_VERTICES,
+    prepare: bool = True,
+) -> gpd.GeoDataFrame:
+    """Intersect the planning unit grid with a conservation layer and calculate the area of
+    overlap with :func:`~overlap_pairs`. Returns the same rows as
+    gpd.overlay(grid, layer, how="intersection") with the area of each row in the AMOUNT column.
+    Invalid features are made valid by :func:`~valid_features`, and features with more than
+    max_vertices vertices are intersected as pieces by :func:`~split_features`, and the pieces of
+    each planning unit are merged back together.
+
+    :param grid: The planning unit grid.
+    :type grid: gpd.GeoDataFrame
+    :param layer: The conservation layer.
+    :type layer: gpd.GeoDataFrame
+    :param cell_area: The area of every planning unit when they are all the same size, such as
+                      a lattice grid, defaults to None which calculates the area of each unit.
+    :type cell_area: float, optional
+    :param max_vertices: The most vertices of a feature before it is split, defaults to
+                         OVERLAP_MAX_VERTICES.
+    :type max_vertices: int, optional
+    :param prepare: Prepare the features, see :func:`~overlap_pairs`, defaults to True.
+    :type prepare: bool, optional
+    :return: One row per overlapping (planning unit, feature) pair with the intersection
+             geometry and the area of overlap rounded to an integer.
+    :rtype: gpd.GeoDataFrame
+    """
+    hexes = np.asarray(grid.geometry.values)
+    features, source = split_features(valid_features(layer.geometry.values), max_vertices)
+    lattice = grid_lattice(grid)
+    grid_ids = None if lattice is None else grid[PUID].to_numpy()
+    hex_idx, piece_idx, area, geometry = overlap_pairs(
+        hexes, features, cell_area, geometries=True, prepare=prepare, lattice=lattice, grid_ids=grid_ids
+    )
+    hex_idx, feature_idx, area, geometry = merge_pieces(hex_idx, source[piece_idx], area, geometry)
+
+    intersection = gpd.GeoDataFrame(_pair_frame(grid, layer, hex_idx, feature_idx), geometry=geometry, crs=grid.crs)
+    intersection[AMOUNT] = np.round(area).astype(int)
+    return intersection
+
+
+def overlap_amounts(
+    grid: gpd.GeoDataFrame,
+    features: list[np.ndarray],
+    sindexes: list,
+    cell_area: float = None,
+    rows: list[np.ndarray] = None,
+    sources: list[np.ndarray] = None,
+    prepare: bool = True,
+) -> list[tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+    """Calculate the area of overlap of a grid chunk with each conservation layer as compact
+    arrays, without keeping any intersection geometry. Only the features whose bounding box
+    overlaps the chunk, and that are kept by the row filter of the layer, are tested. Layers
+    whose heavy features were split by :func:`~split_features` are given as their pieces, and
+    the areas of the pieces of a feature are added up before rounding.
+
+    :param grid: The planning unit grid chunk with the GRID_ID column.
+    :type grid: gpd.GeoDataFrame
+    :param features: The geometries of each conservation layer.
+    :type features: list[np.ndarray]
+    :param sindexes: The spatial index of each conservation layer.
+    :type sindexes: list
+    :param cell_area: The area of every planning unit of a lattice grid, defaults to None.
+    :type cell_area: float, optional
+    :param rows: The positions of the features to keep in each layer, None keeps every feature of
+                 the layer, defaults to None which keeps every feature of every layer.
+    :type rows: list[np.ndarray], optional
+    :param sources: The feature position of each piece of each layer given as pieces, None for a
+                    layer given as its features, defaults to None.
+    :type sources: list[np.ndarray], optional
+    :param prepare: Prepare the features, see :func:`~overlap_pairs`, defaults to True.
+    :type prepare: bool, optional
+    :return: For each layer with overlap, the layer number, and the feature position in the layer,
+             GRID_ID and rounded area of overlap of each overlapping pair. Integer GRID_IDs are
+             sent as int32.
+    :rtype: list[tuple[int, np.ndarray, np.ndarray, np.ndarray]]
+    """
+    results = []
+    hexes = np.asarray(grid.geometry.values)
+    # generated grids number their planning units, grids loaded from file may use text ids
+    puids = grid[PUID].to_numpy()
+    if puids.dtype.kind in "iu":
+        puids = puids.astype(np.int32)
+    bounds = grid.total_bounds
+    lattice = grid_lattice(grid)
+    rows = rows if rows is not None else [None] * len(features)
+    sources = sources if sources is not None else [None] * len(features)
+    for layer_no, (layer_features, sindex, layer_rows, source) in enumerate(zip(features, sindexes, rows, sources)):
+        positions = layer_positions(sindex, bounds, layer_rows, source)
+        if not len(positions):
+            continue
+        hex_idx, feature_idx, area, _ = overlap_pairs(
+            hexes, layer_features[positions], cell_area, prepare=prepare, lattice=lattice, grid_ids=puids
+        )
+        feature = positions[feature_idx]
+        if source is not None:
+            # add up the areas of the pieces of each feature before rounding
+            hex_idx, feature, area, _ = merge_pieces(hex_idx, source[feature], area)
+        if len(hex_idx):
+            results.append(
+                (
+                    layer_no,
+                    feature.astype(np.int32),
+                    puids[hex_idx],
+                    np.round(area).astype(np.int64),
+                )
+            )
+    return results
+
+
+def _raster_weights(lattice: HexLattice, resolution: int) -> np.ndarray:
+    """Calculate how much of each raster pixel of a lattice cell, see :func:`~_lattice_cell_hexes`,
+    belongs to the hexagon of the cell's column, for a cell whose left triangle is in its top
+    left corner. The pixels of a cell whose triangle is in the bottom left corner are the same
+    rows in reverse.
+
+    :param lattice: The lattice of the planning grid.
+    :type lattice: HexLattice
+    :param resolution: The number of pixels across each side of a cell.
+    :type resolution: int
+    :return: The area of each pixel in the column's hexagon, by pixel row from the bottom and column.
+    :rtype: np.ndarray
+    """
+    dx = lattice.h_step / resolution
+    dy = lattice.v_step / 2 / resolution
+    row, col = np.divmod(np.arange(resolution * resolution), resolution)
+    pixels = shapely.box(col * dx, row * dy, (col + 1) * dx, (row + 1) * dy)
+    triangle = shapely.Polygon([(0, 0), (0, lattice.v_step / 2), (lattice.side / 2, lattice.v_step / 2)])
+    left = shapely.area(shapely.intersection(pixels, triangle))
+    return (dx * dy - left).reshape(resolution, resolution)
+
+
+def _edges(feature) -> tuple[np.ndarray, np.ndarray]:
+    """Get the edges of the rings of a polygon feature.
+
+    :param feature: The feature geometry.
+    :type feature: shapely.Geometry
+    :return: The start and end coordinates of every edge.
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    coords, ring = shapely.get_coordinates(shapely.get_rings(shapely.get_parts(feature)), return_index=True)
+    same = ring[1:] == ring[:-1]
+    return (coords[:-1][same], coords[1:][same])
+
+
+def _boundary_pixels(start: np.ndarray, end: np.ndarray, x0: float, y0: float, dx: float, dy: float) -> tuple[np.ndarray, np.ndarray]:
+    """Find every pixel the edges cross. Each edge is cut where it crosses the pixel grid lines,
+    every piece between two cuts lies in a single pixel, and the pixel of the middle of each
+    piece is marked. A pixel no edge crosses is either wholly inside or wholly outside the feature.
+
+    :param start: The start coordinates of the edges.
+    :type start: np.ndarray
+    :param end: The end coordinates of the edges.
+    :type end: np.ndarray
+    :param x0: The x coordinate of the left of pixel column 0.
+    :type x0: float
+    :param y0: The y coordinate of the bottom of pixel row 0.
+    :type y0: float
+    :param dx: The width of a pixel.
+    :type dx: float
+    :param dy: The height of a pixel.
+    :type dy: float
+    :return: The pixel row and column of the crossed pixels, with repeats.
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    # in pixel units the grid lines are at the integers
+    a = (start - [x0, y0]) / [dx, dy]
+    b = (end - [x0, y0]) / [dx, dy]
+    edge = np.arange(len(a))
+    cuts = [edge, edge]
+    cut_t = [np.zeros(len(a)), np.ones(len(a))]
+    for axis in range(2):
+        lo, hi = np.minimum(a[:, axis], b[:, axis]), np.maximum(a[:, axis], b[:, axis])
+        # the grid lines strictly between the ends of the edge
+        first = np.floor(lo) + 1
+        count = np.maximum(np.ceil(hi) - first, 0).astype(np.int64)
+        line_edge = np.repeat(edge, count)
+        line = np.repeat(first, count) + _ramp(count)
+        cuts.append(line_edge)
+        cut_t.append((line - a[line_edge, axis]) / (b[line_edge, axis] - a[line_edge, axis]))
+    cut_edge, cut_t = np.concatenate(cuts), np.concatenate(cut_t)
+    order = np.lexsort((cut_t, cut_edge))
+    cut_edge, cut_t = cut_edge[order], cut_t[order]
+    same = cut_edge[1:] == cut_edge[:-1]
+    piece_edge = cut_edge[1:][same]
+    t = ((cut_t[1:] + cut_t[:-1]) / 2)[same][:, None]
+    middle = a[piece_edge] * (1 - t) + b[piece_edge] * t
+    return (np.floor(middle[:, 1]).astype(np.int64), np.floor(middle[:, 0]).astype(np.int64))
+
+
+def _scanline_crossings(
+    start: np.ndarray, end: np.ndarray, x0: float, y0: float, dx: float, dy: float, n_rows: int, n_cols: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Find where the edges cross the line through the pixel centers of every pixel row. Every
+    crossing toggles whether the pixel centers to its right are inside the feature.
+
+    :param start: The start coordinates of the edges.
+    :type start: np.ndarray
+    :param end: The end coordinates of the edges.
+    :type end: np.ndarray
+    :param x0: The x coordinate of the left of pixel column 0.
+    :type x0: float
+    :param y0: The y coordinate of the bottom of pixel row 0.
+    :type y0: float
+    :param dx: The width of a pixel.
+    :type dx: float
+    :param dy: The height of a pixel.
+    :type dy: float
+    :param n_rows: The number of pixel rows.
+    :type n_rows: int
+    :param n_cols: The number of pixel columns.
+    :type n_cols: int
+    :return: The pixel row of each crossing and the first pixel column right of it, sorted by row.
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    # an edge crosses the rows whose center line is in [lower end, upper end)
+    first = np.clip(np.ceil((np.minimum(start[:, 1], end[:, 1]) - y0) / dy - 0.5), 0, n_rows).astype(np.int64)
+    stop = np.clip(np.ceil((np.maximum(start[:, 1], end[:, 1]) - y0) / dy - 0.5), 0, n_rows).astype(np.int64)
+    count = stop - first
+    edge = np.repeat(np.arange(len(count)), count)
+    row = np.repeat(first, count) + _ramp(count)
+    y = y0 + (row + 0.5) * dy
+    a, b = start[edge], end[edge]
+    x = a[:, 0] + (y - a[:, 1]) * (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1])
+    col = np.clip(np.ceil((x - x0) / dx - 0.5), 0, n_cols).astype(np.int64)
+    order = np.argsort(row, kind="stable")
+    return (row[order], col[order])
+
+
+def raster_overlap(
+    lattice: HexLattice, features: np.ndarray, resolution: int = OVERLAP_RASTER_RESOLUTION
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Estimate the area of overlap of the features with the hexagons of a lattice grid by
+    rasterizing them. Every lattice cell, see :func:`~_lattice_cell_hexes`, is split into
+    resolution by resolution pixels, each pixel whose center is inside a feature counts as
+    covered, and the covered pixels are shared between the two hexagons of the cell by the known
+    area of each pixel in each hexagon. Only a pixel crossed by the boundary of a feature can be
+    wrongly counted, so the hexagon's share of every pixel the boundary crosses is the bound on
+    the error of the estimate.
+
+    :param lattice: The lattice of the planning grid.
+    :type lattice: HexLattice
+    :param features: The conservation feature geometries.
+    :type features: np.ndarray
+    :param resolution: The number of pixels across each side of a cell, a hexagon covers two cells,
+                       defaults to OVERLAP_RASTER_RESOLUTION.
+    :type resolution: int, optional
+    :return: The GRID_ID, feature index, estimated area of overlap and largest possible error of the
+             estimate of each pair whose estimate rounds to a nonzero amount, sorted by feature
+             and GRID_ID.
+    :rtype: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+    """
+    n = resolution
+    h_step = lattice.h_step
+    half = lattice.v_step / 2
+    dx, dy = h_step / n, half / n
+    weights = _raster_weights(lattice, n)
+    features = np.asarray(features)
+    band_x0, band_y0, todo, ranges = _lattice_cell_ranges(lattice, features)
+
+    pixel_area = dx * dy
+    feature_idx, cols, bands, area, left_area, error, left_error = [], [], [], [], [], [], []
+    for feature_no, (col0, col1, band0, band1) in zip(todo, ranges):
+        start, end = _edges(features[feature_no])
+        n_cols, n_bands = col1 - col0 + 1, band1 - band0 + 1
+        width = n_cols * n + 1
+        x0, y0 = band_x0 + col0 * h_step, band_y0 + band0 * half
+
+        # a pixel center is inside the feature when an odd number of edges cross its row to the left
+        # of it, so the crossings of each row are kept sorted by pixel row and column
+        cross_row, cross_col = _scanline_crossings(start, end, x0, y0, dx, dy, n_bands * n, n_cols * n)
+        crossings = np.sort(cross_row * width + cross_col)
+        row_start = np.searchsorted(crossings, np.arange(n_bands * n + 1) * width)
+
+        def inside(row: np.ndarray, col: np.ndarray) -> np.ndarray:
+            """Check if the centers of the pixels are inside the feature."""
+            return (np.searchsorted(crossings, row * width + col, side="right") - row_start[row]) % 2 == 1
+
+        # only the cells with a pixel the boundary may cross need their pixels counted
+        edge_row, edge_col = _boundary_pixels(start, end, x0, y0, dx, dy)
+        keep = (edge_row >= 0) & (edge_row < n_bands * n) & (edge_col >= 0) & (edge_col < n_cols * n)
+        edge_pixels = np.unique(edge_row[keep] * width + edge_col[keep])
+        edge_cells = np.unique((edge_pixels // width // n) * n_cols + edge_pixels % width // n)
+
+        # the other cells are wholly inside or outside the feature, like the blocks of lattice_overlap()
+        plain = np.ones(n_bands * n_cols, dtype=bool)
+        plain[edge_cells] = False
+        plain = np.flatnonzero(plain)
+        plain = plain[inside((plain // n_cols) * n, (plain % n_cols) * n)]
+        triangle = lattice.side * half / 4
+        feature_idx.append(np.full(len(plain), feature_no))
+        cols.append(col0 + plain % n_cols)
+        bands.append(band0 + plain // n_cols)
+        area.append(np.full(len(plain), h_step * half - triangle))
+        left_area.append(np.full(len(plain), triangle))
+        error.append(np.zeros(len(plain)))
+        left_error.append(np.zeros(len(plain)))
+
+        # count the covered and boundary pixels of a batch of edge cells at a time
+        offset_row, offset_col = np.divmod(np.arange(n * n), n)
+        for batch in np.array_split(edge_cells, max(1, len(edge_cells) * n * n // OVERLAP_RASTER_BATCH)):
+            cell_band, cell_col = np.divmod(batch, n_cols)
+            row = (cell_band * n)[:, None] + offset_row
+            col = (cell_col * n)[:, None] + offset_col
+            covered = inside(row, col).reshape(-1, n, n)
+            pixels = row * width + col
+            boundary = (edge_pixels[np.clip(np.searchsorted(edge_pixels, pixels), 0, len(edge_pixels) - 1)] == pixels).reshape(-1, n, n)
+            _, cell_y, _, _ = _lattice_cell_hexes(lattice, col0 + cell_col, band0 + cell_band)
+            # the left triangle is in the top left corner when the column's hexagon is centered below
+            top = cell_y < band_y0 + (band0 + cell_band + 0.5) * half
+            for counted, hex_part, left_part in ((covered, area, left_area), (boundary, error, left_error)):
+                in_hex = np.where(
+                    top, np.einsum("cij,ij->c", counted, weights), np.einsum("cij,ij->c", counted, weights[::-1])
+                )
+                hex_part.append(in_hex)
+                left_part.append(np.maximum(counted.sum(axis=(1, 2)) * pixel_area - in_hex, 0))
+            feature_idx.append(np.full(len(batch), feature_no))
+            cols.append(col0 + cell_col)
+            bands.append(band0 + cell_band)
+
+    if not feature_idx:
+        empty = np.empty(0, dtype=np.int64)
+        return (empty, empty, np.empty(0), np.empty(0))
+    feature_idx, cols, bands = np.concatenate(feature_idx), np.concatenate(cols), np.concatenate(bands)
+    _, _, lattice_id, left_id = _lattice_cell_hexes(lattice, cols, bands)
+    grid_id = lattice.to_grid_id(np.concatenate([lattice_id, left_id]))
+    feature_idx = np.concatenate([feature_idx, feature_idx])
+    area = np.concatenate(area + left_area)
+    error = np.concatenate(error + left_error)
+    keep = (grid_id > 0) & ((area > 0) | (error > 0))
+    grid_id, feature_idx, area, error = grid_id[keep], feature_idx[keep], area[keep], error[keep]
+    _, _, error, _ = merge_pieces(grid_id, feature_idx, error)
+    grid_id, feature_idx, area, _ = merge_pieces(grid_id, feature_idx, area)
+    # pairs that only may overlap along the boundary have no amount in the results table
+    keep = np.round(area) > 0
+    return (grid_id[keep], feature_idx[keep], area[keep], error[keep])
+
+
+def lattice_amounts(
+    lattice: HexLattice,
+    grid_ids: np.ndarray,
+    bounds: np.ndarray,
+    features: list[np.ndarray],
+    sindexes: list,
+    rows: list[np.ndarray] = None,
+    sources: list[np.ndarray] = None,
+) -> list[tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+    """Calculate the area of overlap of a chunk of a lattice grid with each conservation layer
+    with :func:`~lattice_overlap`, returning the same compact arrays as :func:`~overlap_amounts`.
+    The hexagons of the chunk are never built, the features are cut along the lattice within the
+    bounds of the chunk and only the overlap of the chunk's planning units is kept.
+
+    :param lattice: The lattice of the planning grid.
+    :type lattice: HexLattice
+    :param grid_ids: The GRID_IDs of the planning units in the chunk.
+    :type grid_ids: np.ndarray
+    :param bounds: The bounds of the hexagons of the chunk as (xmin, ymin, xmax, ymax).
+    :type bounds: np.ndarray
+    :param features: The geometries of each conservation layer.
+    :type features: list[np.ndarray]
+    :param sindexes: The spatial index of each conservation layer.
+    :type sindexes: list
+    :param rows: The positions of the features to keep in each layer, None keeps every feature of
+                 the layer, defaults to None which keeps every feature of every layer.
+    :type rows: list[np.ndarray], optional
+    :param sources: The feature position of each piece of each layer given as pieces, None for a
+                    layer given as its features, defaults to None.
+    :type sources: list[np.ndarray], optional
+    :return: For each layer with overlap, the layer number, and the feature position in the layer,
+             GRID_ID and rounded area of overlap of each overlapping pair.
+    :rtype: list[tuple[int, np.ndarray, np.ndarray, np.ndarray]]
+    """
+    results = []
+    rows = rows if rows is not None else [None] * len(features)
+    sources = sources if sources is not None else [None] * len(features)
+    for layer_no, (layer_features, sindex, layer_rows, source) in enumerate(zip(features, sindexes, rows, sources)):
+        positions = layer_positions(sindex, bounds, layer_rows, source)
+        if not len(positions):
+            continue
+        puid, feature_idx, area = lattice_overlap(lattice, layer_features[positions], bounds)
+        feature = positions[feature_idx]
+        if source is not None:
+            # add up the areas of the pieces of each feature before rounding
+            puid, feature, area, _ = merge_pieces(puid, source[feature], area)
+        # the cut reaches past the chunk into its neighbours, which are calculated by their own chunk
+        keep = np.isin(puid, grid_ids)
+        if keep.any():
+            results.append(
+                (
+                    layer_no,
+                    feature[keep].astype(np.int32),
+                    puid[keep].astype(np.int32),
+                    np.round(area[keep]).astype(np.int64),
+                )
+            )
+    return results
+
+
+def overlap_frame(results: list[tuple[int, np.ndarray, np.ndarray, np.ndarray]], species: list[np.ndarray]) -> pd.DataFrame:
+    """Combine the compact overlap arrays returned by :func:`~overlap_amounts` into the marxan
+    results table, sorted by planning unit and conservation feature.
+
+    :param results: The overlap arrays of all chunks, approximate overlap arrays also have the
+                    bound on the error of each amount.
+    :type results: list[tuple[int, np.ndarray, np.ndarray, np.ndarray]]
+    :param species: The conservation feature ID of every feature in each layer.
+    :type species: list[np.ndarray]
+    :return: The ID, GRID_ID and AMOUNT of every overlapping pair, and the MAX_ERROR of approximate
+             amounts.
+    :rtype: pd.DataFrame
+    """
+    if not results:
+        return pd.DataFrame(columns=[ID, PUID, AMOUNT])
+    frame = pd.DataFrame(
+        {
+            ID: np.concatenate([species[result[0]][result[1]] for result in results]),
+            PUID: np.concatenate([result[2] for result in results]),
+            AMOUNT: np.concatenate([result[3] for result in results]),
+        }
+    )
+    if len(results[0]) > 4:
+        frame[MAX_ERROR] = np.concatenate([result[4] for result in results])
+    return frame.sort_values([PUID, ID, AMOUNT], kind="stable", ignore_index=True)
+
+
+def hilbert_index(x: np.ndarray, y: np.ndarray, order: int = 16) -> np.ndarray:
+    """Calculate the position of each point along a Hilbert curve covering the points'
+    extent. Points that are close along the curve are close in space.
+
+    :param x: The x coordinates of the points.
+    :type x: np.ndarray
+    :param y: The y coordinates of the points.
+    :type y: np.ndarray
+    :param order: The curve fills a 2**order by 2**order grid, defaults to 16.
+    :type order: int, optional
+    :return: The Hilbert curve index of each point.
+    :rtype: np.ndarray
+    """
+    n = 1 << order
+    d = np.zeros(len(x), dtype=np.int64)
+    if not len(x):
+        return d
+
+    def scale(v: np.ndarray) -> np.ndarray:
+        span = v.max() - v.min()
+        return ((v - v.min()) / span * (n - 1)).astype(np.int64) if span > 0 else np.zeros(len(v), dtype=np.int64)
+
+    xi = scale(np.asarray(x, dtype=float))
+    yi = scale(np.asarray(y, dtype=float))
+    s = n >> 1
+    while s > 0:
+        rx = ((xi & s) > 0).astype(np.int64)
+        ry = ((yi & s) > 0).astype(np.int64)
+        d += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant so the curve stays continuous
+        flip = (ry == 0) & (rx == 1)
+        xi = np.where(flip, n - 1 - xi, xi)
+        yi = np.where(flip, n - 1 - yi, yi)
+        swap = ry == 0
+        xi, yi = np.where(swap, yi, xi), np.where(swap, xi, yi)
+        s >>= 1
+    return d
+
+
+def partition_grid(x: np.ndarray, y: np.ndarray, n_chunks: int) -> list[np.ndarray]:
+    """Split the planning units into spatially compact chunks of equal size by ordering
+    their centers along a Hilbert curve.
+
+    :param x: The x coordinates of the planning unit centers.
+    :type x: np.ndarray
+    :param y: The y coordinates of the planning unit centers.
+    :type y: np.ndarray
+    :param n_chunks: The number of chunks.
+    :type n_chunks: int
+    :return: The sorted positions of the planning units in each chunk, empty chunks are dropped.
+    :rtype: list[np.ndarray]
+    """
+    order = np.argsort(hilbert_index(x, y), kind="stable")
+    chunks = np.array_split(order, max(1, min(n_chunks, len(order))))
+    return [np.sort(chunk) for chunk in chunks if len(chunk)]
+
+
+def layer_positions(sindex, bounds: np.ndarray, rows: np.ndarray = None, source: np.ndarray = None) -> np.ndarray:
+    """Find the positions of the features whose bounding box intersects the bounds.
+
+    :param sindex: The spatial index of the conservation layer, or of its pieces.
+    :type sindex: geopandas.sindex.SpatialIndex | shapely.STRtree
+    :param bounds: The bounds as (xmin, ymin, xmax, ymax).
+    :type bounds: np.ndarray
+    :param rows: The positions of the features to keep, defaults to None which keeps every feature.
+    :type rows: np.ndarray, optional
+    :param source: The feature position of each piece when the index is of the pieces from
+                   :func:`~split_features`, defaults to None.
+    :type source: np.ndarray, optional
+    :return: The sorted positions of the features, or pieces, near the bounds.
+    :rtype: np.ndarray
+    """
+    positions = np.sort(sindex.query(shapely.box(*bounds)))
+    if rows is not None:
+        positions = positions[np.isin(positions if source is None else source[positions], rows)]
+    return positions
+
+
+def layer_subset(layer: gpd.GeoDataFrame, bounds: np.ndarray, sindex=None, rows: np.ndarray = None) -> gpd.GeoDataFrame:
+    """Select the features of a layer whose bounding box intersects the bounds.
+
+    :param layer: The conservation layer.
+    :type layer: gpd.GeoDataFrame
+    :param bounds: The bounds as (xmin, ymin, xmax, ymax).
+    :type bounds: np.ndarray
+    :param sindex: A spatial index with the same feature order as the layer, such as the index of
+                   the layer it was copied from, defaults to None which uses the layer's own.
+    :type sindex: optional
+    :param rows: The positions of the features to keep, defaults to None which keeps every feature.
+    :type rows: np.ndarray, optional
+    :return: The features of the layer near the bounds, in layer order.
+    :rtype: gpd.GeoDataFrame
+    """
+    sindex = layer.sindex if sindex is None else sindex
+    return layer.iloc[layer_positions(sindex, bounds, rows)]
+
+
+def layer_rows(base: gpd.GeoDataFrame, layer: gpd.GeoDataFrame) -> np.ndarray | None:
+    """Find the positions of the rows of a filtered layer in the layer it was filtered from.
+    A row only matches when it has the same index label, the same geometry object and the same
+    ID as the row of the base layer, so a layer that was projected or edited since it was
+    filtered does not match.
+
+    :param base: The layer that may have been filtered.
+    :type base: gpd.GeoDataFrame
+    :param layer: The filtered layer.
+    :type layer: gpd.GeoDataFrame
+    :return: The positions of the rows in the base layer, or None if the layer is not a row
+             subset of the base layer.
+    :rtype: np.ndarray | None
+    """
+    if len(layer) > len(base) or not base.index.is_unique or list(layer.columns) != list(base.columns):
+        return None
+    positions = base.index.get_indexer(layer.index)
+    if (positions < 0).any():
+        return None
+    base_geometry = np.asarray(base.geometry.values)[positions]
+    if not all(a is b for a, b in zip(base_geometry, layer.geometry.values)):
+        return None
+    if ID in layer.columns and not np.array_equal(base[ID].to_numpy()[positions], layer[ID].to_numpy()):
+        return None
+    return positions.astype(np.int32)
+
+
+def layer_filters(
+    base_layers: list[gpd.GeoDataFrame], layers: list[gpd.GeoDataFrame]
+) -> tuple[list[gpd.GeoDataFrame], list[tuple[int, np.ndarray]]]:
+    """Describe each layer as a row filter of one of the base layers, so workers that already hold
+    the base layers only need the filter. Layers that are not a filter of a base layer are added
+    to the base layers.
+
+    :param base_layers: The layers the others may have been filtered from, such as the loaded
+                        conservation layers.
+    :type base_layers: list[gpd.GeoDataFrame]
+    :param layers: The layers to describe, such as the filtered conservation layers.
+    :type layers: list[gpd.GeoDataFrame]
+    :return: The base layers, and for each layer the number of its base layer and the positions
+             of its rows in the base layer, or None if it has every row of the base layer.
+    :rtype: tuple[list[gpd.GeoDataFrame], list[tuple[int, np.ndarray]]]
+    """
+    base_layers = list(base_layers)
+    filters = []
+    for layer in layers:
+        for base_no, base in enumerate(base_layers):
+            if base is layer:
+                filters.append((base_no, None))
+                break
+            rows = layer_rows(base, layer)
+            if rows is not None:
+                full = len(rows) == len(base) and np.array_equal(rows, np.arange(len(base)))
+                filters.append((base_no, None if full else rows))
+                break
+        else:
+            filters.append((len(base_layers), None))
+            base_layers.append(layer)
+    return (base_layers, filters)
+
+
+def fingerprint(*parts) -> str:
+    """Hash strings, numbers and arrays into a hex digest that identifies their contents.
+
+    :return: The hex digest of the parts.
+    :rtype: str
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, np.ndarray) and part.dtype.kind not in "OUST":
+            digest.update(str(part.dtype).encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        elif isinstance(part, np.ndarray):
+            for item in part:
+                digest.update(item if isinstance(item, bytes) else str(item).encode())
+                digest.update(b"\x00")
+        else:
+            digest.update(str(part).encode())
+        digest.update(b"\x01")
+    return digest.hexdigest()
+
+
+def grid_fingerprint(grid) -> str:
+    """Fingerprint the planning units of a planning grid, a lattice grid is identified by its
+    hexagon centers and size, other grids by their geometries and GRID_IDs.
+
+    :param grid: The planning grid.
+    :type grid: PlanningGrid | gpd.GeoDataFrame
+    :return: The fingerprint of the grid.
+    :rtype: str
+    """
+    if isinstance(grid, gpd.GeoDataFrame):
+        return fingerprint(shapely.to_wkb(grid.geometry.values), grid[PUID].to_numpy(), grid.crs)
+    return fingerprint(grid.x, grid.y, grid.side, grid.crs)
+
+
+def layer_fingerprint(layer: gpd.GeoDataFrame) -> str:
+    """Fingerprint the features of a conservation layer by their geometries and IDs.
+
+    :param layer: The conservation layer.
+    :type layer: gpd.GeoDataFrame
+    :return: The fingerprint of the layer.
+    :rtype: str
+    """
+    ids = layer[ID].to_numpy() if ID in layer.columns else np.arange(len(layer))
+    return fingerprint(shapely.to_wkb(layer.geometry.values), ids, layer.crs)
+
+
+class OverlapCache:
+    """In session cache of the overlap arrays of each feature of the conservation layers with
+    the planning grid. The overlap of a layer is keyed by the fingerprints of the grid and the
+    layer, and every feature row is calculated at most once, so a new filter of a layer only
+    needs the rows that were not calculated before and is otherwise a subset of the cached
+    arrays. Only the overlap with the most recent grid is kept in memory, with a disk cache the
+    overlap of every grid is also kept on disk for later sessions, keyed as well by the
+    OVERLAP_ENGINE_VERSION.
+    """
+
+    def __init__(self, disk: DiskCache = None) -> None:
+        self.grid = None
+        self.entries = {}
+        self.fingerprints = {}
+        self.disk = disk
+
+    def clear(self) -> None:
+        """Remove every overlap cached in memory."""
+        self.grid = None
+        self.entries = {}
+        self.fingerprints = {}
+        return
+
+    def fingerprint(self, gdf: gpd.GeoDataFrame) -> str:
+        """Fingerprint a grid or layer, remembering the fingerprint of each object so a layer
+        is only hashed once per session.
+
+        :param gdf: The planning grid or conservation layer.
+        :type gdf: PlanningGrid | gpd.GeoDataFrame
+        :return: The fingerprint.
+        :rtype: str
+        """
+        if not isinstance(gdf, gpd.GeoDataFrame):
+            return grid_fingerprint(gdf)
+        ref, value = self.fingerprints.get(id(gdf), (None, None))
+        if ref is None or ref() is not gdf:
+            value = layer_fingerprint(gdf) if PUID not in gdf.columns else grid_fingerprint(gdf)
+            self.fingerprints[id(gdf)] = (weakref.ref(gdf), value)
+        return value
+
+    def use_grid(self, grid) -> None:
+        """Set the planning grid of the cached overlap, dropping the overlap of any other grid
+        from memory.
+
+        :param grid: The planning grid.
+        :type grid: PlanningGrid | gpd.GeoDataFrame
+        """
+        key = self.fingerprint(grid)
+        if key != self.grid:
+            self.grid = key
+            self.entries = {}
+        return
+
+    def disk_key(self, layer_key: str) -> str:
+        """Get the disk cache key of the overlap of a layer with the current grid.
+
+        :param layer_key: The fingerprint of the layer.
+        :type layer_key: str
+        :return: The disk cache key.
+        :rtype: str
+        """
+        return DiskCache.key("overlap", OVERLAP_ENGINE_VERSION, self.grid, layer_key)
+
+    def entry(self, layer: gpd.GeoDataFrame) -> dict | None:
+        """Get the cached overlap of a layer, loading it from the disk cache if needed.
+
+        :param layer: The conservation layer.
+        :type layer: gpd.GeoDataFrame
+        :return: The rows calculated and the overlap arrays, or None if the layer is not cached.
+        :rtype: dict | None
+        """
+        key = self.fingerprint(layer)
+        if key not in self.entries and self.disk is not None:
+            file_name = self.disk.get(self.disk_key(key), ".npz")
+            if file_name is not None:
+                try:
+                    with np.load(file_name) as data:
+                        entry = {name: data[name] for name in ("done", "feature", "puid", "amount")}
+                    if len(entry["done"]) == len(layer):
+                        self.entries[key] = entry
+                except (OSError, ValueError, KeyError):
+                    pass
+        return self.entries.get(key)
+
+    def missing(self, layer: gpd.GeoDataFrame, rows: np.ndarray = None) -> np.ndarray:
+        """Find the rows of a layer that have not been calculated.
+
+        :param layer: The conservation layer.
+        :type layer: gpd.GeoDataFrame
+        :param rows: The positions of the rows needed, defaults to None for every row.
+        :type rows: np.ndarray, optional
+        :return: The positions of the needed rows that are not in the cache.
+        :rtype: np.ndarray
+        """
+        entry = self.entry(layer)
+        rows = np.arange(len(layer)) if rows is None else np.asarray(rows)
+        if entry is None:
+            return rows
+        return rows[~entry["done"][rows]]
+
+    def add(
+        self, layer: gpd.GeoDataFrame, rows: np.ndarray, feature: np.ndarray, puid: np.ndarray, amount: np.ndarray
+    ) -> None:
+        """Add the overlap arrays of newly calculated rows of a layer, and write the overlap of
+        the layer to the disk cache.
+
+        :param layer: The conservation layer.
+        :type layer: gpd.GeoDataFrame
+        :param rows: The positions of the calculated rows, None for every row.
+        :type rows: np.ndarray
+        :param feature: The feature position of each overlap.
+        :type feature: np.ndarray
+        :param puid: The GRID_ID of each overlap.
+        :type puid: np.ndarray
+        :param amount: The area of each overlap.
+        :type amount: np.ndarray
+        """
+        entry = self.entry(layer)
+        if entry is None:
+            entry = {
+                "done": np.zeros(len(layer), dtype=bool),
+                "feature": np.empty(0, dtype=np.int32),
+                "puid": puid[:0],
+                "amount": np.empty(0, dtype=np.int64),
+            }
+            self.entries[self.fingerprint(layer)] = entry
+        entry["done"][slice(None) if rows is None else rows] = True
+        entry["feature"] = np.concatenate([entry["feature"], feature])
+        entry["puid"] = np.concatenate([entry["puid"], puid])
+        entry["amount"] = np.concatenate([entry["amount"], amount])
+
+        if self.disk is not None:
+            # text GRID_IDs are stored as fixed width strings so the file loads without pickle
+            arrays = dict(entry)
+            if arrays["puid"].dtype.kind == "O":
+                arrays["puid"] = arrays["puid"].astype(str)
+            try:
+                self.disk.put(self.disk_key(self.fingerprint(layer)), ".npz", lambda file_name: np.savez(file_name, **arrays))
+            except OSError:
+                pass
+        return
+
+    def take(self, layer: gpd.GeoDataFrame, rows: np.ndarray = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Get the cached overlap arrays of the rows of a layer.
+
+        :param layer: The conservation layer.
+        :type layer: gpd.GeoDataFrame
+        :param rows: The positions of the rows, defaults to None for every row.
+        :type rows: np.ndarray, optional
+        :return: The feature position, GRID_ID and area of each overlap of the rows.
+        :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]
+        """
+        entry = self.entry(layer)
+        if rows is None:
+            return (entry["feature"], entry["puid"], entry["amount"])
+        keep = np.zeros(len(layer), dtype=bool)
+        keep[rows] = True
+        keep = keep[entry["feature"]]
+        return (entry["feature"][keep], entry["puid"][keep], entry["amount"][keep])
+
+
+def overlap_job_key(grid_key: str, layer_keys: list[str], filters: list[tuple[int, np.ndarray]], n_chunks: int) -> str:
+    """Identify an overlap calculation, so a checkpoint is only resumed by the same calculation.
+
+    :param grid_key: The fingerprint of the planning grid.
+    :type grid_key: str
+    :param layer_keys: The fingerprint of the base layer of each filter.
+    :type layer_keys: list[str]
+    :param filters: The layer number and row positions of each layer calculated.
+    :type filters: list[tuple[int, np.ndarray]]
+    :param n_chunks: The number of chunks the grid is split into.
+    :type n_chunks: int
+    :return: The key of the calculation.
+    :rtype: str
+    """
+    rows = [
+        fingerprint("all" if layer_rows is None else np.asarray(layer_rows, dtype=np.int64)) for _, layer_rows in filters
+    ]
+    return DiskCache.key("checkpoint", OVERLAP_ENGINE_VERSION, grid_key, *layer_keys, *rows, n_chunks)
+
+
+def save_checkpoint_chunk(directory: str, chunk: int, results: list[tuple[int, np.ndarray, np.ndarray, np.ndarray]]) -> None:
+    """Save the overlap arrays of a finished chunk to the checkpoint directory. The file is
+    written under a temporary name and moved into place, so an interrupted write is never
+    mistaken for a finished chunk.
+
+    :param directory: The checkpoint directory of the calculation.
+    :type directory: str
+    :param chunk: The chunk number.
+    :type chunk: int
+    :param results: The overlap arrays of the chunk from :func:`~overlap_amounts`.
+    :type results: list[tuple[int, np.ndarray, np.ndarray, np.ndarray]]
+    """
+    makedirs(directory, exist_ok=True)
+    layers = [np.full(len(feature), layer_no, dtype=np.int32) for layer_no, feature, _, _ in results]
+    arrays = {
+        "layer": np.concatenate(layers or [np.empty(0, dtype=np.int32)]),
+        "feature": np.concatenate([feature for _, feature, _, _ in results] or [np.empty(0, dtype=np.int32)]),
+        "puid": np.concatenate([puid for _, _, puid, _ in results] or [np.empty(0, dtype=np.int32)]),
+        "amount": np.concatenate([amount for _, _, _, amount in results] or [np.empty(0, dtype=np.int64)]),
+    }
+    # text GRID_IDs are stored as fixed width strings so the file loads without pickle
+    if arrays["puid"].dtype.kind == "O":
+        arrays["puid"] = arrays["puid"].astype(str)
+    temp_name = path.join(directory, f".chunk_{chunk:05d}.tmp.npz")
+    np.savez(temp_name, **arrays)
+    replace(temp_name, path.join(directory, f"chunk_{chunk:05d}.npz"))
+    return
+
+
+def load_checkpoint(directory: str) -> dict[int, list[tuple[int, np.ndarray, np.ndarray, np.ndarray]]]:
+    """Load the overlap arrays of the finished chunks of an interrupted calculation.
+
+    :param directory: The checkpoint directory of the calculation.
+    :type directory: str
+    :return: The overlap arrays of each finished chunk by chunk number, empty if there is no checkpoint.
+    :rtype: dict[int, list[tuple[int, np.ndarray, np.ndarray, np.ndarray]]]
+    """
+    finished = {}
+    if not path.isdir(directory):
+        return finished
+    for name in listdir(directory):
+        if not (name.startswith("chunk_") and name.endswith(".npz")):
+            continue
+        try:
+            with np.load(path.join(directory, name)) as data:
+                layer, feature, puid, amount = (data[key] for key in ("layer", "feature", "puid", "amount"))
+        except (OSError, ValueError, KeyError):
+            continue
+        finished[int(name[6:-4])] = [
+            (int(layer_no), feature[layer == layer_no], puid[layer == layer_no], amount[layer == layer_no])
+            for layer_no in np.unique(layer)
+        ]
+    return finished
+
+
+def save_filters(file_name: str, filters: list[tuple[int, np.ndarray]]) -> None:
+    """Save the layer filters of a calculation for workers that already hold the base layers.
+
+    :param file_name: The name of the .npz file.
+    :type file_name: str
+    :param filters: The layer number and row positions of each layer from :func:`~layer_filters`.
+    :type filters: list[tuple[int, np.ndarray]]
+    """
+    arrays = {"layer": np.array([layer_no for layer_no, _ in filters], dtype=np.int32)}
+    for i, (_, layer_rows) in enumerate(filters):
+        # a layer that keeps every row has no rows array
+        if layer_rows is not None:
+            arrays[f"rows_{i}"] = np.asarray(layer_rows, dtype=np.int64)
+    np.savez(file_name, **arrays)
+    return
+
+
+def load_filters(file_name: str) -> list[tuple[int, np.ndarray]]:
+    """Load the layer filters saved by :func:`~save_filters`.
+
+    :param file_name: The name of the .npz file.
+    :type file_name: str
+    :return: The layer number and row positions of each layer.
+    :rtype: list[tuple[int, np.ndarray]]
+    """
+    with np.load(file_name) as data:
+        return [(int(layer_no), data[f"rows_{i}"] if f"rows_{i}" in data else None) for i, layer_no in enumerate(data["layer"])]
@@ -17,29 +17,38 @@ NOTE: This script has its own environment availble to build with the
 """
 # Import modules
 from util import *
+from hexgrid import *
+from overlap import *
+from cache import DiskCache
 import os
+import shutil
+import tempfile
 
 os.environ["USE_PYGEOS"] = "0"
 from time import time
 
-from shapely.geometry import Point, Polygon
+from shapely.geometry import Point
 from shapely import wkt
-from math import cos, sin, sqrt, radians, ceil
+import shapely
 
 import geopandas as gpd
 import pandas as pd
 import matplotlib.pyplot as plt
 
 from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import numpy as np
 import psutil
 from functools import partial
+from typing import Iterator
 
 # Global Variables
 verbose = True
 CORES = psutil.cpu_count(logical=False)
 target_crs = TARGET_CRS
 intro = True
+worker_state = {}  # planning grid and conservation layers held by each overlap worker, set by init_worker()
 
 # %% Obtain the CRS from the user
 
@@ -180,69 +189,28 @@ def get_area_input() -> float:
 # %% create a planning unit grid
 def create_hexagon(l, x, y):
     """
-    Author:Kadir Şahbaz
-    Create a hexagon centered on (x, y)
+    Create a hexagon centered on (x, y), see :func:`~hexgrid.hexagons`
     :param l: length of the hexagon's edge
     :param x: x-coordinate of the hexagon's center
     :param y: y-coordinate of the hexagon's center
     :return: The polygon containing the hexagon's coordinates
-    Source:https://gis.stackexchange.com/questions/341218/creating-a-hexagonal-grid-of-regular-hexagons-of-definite-area-anywhere-on-the-g
     """
-    c = [[x + cos(radians(angle)) * l, y + sin(radians(angle)) * l] for angle in range(0, 360, 60)]
-    return Polygon(c)
+    return hexagons(np.array([x]), np.array([y]), l)[0]
 
 
 def create_hexgrid(bbx, area):
     """
-    Author:Kadir Şahbaz
-    returns an array of Points describing hexagons centers that are inside the given bounding_box
-    :param bbx: The containing bounding box. The bbox coordinate should be in Webmercator.
-    :param side: The size of the hexagons'
-    :return: The hexagon grid
-    Source:https://gis.stackexchange.com/questions/341218/creating-a-hexagonal-grid-of-regular-hexagons-of-definite-area-anywhere-on-the-g
+    Returns the hexagon centers that cover the given bounding box in GRID_ID order, see
+    :func:`~hexgrid.hexgrid_centers`
+    :param bbx: The containing bounding box.
+    :param area: The area of the hexagons
+    :return: The hexagon centers and the length of the hexagon's edge
     """
-    side = sqrt(area / (1.5 * sqrt(3)))
+    x, y, side = hexgrid_centers(bbx, area)
+    return (list(zip(x.tolist(), y.tolist())), side)
 
-    grid = []
-    v_step = sqrt(3) * side
-    h_step = 1.5 * side
 
-    x_min = min(bbx[0], bbx[2])
-    x_max = max(bbx[0], bbx[2])
-    y_min = min(bbx[1], bbx[3])
-    y_max = max(bbx[1], bbx[3])
-
-    h_skip = ceil(x_min / h_step) - 1
-    h_start = h_skip * h_step
-
-    v_skip = ceil(y_min / v_step) - 1
-    v_start = v_skip * v_step
-
-    h_end = x_max + h_step
-    v_end = y_max + v_step
-
-    if v_start - (v_step / 2.0) < y_min:
-        v_start_array = [v_start + (v_step / 2.0), v_start]
-    else:
-        v_start_array = [v_start - (v_step / 2.0), v_start]
-
-    v_start_idx = int(abs(h_skip) % 2)
-
-    c_x = h_start
-    c_y = v_start_array[v_start_idx]
-    v_start_idx = (v_start_idx + 1) % 2
-    while c_x < h_end:
-        while c_y < v_end:
-            grid.append((c_x, c_y))
-            c_y += v_step
-        c_x += h_step
-        c_y = v_start_array[v_start_idx]
-        v_start_idx = (v_start_idx + 1) % 2
-
-    return (grid, side)
-
-
-def create_planning_unit_grid() -> gpd.GeoDataFrame:
+def create_planning_unit_grid() -> PlanningGrid | gpd.GeoDataFrame:
     """
     Author: Lucas McPhail
     Take user input to create a hexagonal planning
@@ -266,8 +234,10 @@ def create_planning_unit_grid() -> gpd.GeoDataFrame:
         y coordinate for center of grid
     Returns
     -------
-    planning_unit_grid: gpd.GeoDataFrame
-        hexagon grid shapefile that matches the dimensions specified by the user
+    planning_unit_grid: PlanningGrid | gpd.GeoDataFrame
+        hexagon grid that matches the dimensions specified by the user, generated
+        grids are returned as a compact PlanningGrid, grids loaded from file as a
+        gpd.GeoDataFrame
 
     """
 
@@ -284,6 +254,7 @@ def create_planning_unit_grid() -> gpd.GeoDataFrame:
         2  Create Grid from Shape File extents and clip to shape
         3  Load existing Grid from File
         4  Create Grid from User Input
+        5  Stream Grid from Shape File extents to GeoPackage
         9  Return to Main Menu
     >>> """
             )
@@ -317,29 +288,12 @@ def create_planning_unit_grid() -> gpd.GeoDataFrame:
                 if verbose:
                     progress = print_progress_start(ABORT + "Generating Planning Unit Grid")
 
-                hex_centers, edge = create_hexgrid(box, area)
-                # Empty list is created that will contain the hexagons
-                hexagons = []
-                # centre points are iterated through the function that creates a
-                # hexagon around each of them and adds it to the list
-                for center in hex_centers:
-                    hexagons.append(create_hexagon(edge, center[0], center[1]))
-                # Geometry list is turned into a geodataframe
-                planning_unit_grid = gpd.GeoDataFrame(geometry=hexagons, crs=target_crs)
-                planning_unit_grid.to_crs(crs=target_crs, inplace=True)
-                # unique PUID is assigned to each hexagon
-                planning_unit_grid[PUID] = planning_unit_grid.index + 1
-
-                clipped = ''
-                # Clip the hexagons to the shape of the input shapefile
-                if selection == 2:
-                    hex_gdf_clipped = gpd.clip(planning_unit_grid, file)
-                    # Filter the original GeoDataFrame to only include the hexagons within the clipped area
-                    hex_ids = set(hex_gdf_clipped[PUID])
-                    planning_unit_grid = planning_unit_grid[planning_unit_grid[PUID].isin(hex_ids)]
-                    planning_unit_grid.reset_index(drop=True, inplace=True)
-                    planning_unit_grid[PUID] = planning_unit_grid.index + 1
-                    clipped = '_clipped'
+                # only the hexagon centres are kept, the PUID of each hexagon is its position
+                # in the grid, when clipping to the shape only the hexagons intersecting the
+                # shape are kept
+                clipped = '_clipped' if selection == 2 else ''
+                shapes = file.geometry.values if selection == 2 else None
+                planning_unit_grid = PlanningGrid.from_bounds(box, area, target_crs, shapes)
 
                 planning_unit_grid.name = f'Planning_Unit_Grid_{str(area/(SUFFIX_DICT[suf]**2)).replace(".","-")}{suf.replace(SQ,"2")}{clipped}'
                 # planning_unit_grid.to_file("planning_unit_grid.shp")
@@ -405,21 +359,10 @@ def create_planning_unit_grid() -> gpd.GeoDataFrame:
                 box = area_geos.total_bounds
                 # edge length of individual hexagon is calculated using the area
                 # edge = math.sqrt(Area**2 / (3 / 2 * math.sqrt(3)))
-                # grid is created that has the central points of each hexagon
-                hex_centers, edge = create_hexgrid(box, area)
-                # Empty list that will contain the hexagon geometry
-                hexagons = []
-                # centre points are iterated through the function that creates a
-                # hexagon around each of them and adds it to the list
-                for center in hex_centers:
-                    hexagons.append(create_hexagon(edge, center[0], center[1]))
-
-
-                # Geometry list is turned into a geodataframe
-                planning_unit_grid = gpd.GeoDataFrame(geometry=hexagons, crs=target_crs)
-                # unique PUID is assigned to each hexagon
+                # only the hexagon centres are kept, the PUID of each hexagon is its position
+                # in the grid
+                planning_unit_grid = PlanningGrid.from_bounds(box, area, target_crs)
                 planning_unit_grid.name = f'Planning_Unit_Grid_{str(area/(SUFFIX_DICT[suf]**2)).replace(".","-")}{suf.replace(SQ,"2")}'
-                planning_unit_grid[PUID] = planning_unit_grid.index + 1
                 # file is saved for user to reuse
                 # planning_unit_grid.to_file("planning_unit_grid.shp")
             except KeyboardInterrupt:
@@ -432,6 +375,52 @@ def create_planning_unit_grid() -> gpd.GeoDataFrame:
                     print_progress_stop(progress)
             break
 
+        # 5 Stream Grid from Shape File extents to GeoPackage
+        elif selection == 5:
+            # the grid is written to file tile by tile and never held in memory as a whole,
+            # this is used for extents and resolutions that are too large to create in memory
+            file = get_file(title="Select a file to load the extents from")
+            if not file:
+                continue
+            file = load_files(file, verbose)
+
+            area, suf = get_area_input()
+            clip = input("Clip grid to shape? (y/[n]): ").lower() == "y"
+            file.to_crs(crs=target_crs, inplace=True)
+            box = file.total_bounds
+            clipped = '_clipped' if clip else ''
+            grid_name = f'Planning_Unit_Grid_{str(area/(SUFFIX_DICT[suf]**2)).replace(".","-")}{suf.replace(SQ,"2")}{clipped}'
+
+            file_name = get_save_file_name(
+                title="Save planning unit grid to GeoPackage", f_types=ft_geo_package, initialfile=grid_name
+            )
+            if not file_name:
+                print_warning_msg("Skipping grid generation. File name not provided.")
+                continue
+            if not file_name.lower().endswith(".gpkg"):
+                file_name = os.path.splitext(file_name)[0] + ".gpkg"
+
+            count = 0
+            try:
+                if verbose:
+                    progress = print_progress_start(ABORT + "Streaming Planning Unit Grid")
+                start_time = time()
+                count = write_hexgrid_gpkg(
+                    file_name, box, area, target_crs, file.geometry.values if clip else None, layer=grid_name
+                )
+            except KeyboardInterrupt:
+                print_warning_msg(f"Grid Generation Aborted\n")
+            except Exception as e:
+                print_warning_msg(f"Error during Grid Generation\n")
+                print(e)
+            finally:
+                if verbose:
+                    print_progress_stop(progress)
+            if count:
+                print_info_complete(f"{count} planning units written to {file_name} in {(time() - start_time):.2f} seconds")
+                print_info("Use 'Load existing Grid from File' to load the grid for overlap calculations.")
+            break
+
         # 9 Return to Main Menu
         elif selection == 9:
             break
@@ -553,12 +542,21 @@ def create_planning_unit_grid() -> gpd.GeoDataFrame:
 
 
 # %% Load conservation feature layers from file
-def load_convservation_layers() -> list[gpd.GeoDataFrame]:
+def load_convservation_layers(
+    planning_grid: PlanningGrid | gpd.GeoDataFrame = None, layer_cache: DiskCache = None
+) -> list[gpd.GeoDataFrame]:
     """
     Author: Nata
 
     Takes user selection to load planning/ conservation layers of interest
 
+    Parameters
+    ----------
+    planning_grid : PlanningGrid | gpd.GeoDataFrame, optional
+        The planning grid, when one exists only the features within its extent are read.
+    layer_cache : DiskCache, optional
+        The cache of layers projected to the target CRS, a cached layer is not read and projected again.
+
     Returns
     -------
     conserv_layers : list[gpd.GeoDataFrame]
@@ -566,6 +564,7 @@ def load_convservation_layers() -> list[gpd.GeoDataFrame]:
 
     """
     conserv_layers = [] # list to hold conservation feature layers
+    extent = grid_extent(planning_grid)
     title = bu("Load Conservation Feature Layers:")
     # get list of files to load
     while True:
@@ -594,7 +593,7 @@ def load_convservation_layers() -> list[gpd.GeoDataFrame]:
         if selection == 1:
             files = get_files(title="Select Conservation Feature files")
             if files:
-                conserv_layers = load_files(files, verbose)
+                conserv_layers = load_files(files, verbose, LOAD_COLUMNS, extent, target_crs, layer_cache)
             else:
                 print_warning_msg("No files loaded, please verify files and try again.")
                 continue
@@ -604,7 +603,7 @@ def load_convservation_layers() -> list[gpd.GeoDataFrame]:
         elif selection == 2:
             files = get_files_from_dir([ft_shapefile, ft_geo_package])
             if files:
-                conserv_layers = load_files(files, verbose)
+                conserv_layers = load_files(files, verbose, LOAD_COLUMNS, extent, target_crs, layer_cache)
             else:
                 print_warning_msg("No files loaded from directory, try selecting files manually.")
                 continue
@@ -647,13 +646,6 @@ def query_conservation_layers(
         print_warning_msg("No conservation feature layers loaded.")
         return []
 
-    # This will reset the list of layers to the original loaded layers every time
-    filtered_conserv_layers = []
-    for layer in conserv_layers:
-        filtered_conserv_layers.append(layer.copy(deep=True))
-    for i in range(len(conserv_layers)):
-        filtered_conserv_layers[i].name = "".join(conserv_layers[i].name.split(".")[:-1])+"_filtered" if hasattr(conserv_layers[i], "name") else f"filtered_{i}"
-
     attribute = ""
 
     def filter_by_attribute(conserv_layers: list[gpd.GeoDataFrame], attribute: any) -> list[gpd.GeoDataFrame]:
@@ -661,8 +653,8 @@ def query_conservation_layers(
         for gdf in conserv_layers:
             if gdf.empty:
                 continue
-            if attribute in gdf.columns:
-                filter.extend(gdf[attribute].unique())
+            # the values of a column that is not loaded are read from the layer file
+            filter.extend(attribute_values(gdf, attribute))
         filter = list(set(filter))
         filter.sort()
 
@@ -673,8 +665,9 @@ def query_conservation_layers(
             filtered_gdf_list = conserv_layers
         else:
             for gdf in conserv_layers:
-                if attribute in gdf.columns:
-                    filtered_gdf = gdf[gdf[attribute].astype(str).isin(chosenFeatures)]
+                if attribute in gdf.columns or attribute in gdf.attrs.get("fields", []):
+                    # the filter is applied by the reader, the result shares the rows of the layer
+                    filtered_gdf = select_by_attribute(gdf, attribute, chosenFeatures)
                     filtered_gdf.name = gdf.name if hasattr(gdf, "name") else ""
                     filtered_gdf_list.append(filtered_gdf)
                 else:
@@ -726,7 +719,8 @@ def query_conservation_layers(
         elif selection == 5:
             column_names = []
             for gdf in conserv_layers:
-                column_names.extend(list(gdf.columns))
+                # layers loaded with only some columns list the columns of their file
+                column_names.extend(list(gdf.columns) + list(gdf.attrs.get("fields", [])))
             column_names = list(set(column_names))
             column_names.remove(GEOMETRY)
             column_names.sort()
@@ -740,6 +734,19 @@ def query_conservation_layers(
             print_warning_msg(msg_value_error)
             continue
 
+    # the attribute column is only read from the layer files once it is filtered on, it is added
+    # to the loaded layers so the filtered layers have the same columns and still map onto them
+    if attribute:
+        load_columns(conserv_layers, attribute, verbose)
+
+    # This will reset the list of layers to the original loaded layers every time, the
+    # filtered layers are shallow copies that share the data of the loaded layers
+    filtered_conserv_layers = []
+    for layer in conserv_layers:
+        filtered_conserv_layers.append(layer.copy(deep=False))
+    for i in range(len(conserv_layers)):
+        filtered_conserv_layers[i].name = "".join(conserv_layers[i].name.split(".")[:-1])+"_filtered" if hasattr(conserv_layers[i], "name") else f"filtered_{i}"
+
     if attribute:
         filtered_conserv_layers = filter_by_attribute(filtered_conserv_layers, attribute)
 
@@ -747,7 +754,9 @@ def query_conservation_layers(
 
 
 # %% Calculate planning unit / conservation feature overlap
-def calculate(planning_grid: gpd.GeoDataFrame, cons_layers: list[gpd.GeoDataFrame]) -> list[gpd.GeoDataFrame]:
+def calculate(
+    planning_grid: gpd.GeoDataFrame, cons_layers: list[gpd.GeoDataFrame], cell_area: float = None, prepare: bool = True
+) -> list[gpd.GeoDataFrame]:
     """Target function for processor pool. Intersects planning grid with each conservation layer
     and calculates area of overlap.
     Author: Mitch Albert
@@ -756,6 +765,10 @@ def calculate(planning_grid: gpd.GeoDataFrame, cons_layers: list[gpd.GeoDataFram
     :type planning_grid: gpd.GeoDataFrame
     :param cons_layers: The conservation layers to intersect with the planning grid.
     :type cons_layers: list[gpd.GeoDataFrame]
+    :param cell_area: The area of every planning unit of a lattice grid, defaults to None.
+    :type cell_area: float, optional
+    :param prepare: Prepare the features, see :func:`~overlap.overlap_pairs`, defaults to True.
+    :type prepare: bool, optional
     :return: The list of conservation layers after being intersected with the planning grid
              with an additional column containing the area of overlap.
     :rtype: list[gpd.GeoDataFrame]
@@ -763,80 +776,884 @@ def calculate(planning_grid: gpd.GeoDataFrame, cons_layers: list[gpd.GeoDataFram
     intersections = []
     for layer in cons_layers:
         if not layer.empty:
-            clipped_grid = gpd.clip(planning_grid, layer.geometry.convex_hull)
-            intersection = gpd.overlay(clipped_grid, layer, how="intersection")
-            intersection[AMOUNT] = intersection.area
-            intersection[AMOUNT] = intersection[AMOUNT].round().astype(int)
-            intersections.append(intersection)
+            intersections.append(intersect_layer(planning_grid, layer, cell_area, prepare=prepare))
         else:
             print_warning_msg("Skipping empty conservation layer.")
 
     return intersections
 
 
-def calculate_overlap(planning_grid: gpd.GeoDataFrame, cons_layers: list[gpd.GeoDataFrame]) -> list[gpd.GeoDataFrame]:
+def init_worker(
+    planning_grid: PlanningGrid | gpd.GeoDataFrame,
+    chunks: list[np.ndarray],
+    cons_layers: list[gpd.GeoDataFrame],
+    cell_area: float = None,
+    filters: list[tuple[int, np.ndarray]] = None,
+    threads: bool = False,
+) -> None:
+    """Processor pool initializer. Stores the planning grid, the chunk positions, the
+    conservation layers and the layer filters once in each worker, so the tasks only need to
+    carry a chunk number.
+    The serial and thread backends call it once in the main process and share the state.
+    Layers with features of more than OVERLAP_MAX_VERTICES vertices are split into pieces once
+    by :func:`~overlap.split_features`, with a spatial index of the pieces, before any task runs.
+    The features and pieces are prepared here for the serial and process backends. The threads
+    of the thread backend share the geometries and spatial indexes without copies, so the
+    geometries are left unprepared and each test prepares a temporary copy in its own thread,
+    see :func:`~overlap.overlap_pairs`.
+
+    :param planning_grid: The planning grid.
+    :type planning_grid: PlanningGrid | gpd.GeoDataFrame
+    :param chunks: The positions of the planning units in each chunk.
+    :type chunks: list[np.ndarray]
+    :param cons_layers: The conservation layers, the tasks select the filtered rows of each.
+    :type cons_layers: list[gpd.GeoDataFrame]
+    :param cell_area: The area of every planning unit of a lattice grid, defaults to None.
+    :type cell_area: float, optional
+    :param filters: The layer number and row positions of each layer to calculate from
+                    :func:`~overlap.layer_filters`, defaults to None.
+    :type filters: list[tuple[int, np.ndarray]], optional
+    :param threads: The chunks run on several threads of this process, defaults to False.
+    :type threads: bool, optional
+    """
+    worker_state["grid"] = planning_grid
+    worker_state["chunks"] = chunks
+    worker_state["cell_area"] = cell_area
+    worker_state["filters"] = filters
+    worker_state["filters_file"] = None
+    worker_state["layers_file"] = None
+    set_worker_layers(cons_layers, threads)
+    return
+
+
+def set_worker_layers(cons_layers: list[gpd.GeoDataFrame], threads: bool = False) -> None:
+    """Store the conservation layers and their prepared feature geometries in the worker state,
+    splitting the features of more than OVERLAP_MAX_VERTICES vertices into pieces, see
+    :func:`~init_worker`.
+
+    :param cons_layers: The conservation layers.
+    :type cons_layers: list[gpd.GeoDataFrame]
+    :param threads: The chunks run on several threads of this process, defaults to False.
+    :type threads: bool, optional
+    """
+    features, sources, sindexes = [], [], []
+    for layer in cons_layers:
+        # the spatial index of a layer is built lazily, build it before the tasks share it
+        layer.sindex
+        layer_features = valid_features(layer.geometry.values)
+        source = sindex = None
+        if (shapely.get_num_coordinates(layer_features) > OVERLAP_MAX_VERTICES).any():
+            layer_features, source = split_features(layer_features)
+            sindex = shapely.STRtree(layer_features)
+        if threads:
+            # a previous serial run may have prepared the shared geometries in place
+            shapely.destroy_prepared(layer_features)
+        else:
+            shapely.prepare(layer_features)
+        features.append(layer_features)
+        sources.append(source)
+        sindexes.append(sindex)
+    worker_state["layers"] = cons_layers
+    worker_state["features"] = features
+    worker_state["sources"] = sources
+    worker_state["sindexes"] = sindexes
+    worker_state["prepare"] = not threads
+    return
+
+
+def worker_layers(layers_file: str = None) -> tuple[list[gpd.GeoDataFrame], list[np.ndarray], list[np.ndarray], list]:
+    """Get the conservation layers and their prepared feature geometries from the worker state
+    set by :func:`~init_worker`. The workers of a session pool that was started with other
+    layers load the layers of each later calculation once from the file saved by
+    :meth:`~OverlapPool.load_layers`.
+
+    :param layers_file: The pickle file of the layers, defaults to None which uses the layers set
+                        by :func:`~init_worker`.
+    :type layers_file: str, optional
+    :return: The conservation layers, the feature or piece geometries of each layer, the feature
+             position of each piece or None for layers that were not split, and the spatial index
+             of the pieces or None for layers that were not split.
+    :rtype: tuple[list[gpd.GeoDataFrame], list[np.ndarray], list[np.ndarray], list]
+    """
+    if layers_file is not None and worker_state["layers_file"] != layers_file:
+        set_worker_layers(pd.read_pickle(layers_file))
+        worker_state["layers_file"] = layers_file
+    return (worker_state["layers"], worker_state["features"], worker_state["sources"], worker_state["sindexes"])
+
+
+def worker_filters(filters_file: str = None) -> list[tuple[int, np.ndarray]]:
+    """Get the layer filters of the current calculation. The workers of a session pool that
+    was started by an earlier calculation load the filters of each later calculation once from
+    the file saved by :func:`~overlap.save_filters`.
+
+    :param filters_file: The file of the filters, defaults to None which uses the filters set by
+                         :func:`~init_worker`.
+    :type filters_file: str, optional
+    :return: The layer number and row positions of each layer to calculate.
+    :rtype: list[tuple[int, np.ndarray]]
+    """
+    if filters_file is not None and worker_state["filters_file"] != filters_file:
+        worker_state["filters"] = load_filters(filters_file)
+        worker_state["filters_file"] = filters_file
+    return worker_state["filters"]
+
+
+def lattice_chunks() -> bool:
+    """Check if the worker calculates the overlap by cutting the features along the lattice of the
+    planning grid with :func:`~overlap.lattice_overlap`, which needs a generated grid.
+
+    :return: True if the planning grid is a PlanningGrid and OVERLAP_LATTICE is set.
+    :rtype: bool
+    """
+    return OVERLAP_LATTICE and isinstance(worker_state["grid"], PlanningGrid)
+
+
+def calculate_chunk(
+    task: tuple[int, str, str, bool],
+) -> tuple[int, list[gpd.GeoDataFrame] | list[tuple[int, np.ndarray, np.ndarray, np.ndarray]]]:
+    """Target function for processor pool. Builds one chunk of the planning grid from the worker
+    state set by :func:`~init_worker` and intersects it with the filtered features of each
+    conservation layer whose bounding box overlaps the chunk. Unless the intersection geometries
+    were asked for, only the compact overlap arrays of :func:`~overlap_amounts` are sent back.
+
+    :param task: The number of the chunk to calculate, the files of the layers and of the layer
+                 filters or None, see :func:`~worker_layers` and :func:`~worker_filters`, and
+                 whether to return the intersection gdfs.
+    :type task: tuple[int, str, str, bool]
+    :return: The chunk number, and the intersections of the chunk with each conservation layer,
+             or the layer number, feature positions, GRID_IDs and areas of overlap of each layer.
+    :rtype: tuple[int, list[gpd.GeoDataFrame] | list[tuple[int, np.ndarray, np.ndarray, np.ndarray]]]
+    """
+    chunk, layers_file, filters_file, geometries = task
+    layers, features, sources, piece_sindexes = worker_layers(layers_file)
+    filters = worker_filters(filters_file)
+    sindexes = [worker_state["layers"][layer_no].sindex for layer_no, _ in filters]
+    rows = [layer_rows for _, layer_rows in filters]
+    if not geometries and lattice_chunks():
+        planning_grid = worker_state["grid"]
+        positions = worker_state["chunks"][chunk]
+        x, y = planning_grid.x[positions], planning_grid.y[positions]
+        bounds = np.array(
+            [
+                x.min() - planning_grid.side,
+                y.min() - planning_grid.lattice.v_step / 2,
+                x.max() + planning_grid.side,
+                y.max() + planning_grid.lattice.v_step / 2,
+            ]
+        )
+        results = lattice_amounts(
+            planning_grid.lattice,
+            positions + 1,
+            bounds,
+            [features[layer_no] for layer_no, _ in filters],
+            [
+                sindex if piece_sindexes[layer_no] is None else piece_sindexes[layer_no]
+                for (layer_no, _), sindex in zip(filters, sindexes)
+            ],
+            rows,
+            [sources[layer_no] for layer_no, _ in filters],
+        )
+        return (chunk, [(filters[i][0], feature, puid, amount) for i, feature, puid, amount in results])
+    grid_chunk = grid_take(worker_state["grid"], worker_state["chunks"][chunk])
+    if not geometries:
+        results = overlap_amounts(
+            grid_chunk,
+            [features[layer_no] for layer_no, _ in filters],
+            [
+                sindex if piece_sindexes[layer_no] is None else piece_sindexes[layer_no]
+                for (layer_no, _), sindex in zip(filters, sindexes)
+            ],
+            worker_state["cell_area"],
+            rows,
+            [sources[layer_no] for layer_no, _ in filters],
+            worker_state["prepare"],
+        )
+        return (chunk, [(filters[i][0], feature, puid, amount) for i, feature, puid, amount in results])
+    bounds = grid_chunk.total_bounds
+    subsets = [
+        layer_subset(layers[layer_no], bounds, sindex, layer_rows)
+        for (layer_no, layer_rows), sindex in zip(filters, sindexes)
+    ]
+    subsets = [subset for subset in subsets if not subset.empty]
+    return (chunk, calculate(grid_chunk, subsets, worker_state["cell_area"], worker_state["prepare"]))
+
+
+class OverlapPool:
+    """A processor pool owned by the session that keeps the planning grid, its chunks and the
+    conservation layers resident in the workers between overlap calculations. While the grid and
+    layers stay the same each calculation only sends the chunk numbers and the file of its layer
+    filters, which each worker reads once. New layers for the same grid, such as the batches of
+    :func:`~stream_overlap`, are sent the same way through a layers file.
+    The pool is restarted when the grid changes and must be closed at the end of the session.
+    """
+
+    def __init__(self) -> None:
+        self.pool = None
+        self.grid = None
+        self.layers = []
+        self.chunks = []
+        self.layers_file = None
+
+    def has_grid(self, planning_grid: PlanningGrid | gpd.GeoDataFrame) -> bool:
+        """Check if the workers are running with this planning grid.
+
+        :param planning_grid: The planning grid.
+        :type planning_grid: PlanningGrid | gpd.GeoDataFrame
+        :return: True if the pool is running with the same grid object.
+        :rtype: bool
+        """
+        return self.pool is not None and self.grid is planning_grid
+
+    def is_warm(self, planning_grid: PlanningGrid | gpd.GeoDataFrame, cons_layers: list[gpd.GeoDataFrame]) -> bool:
+        """Check if the workers already hold this planning grid and these conservation layers.
+
+        :param planning_grid: The planning grid.
+        :type planning_grid: PlanningGrid | gpd.GeoDataFrame
+        :param cons_layers: The conservation layers.
+        :type cons_layers: list[gpd.GeoDataFrame]
+        :return: True if the pool is running with the same grid and layer objects.
+        :rtype: bool
+        """
+        return (
+            self.has_grid(planning_grid)
+            and len(self.layers) == len(cons_layers)
+            and all(a is b for a, b in zip(self.layers, cons_layers))
+        )
+
+    def start(
+        self,
+        planning_grid: PlanningGrid | gpd.GeoDataFrame,
+        chunks: list[np.ndarray],
+        cons_layers: list[gpd.GeoDataFrame],
+        cell_area: float = None,
+        filters: list[tuple[int, np.ndarray]] = None,
+    ) -> None:
+        """Start the workers with the planning grid, chunks, conservation layers and layer
+        filters, closing the workers of a previous grid or layers first.
+
+        :param planning_grid: The planning grid.
+        :type planning_grid: PlanningGrid | gpd.GeoDataFrame
+        :param chunks: The positions of the planning units in each chunk.
+        :type chunks: list[np.ndarray]
+        :param cons_layers: The conservation layers.
+        :type cons_layers: list[gpd.GeoDataFrame]
+        :param cell_area: The area of every planning unit of a lattice grid, defaults to None.
+        :type cell_area: float, optional
+        :param filters: The layer filters of the first calculation, defaults to None.
+        :type filters: list[tuple[int, np.ndarray]], optional
+        """
+        self.close()
+        self.pool = Pool(CORES, initializer=init_worker, initargs=(planning_grid, chunks, cons_layers, cell_area, filters))
+        self.grid = planning_grid
+        self.layers = list(cons_layers)
+        self.chunks = chunks
+        return
+
+    def load_layers(self, cons_layers: list[gpd.GeoDataFrame]) -> None:
+        """Send new conservation layers to the running workers, which keep the planning grid and
+        its chunks. The layers are saved to a file that each worker reads once, see
+        :func:`~worker_layers`.
+
+        :param cons_layers: The conservation layers.
+        :type cons_layers: list[gpd.GeoDataFrame]
+        """
+        self.remove_layers_file()
+        handle, self.layers_file = tempfile.mkstemp(suffix=".pkl")
+        os.close(handle)
+        pd.to_pickle(list(cons_layers), self.layers_file)
+        self.layers = list(cons_layers)
+        return
+
+    def remove_layers_file(self) -> None:
+        """Remove the layers file of the previous :meth:`~load_layers`."""
+        if self.layers_file is not None:
+            os.remove(self.layers_file)
+        self.layers_file = None
+        return
+
+    def close(self, terminate: bool = False) -> None:
+        """Shut down the workers and release the grid and layers.
+
+        :param terminate: Stop the workers without waiting for queued tasks, such as after the
+                          calculation was aborted, defaults to False.
+        :type terminate: bool, optional
+        """
+        if self.pool is not None:
+            if terminate:
+                self.pool.terminate()
+            else:
+                self.pool.close()
+            self.pool.join()
+        self.remove_layers_file()
+        self.pool = None
+        self.grid = None
+        self.layers = []
+        self.chunks = []
+        return
+
+
+def overlap_work(planning_grid: PlanningGrid | gpd.GeoDataFrame, cons_layers: list[gpd.GeoDataFrame]) -> int:
+    """Measure the size of an overlap calculation as the number of planning units plus the
+    number of feature vertices.
+
+    :param planning_grid: The planning grid.
+    :type planning_grid: PlanningGrid | gpd.GeoDataFrame
+    :param cons_layers: The conservation layers.
+    :type cons_layers: list[gpd.GeoDataFrame]
+    :return: The size of the calculation.
+    :rtype: int
+    """
+    return len(planning_grid) + sum(int(shapely.get_num_coordinates(layer.geometry.values).sum()) for layer in cons_layers)
+
+
+def overlap_backend(planning_grid: PlanningGrid | gpd.GeoDataFrame, cons_layers: list[gpd.GeoDataFrame], backend: str = None) -> str:
+    """Choose how the overlap calculation is run. Serial runs the chunks in the main process,
+    thread runs them on a thread pool sharing the grid and layers in memory, which works because
+    the shapely intersection and area calls release the GIL, and process runs them on a processor
+    pool. Auto picks serial for small jobs, where starting workers costs more than the work,
+    threads for medium jobs and processes for large jobs, using the number of planning units plus
+    the number of feature vertices as the size of the job.
+
+    :param planning_grid: The planning grid.
+    :type planning_grid: PlanningGrid | gpd.GeoDataFrame
+    :param cons_layers: The non-empty conservation layers.
+    :type cons_layers: list[gpd.GeoDataFrame]
+    :param backend: One of OVERLAP_BACKENDS, defaults to None which uses OVERLAP_BACKEND.
+    :type backend: str, optional
+    :raises ValueError: If the backend is not one of OVERLAP_BACKENDS.
+    :return: The backend to use, serial, thread or process.
+    :rtype: str
+    """
+    backend = (backend or OVERLAP_BACKEND).lower()
+    if backend not in OVERLAP_BACKENDS:
+        raise ValueError(f"Unknown overlap backend {backend}, expected one of {OVERLAP_BACKENDS}")
+    if backend != "auto":
+        return backend
+    if CORES < 2:
+        return "serial"
+    work = overlap_work(planning_grid, cons_layers)
+    if work < OVERLAP_SERIAL_MAX_WORK:
+        return "serial"
+    if work < OVERLAP_THREAD_MAX_WORK:
+        return "thread"
+    return "process"
+
+
+def run_overlap(
+    planning_grid: PlanningGrid | gpd.GeoDataFrame,
+    base_layers: list[gpd.GeoDataFrame],
+    filters: list[tuple[int, np.ndarray]],
+    geometries: bool = False,
+    backend: str = None,
+    pool: OverlapPool = None,
+    cache: OverlapCache = None,
+    chunks: list[np.ndarray] = None,
+    checkpoint: bool = True,
+) -> list[gpd.GeoDataFrame] | list[tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+    """Run the chunks of the planning grid against the filtered base layers on the backend
+    chosen by :func:`~overlap_backend`. Unless the intersection geometries are asked for, the
+    overlap arrays of each chunk of a calculation of at least OVERLAP_CHECKPOINT_MIN_WORK, see
+    :func:`~overlap_work`, are saved to a checkpoint as they arrive, so if the calculation is
+    interrupted running it again only calculates the chunks that did not finish. The checkpoint
+    is removed once every chunk has finished.
+
+    :param planning_grid: The planning grid.
+    :type planning_grid: PlanningGrid | gpd.GeoDataFrame
+    :param base_layers: The base layers from :func:`~overlap.layer_filters`.
+    :type base_layers: list[gpd.GeoDataFrame]
+    :param filters: The layer number and row positions of each layer to calculate.
+    :type filters: list[tuple[int, np.ndarray]]
+    :param geometries: Return the intersection gdfs with their geometries, defaults to False.
+    :type geometries: bool, optional
+    :param backend: Run the chunks serially, on threads or on processes, defaults to None which
+                    uses OVERLAP_BACKEND.
+    :type backend: str, optional
+    :param pool: The session pool used by the process backend instead of a new pool, its workers
+                 are kept while the grid stays the same, defaults to None.
+    :type pool: OverlapPool, optional
+    :param cache: The session cache, used for the fingerprints that identify the checkpoint,
+                  defaults to None.
+    :type cache: OverlapCache, optional
+    :param chunks: The positions of the planning units in each chunk from
+                   :func:`~overlap.partition_grid`, defaults to None which partitions the grid.
+    :type chunks: list[np.ndarray], optional
+    :param checkpoint: Save the finished chunks to a checkpoint, defaults to True.
+    :type checkpoint: bool, optional
+    :return: The results of every chunk, see :func:`~calculate_chunk`.
+    :rtype: list[gpd.GeoDataFrame] | list[tuple[int, np.ndarray, np.ndarray, np.ndarray]]
+    """
+    layers = [base_layers[layer_no] for layer_no, _ in filters]
+    backend = overlap_backend(planning_grid, layers, backend)
+    warm = backend == "process" and pool is not None and pool.has_grid(planning_grid)
+
+    if warm:
+        chunks = pool.chunks
+    elif chunks is None:
+        # order the planning units along a Hilbert curve and split them into many more spatially
+        # compact chunks than cores, each chunk is paired only with the features near it so the
+        # coastline heavy chunks are spread across the workers
+        x, y = grid_centers(planning_grid)
+        chunks = partition_grid(x, y, CORES * OVERLAP_CHUNKS_PER_CORE)
+
+    # the planning units of a lattice grid all have the same known area
+    cell_area = planning_grid.lattice.cell_area if isinstance(planning_grid, PlanningGrid) else None
+
+    # build the spatial indexes before the workers start so they inherit or share them instead
+    # of each building their own
+    for layer in base_layers:
+        layer.sindex
+
+    initargs = (planning_grid, chunks, base_layers, cell_area, filters)
+
+    # this will hold the results of the pool
+    intersections = []
+
+    # the checkpoint of an interrupted run of the same job holds the chunks already finished
+    use_checkpoint = checkpoint
+    checkpoint = None
+    finished = {}
+    if (
+        not geometries
+        and use_checkpoint
+        and OVERLAP_CHECKPOINT
+        and overlap_work(planning_grid, layers) >= OVERLAP_CHECKPOINT_MIN_WORK
+    ):
+        fingerprint = (cache or OverlapCache()).fingerprint
+        job = overlap_job_key(
+            fingerprint(planning_grid), [fingerprint(base_layers[layer_no]) for layer_no, _ in filters], filters, len(chunks)
+        )
+        checkpoint = os.path.join(os.path.expanduser(OVERLAP_CHECKPOINT_DIR), job)
+        finished = load_checkpoint(checkpoint)
+        for result in finished.values():
+            intersections.extend(result)
+    # the filters are sent once to each worker, by the initializer or by a file the workers of a
+    # warm pool read once, instead of with every task
+    filters_file = None
+    if warm:
+        if not pool.is_warm(planning_grid, base_layers):
+            pool.load_layers(base_layers)
+        handle, filters_file = tempfile.mkstemp(suffix=".npz")
+        os.close(handle)
+        save_filters(filters_file, filters)
+    layers_file = pool.layers_file if warm else None
+    tasks = [(chunk, layers_file, filters_file, geometries) for chunk in range(len(chunks)) if chunk not in finished]
+
+    def run_tasks():
+        """Run the tasks on the chosen backend, yielding each chunk's results as they finish."""
+        if backend == "process" and pool is not None:
+            # the session pool keeps its workers, they are only restarted for a new grid
+            if not warm:
+                pool.start(*initargs)
+            try:
+                yield from pool.pool.imap_unordered(calculate_chunk, tasks)
+            except BaseException:
+                # queued tasks of an aborted calculation must not keep the workers busy
+                pool.close(terminate=True)
+                raise
+        elif backend == "process":
+            # Create a Pool object with the number of cores specified in CORES, the grid, layers and
+            # filters are sent once to each worker by the initializer and each task is only a chunk number
+            with Pool(CORES, initializer=init_worker, initargs=initargs) as process_pool:
+                yield from process_pool.imap_unordered(calculate_chunk, tasks)
+        else:
+            # serial and threads share the grid and layer attributes of the main process
+            init_worker(*initargs, threads=backend == "thread")
+            try:
+                if backend == "thread":
+                    executor = ThreadPoolExecutor(CORES)
+                    try:
+                        yield from executor.map(calculate_chunk, tasks)
+                    finally:
+                        executor.shutdown(cancel_futures=True)
+                else:
+                    for task in tasks:
+                        yield calculate_chunk(task)
+            finally:
+                worker_state.clear()
+
+    if verbose:
+        workers = "1 core" if backend == "serial" else f"{CORES} {'threads' if backend == 'thread' else 'cores'}"
+        if finished:
+            print_info(f"Resuming from checkpoint with {len(finished)} of {len(chunks)} chunks finished")
+        print_info(f"Starting intersection calculations of {len(tasks)} chunks with {workers}")
+        progress = print_progress_start("Calculating intersections", dots=10, time=1)
+    # start timer
+    start_time = time()
+    try:
+        for chunk, result in run_tasks():
+            intersections.extend(result)
+            if checkpoint is not None:
+                save_checkpoint_chunk(checkpoint, chunk, result)
+    finally:
+        if filters_file is not None:
+            os.remove(filters_file)
+        if verbose:
+            print_progress_stop(progress)
+
+    if checkpoint is not None:
+        shutil.rmtree(checkpoint, ignore_errors=True)
+    if verbose:
+        print_info_complete(f"Intersection calculations completed in: {(time() - start_time):.2f} seconds")
+
+    return intersections
+
+
+def calculate_overlap(
+    planning_grid: PlanningGrid | gpd.GeoDataFrame,
+    cons_layers: list[gpd.GeoDataFrame],
+    geometries: bool = False,
+    backend: str = None,
+    pool: OverlapPool = None,
+    base_layers: list[gpd.GeoDataFrame] = None,
+    cache: OverlapCache = None,
+) -> pd.DataFrame | list[gpd.GeoDataFrame]:
     """Intersect the planning grid with the conservation layers and calculate the area of overlap.
+    By default the workers only send back the GRID_ID, conservation feature and area of each
+    overlap as compact arrays, the intersection geometries are only built when asked for.
+    The conservation layers are sent to the workers as row filters of the base layers, so a
+    session pool that already holds the grid and base layers only receives the filters. With a
+    session cache only the feature rows that were not calculated before are sent to the workers.
     Author: Mitch Albert
 
     :param planning_grid: The planning grid to intersect with conservation layers.
-    :type planning_grid: gpd.GeoDataFrame
+    :type planning_grid: PlanningGrid | gpd.GeoDataFrame
     :param cons_layers: A list of conservation layers that should contain only the desired
                         conservation features to intersect with the planning grid.
     :type cons_layers: list[gpd.GeoDataFrame]
-    :return: The intersected gdfs, or an empty list if planning grid or conservation layers are not loaded,
-             or if there are no intersecting features. The list will contain CORES * len(cons_layers) gdfs
-    :rtype: list[gpd.GeoDataFrame]
+    :param geometries: Return the intersection gdfs with their geometries, defaults to False.
+    :type geometries: bool, optional
+    :param backend: Run the chunks serially, on threads or on processes, see :func:`~overlap_backend`,
+                    defaults to None which uses OVERLAP_BACKEND.
+    :type backend: str, optional
+    :param pool: The session pool used by the process backend instead of a new pool, defaults to None.
+    :type pool: OverlapPool, optional
+    :param base_layers: The layers the conservation layers were filtered from, such as the loaded
+                        conservation layers, defaults to None.
+    :type base_layers: list[gpd.GeoDataFrame], optional
+    :param cache: The session cache of overlap arrays, not used for geometries, defaults to None.
+    :type cache: OverlapCache, optional
+    :return: The ID, GRID_ID and AMOUNT of every overlap sorted by GRID_ID, or if geometries is True
+             the intersected gdfs, up to one gdf per chunk and layer. Empty if planning grid or
+             conservation layers are not loaded, or if there are no intersecting features.
+    :rtype: pd.DataFrame | list[gpd.GeoDataFrame]
     """
+    no_results = [] if geometries else pd.DataFrame(columns=[ID, PUID, AMOUNT])
 
-    # check if planning grid and conservation layers are loaded, otherwise return empty list
+    # check if planning grid and conservation layers are loaded, otherwise return empty results
     if not len(cons_layers):
         print_warning_msg("No conservation feature layers loaded.")
-        return []
+        return no_results
     if planning_grid.empty:
         print_warning_msg("No planning unit grid loaded.")
-        return []
+        return no_results
+
+    # skip empty layers up front so the chunks only carry layers with features, the overlap
+    # arrays identify each conservation feature by its ID so layers without one are skipped
+    layers = []
+    for layer in cons_layers:
+        if layer.empty:
+            print_warning_msg("Skipping empty conservation layer.")
+        elif not geometries and ID not in layer.columns:
+            print_warning_msg(f"Skipping conservation layer without {ID} column.")
+        else:
+            layers.append(layer)
+    if not layers:
+        return no_results
+
+    # each layer is sent to the workers as the row positions it keeps of a base layer
+    base_layers, filters = layer_filters(base_layers or [], layers)
+
+    if geometries:
+        intersections = run_overlap(planning_grid, base_layers, filters, True, backend, pool)
+        # sort the results by PUID, ID, and AMOUNT
+        for i in range(len(intersections)):
+            intersections[i] = intersections[i].sort_values([PUID, ID, AMOUNT])
+        if not any(not layer.empty for layer in intersections):
+            print_warning_msg("No intersecting features found.")
+        return intersections
+
+    if cache is None:
+        results = run_overlap(planning_grid, base_layers, filters, False, backend, pool)
+    else:
+        # only calculate the rows of each base layer that are not cached yet
+        cache.use_grid(planning_grid)
+        needed = {}
+        for layer_no, rows in filters:
+            missing = cache.missing(base_layers[layer_no], rows)
+            if layer_no in needed:
+                missing = np.union1d(needed[layer_no], missing)
+            needed[layer_no] = missing
+        compute = [
+            (layer_no, None if len(rows) == len(base_layers[layer_no]) else rows.astype(np.int32))
+            for layer_no, rows in needed.items()
+            if len(rows)
+        ]
+        if compute:
+            computed = run_overlap(planning_grid, base_layers, compute, False, backend, pool, cache)
+        else:
+            computed = []
+            if verbose:
+                print_info_complete("All intersections found in the session cache")
+        for layer_no, rows in compute:
+            parts = [result for result in computed if result[0] == layer_no]
+            cache.add(
+                base_layers[layer_no],
+                rows,
+                np.concatenate([feature for _, feature, _, _ in parts] or [np.empty(0, dtype=np.int32)]),
+                np.concatenate([puid for _, _, puid, _ in parts] or [np.empty(0, dtype=np.int32)]),
+                np.concatenate([amount for _, _, _, amount in parts] or [np.empty(0, dtype=np.int64)]),
+            )
+        results = [(layer_no, *cache.take(base_layers[layer_no], rows)) for layer_no, rows in filters]
 
-    # split planning grid into chunks to be processed by each core
-    planning_grid_divisions = np.array_split(planning_grid, CORES)
+    species = [layer[ID].to_numpy() if ID in layer.columns else None for layer in base_layers]
+    intersections = overlap_frame(results, species)
 
-    # define partial function to pass to pool, this enables passing multiple arguments to calculate() from the pool
-    # otherwise we would have to pass a tuple of arguments
-    calc_overlap_partial = partial(calculate, cons_layers=cons_layers)
+    # check if any results were found
+    if intersections.empty:
+        print_warning_msg("No intersecting features found.")
 
-    # this will hold the results of the pool
-    intersections = []
+    return intersections
+
+
+def stream_overlap(
+    planning_grid: PlanningGrid | gpd.GeoDataFrame,
+    files: list[str],
+    batch_size: int = None,
+    backend: str = None,
+    pool: OverlapPool = None,
+) -> Iterator[pd.DataFrame]:
+    """Calculate the overlap of the planning grid with conservation layers read straight from their
+    files, for layers larger than memory. Each layer is read a batch of features at a time with
+    :func:`~util.iter_file_batches`, the batch is projected to the grid's CRS and intersected with
+    the grid, and its results are yielded before the next batch is read, so the memory used only
+    depends on the batch size. The grid is partitioned into chunks once for the whole stream, the
+    process backend starts its workers with the grid once and sends them each batch through a
+    layers file, see :class:`~OverlapPool`, and the batches are not checkpointed.
+
+    :param planning_grid: The planning grid.
+    :type planning_grid: PlanningGrid | gpd.GeoDataFrame
+    :param files: The conservation layer files.
+    :type files: list[str]
+    :param batch_size: The most features read at a time, defaults to None which uses STREAM_BATCH_SIZE.
+    :type batch_size: int, optional
+    :param backend: Run the chunks of each batch serially, on threads or on processes, defaults to
+                    None which uses OVERLAP_BACKEND.
+    :type backend: str, optional
+    :param pool: The session pool used by the process backend, defaults to None which starts a
+                 pool for the stream that is closed at its end.
+    :type pool: OverlapPool, optional
+    :yield: The ID, GRID_ID and AMOUNT of the overlaps of each batch.
+    :rtype: Iterator[pd.DataFrame]
+    """
+    batch_size = batch_size or STREAM_BATCH_SIZE
+    # the grid is the same for every batch, so it is only partitioned once
+    x, y = grid_centers(planning_grid)
+    chunks = partition_grid(x, y, CORES * OVERLAP_CHUNKS_PER_CORE)
+    stream_pool = pool or OverlapPool()
+    try:
+        for file in files:
+            try:
+                for batch_no, batch in enumerate(iter_file_batches(file, batch_size)):
+                    if ID not in batch.columns:
+                        print_warning_msg(f"Skipping {batch.name} without {ID} column.")
+                        break
+                    if verbose:
+                        print_info(
+                            f"Streaming {batch.name} features {batch_no * batch_size + 1} to {batch_no * batch_size + len(batch)}"
+                        )
+                    if batch.crs != planning_grid.crs:
+                        batch = batch.to_crs(planning_grid.crs)
+                    # a batch is quick to redo, so it is not checkpointed
+                    results = run_overlap(
+                        planning_grid, [batch], [(0, None)], backend=backend, pool=stream_pool, chunks=chunks, checkpoint=False
+                    )
+                    yield overlap_frame(results, [batch[ID].to_numpy()])
+                    del batch, results
+            except Exception as e:
+                print_error_msg(f"Error streaming file: {file}\n")
+                print(e)
+                continue
+    finally:
+        if pool is None:
+            stream_pool.close()
+
+
+def calculate_stream_overlap(
+    planning_grid: PlanningGrid | gpd.GeoDataFrame, files: list[str], batch_size: int = None, pool: OverlapPool = None
+) -> pd.DataFrame:
+    """Calculate the overlap of the planning grid with conservation layers streamed from their
+    files with :func:`~stream_overlap`, and combine the results of the batches.
+
+    :param planning_grid: The planning grid.
+    :type planning_grid: PlanningGrid | gpd.GeoDataFrame
+    :param files: The conservation layer files.
+    :type files: list[str]
+    :param batch_size: The most features read at a time, defaults to None which uses STREAM_BATCH_SIZE.
+    :type batch_size: int, optional
+    :param pool: The session pool used by the process backend, defaults to None.
+    :type pool: OverlapPool, optional
+    :return: The ID, GRID_ID and AMOUNT of every overlap sorted by GRID_ID.
+    :rtype: pd.DataFrame
+    """
+    if planning_grid.empty:
+        print_warning_msg("No planning unit grid loaded.")
+        return pd.DataFrame(columns=[ID, PUID, AMOUNT])
+    frames = [frame for frame in stream_overlap(planning_grid, files, batch_size, pool=pool) if not frame.empty]
+    if not frames:
+        print_warning_msg("No intersecting features found.")
+        return pd.DataFrame(columns=[ID, PUID, AMOUNT])
+    return pd.concat(frames, ignore_index=True).sort_values([PUID, ID, AMOUNT], kind="stable", ignore_index=True)
 
-    if verbose:
-        print_info(f"Starting intersection calculations with {CORES} cores")
-        progress = print_progress_start("Calculating intersections", dots=10, time=1)
-    # start timer
-    start_time = time()
-    # Create a Pool object with the number of cores specified in CORES
-    with Pool(CORES) as pool:
-        # Iterate through the planning_grid_divisions and apply the calc_overlap_partial function to each element
-        for result in pool.imap_unordered(calc_overlap_partial, planning_grid_divisions):
-            intersections.extend(result)
 
-    # sort the results by PUID, ID, and AMOUNT
-    for i in range(len(intersections)):
-        intersections[i] = intersections[i].sort_values([PUID, ID, AMOUNT])
+def calculate_raster_overlap(
+    planning_grid: PlanningGrid | gpd.GeoDataFrame, cons_layers: list[gpd.GeoDataFrame], resolution: int = None
+) -> pd.DataFrame:
+    """Estimate the area of overlap of the planning grid with the conservation layers by rasterizing
+    the features with :func:`~overlap.raster_overlap`, for quick exploratory runs. Each amount comes
+    with the most it can differ from the exact area of overlap. Only generated grids can be
+    rasterized along their lattice, other grids get the exact amounts with no error.
 
+    :param planning_grid: The planning grid to intersect with conservation layers.
+    :type planning_grid: PlanningGrid | gpd.GeoDataFrame
+    :param cons_layers: The filtered conservation layers.
+    :type cons_layers: list[gpd.GeoDataFrame]
+    :param resolution: The number of pixels across each half row cell of a hexagon, defaults to None
+                       which uses OVERLAP_RASTER_RESOLUTION.
+    :type resolution: int, optional
+    :return: The ID, GRID_ID, AMOUNT and MAX_ERROR of every nonzero estimated overlap sorted by GRID_ID.
+    :rtype: pd.DataFrame
+    """
+    if not isinstance(planning_grid, PlanningGrid) or planning_grid.empty:
+        if not getattr(planning_grid, "empty", True):
+            print_warning_msg("Only generated planning unit grids can be rasterized, calculating the exact overlap.")
+        intersections = calculate_overlap(planning_grid, cons_layers)
+        intersections[MAX_ERROR] = np.zeros(len(intersections), dtype=np.int64)
+        return intersections
+
+    resolution = resolution or OVERLAP_RASTER_RESOLUTION
+    results = []
+    species = []
     if verbose:
-        print_progress_stop(progress)
-        print_info_complete(f"Intersection calculations completed in: {(time() - start_time):.2f} seconds")
+        print_info(f"Starting approximate overlap calculations at {resolution} pixels per half row")
+        progress = print_progress_start("Rasterizing conservation layers", dots=10, time=1)
+    start_time = time()
+    try:
+        for layer in cons_layers:
+            if layer.empty or ID not in layer.columns:
+                print_warning_msg(f"Skipping empty conservation layer or layer without {ID} column.")
+                continue
+            puid, feature, area, error = raster_overlap(
+                planning_grid.lattice, valid_features(layer.geometry.values), resolution
+            )
+            # the rounded amount is within the error, plus one for rounding, of the exact amount
+            results.append(
+                (
+                    len(species),
+                    feature.astype(np.int32),
+                    puid.astype(np.int32),
+                    np.round(area).astype(np.int64),
+                    np.where(error > 0, np.ceil(error) + 1, 0).astype(np.int64),
+                )
+            )
+            species.append(layer[ID].to_numpy())
+    finally:
+        if verbose:
+            print_progress_stop(progress)
 
-    # check if any results were found
-    results = False
-    for layer in intersections:
-        if not layer.empty:
-            results = True
-            break
-    if not results:
+    intersections = overlap_frame([result for result in results if len(result[1])], species)
+    if intersections.empty:
         print_warning_msg("No intersecting features found.")
-
+        intersections[MAX_ERROR] = np.zeros(0, dtype=np.int64)
+    elif verbose:
+        print_info_complete(f"Approximate overlap calculations completed in: {(time() - start_time):.2f} seconds")
+        print_info(
+            f"Largest error of a planning unit amount: {intersections[MAX_ERROR].max()}, "
+            f"total error bound: {intersections[MAX_ERROR].sum()}"
+        )
     return intersections
 
 
+def calculate_overlap_menu(
+    planning_grid: PlanningGrid | gpd.GeoDataFrame,
+    cons_layers: list[gpd.GeoDataFrame],
+    base_layers: list[gpd.GeoDataFrame],
+    overlap_pool: OverlapPool,
+    overlap_cache: OverlapCache,
+) -> pd.DataFrame | None:
+    """Display the overlap menu and calculate the exact overlap with :func:`~calculate_overlap`, the
+    approximate overlap with :func:`~calculate_raster_overlap`, or the overlap of layers too large
+    to load streamed from their files with :func:`~calculate_stream_overlap`.
+
+    :param planning_grid: The planning grid.
+    :type planning_grid: PlanningGrid | gpd.GeoDataFrame
+    :param cons_layers: The filtered conservation layers.
+    :type cons_layers: list[gpd.GeoDataFrame]
+    :param base_layers: The loaded conservation layers the filtered layers come from.
+    :type base_layers: list[gpd.GeoDataFrame]
+    :param overlap_pool: The session processor pool.
+    :type overlap_pool: OverlapPool
+    :param overlap_cache: The session overlap cache.
+    :type overlap_cache: OverlapCache
+    :return: The overlap results, or None if no calculation was run.
+    :rtype: pd.DataFrame | None
+    """
+    title = bu("Calculate Overlap:")
+    while True:
+        selection = input(
+            f"""
+    {title}
+       [1] Exact Overlap
+        2  Approximate Raster Overlap
+        3  Stream Overlap From Files
+        9  Return to Main Menu
+    >>> """
+        )
+
+        if selection == DEFAULT_INPUT:
+            selection = DEFAULT_OVERLAP_INPUT
+            print(f"\t{selection}")
+        try:
+            selection = int(selection)
+        except ValueError:
+            print_warning_msg(msg_value_error)
+            continue
+
+        # 1 Exact Overlap
+        if selection == 1:
+            return calculate_overlap(
+                planning_grid, cons_layers, pool=overlap_pool, base_layers=base_layers, cache=overlap_cache
+            )
+
+        # 2 Approximate Raster Overlap
+        elif selection == 2:
+            resolution = input(f"Pixels across each half row of a hexagon ([{OVERLAP_RASTER_RESOLUTION}]): ")
+            try:
+                resolution = int(resolution) if resolution != DEFAULT_INPUT else OVERLAP_RASTER_RESOLUTION
+            except ValueError:
+                print_warning_msg(msg_value_error)
+                continue
+            if resolution < 1:
+                print_warning_msg(msg_value_error)
+                continue
+            return calculate_raster_overlap(planning_grid, cons_layers, resolution)
+
+        # 3 Stream Overlap From Files
+        elif selection == 3:
+            files = get_files(title="Select Conservation Feature files to stream")
+            if not files:
+                print_warning_msg("No files selected.")
+                continue
+            return calculate_stream_overlap(planning_grid, files, pool=overlap_pool)
+
+        # 9 Return to Main Menu
+        elif selection == 9:
+            return None
+
+        else:
+            print_warning_msg(msg_value_error)
+            continue
+
+
 # %% CRS helper function
 def validate_crs(crs: any, target_crs: str) -> bool:
     """
@@ -922,7 +1739,7 @@ def validate_crs(crs: any, target_crs: str) -> bool:
 
 # %% Plotting function
 def plot_layers(
-    planning_unit_grid: gpd.GeoDataFrame,
+    planning_unit_grid: PlanningGrid | gpd.GeoDataFrame,
     conserv_layers: list[gpd.GeoDataFrame],
     filtered_conserv_layers: list[gpd.GeoDataFrame],
 ):
@@ -930,7 +1747,7 @@ def plot_layers(
     Author: Mitch Albert
 
     :param planning_unit_grid: The planning unit grid.
-    :type planning_unit_grid: gpd.GeoDataFrame
+    :type planning_unit_grid: PlanningGrid | gpd.GeoDataFrame
     :param conserv_layers: The conservation feature layers without filtering.
     :type conserv_layers: list[gpd.GeoDataFrame]
     :param filtered_conserv_layers: The selected conservation features after filtering.
@@ -999,7 +1816,7 @@ def plot_layers(
         # 1 Planning Unit Grid
         if selection == 1:
             print_info("Plotting Planning Unit Grid...")
-            plot([] if planning_unit_grid.empty else [planning_unit_grid])
+            plot([] if planning_unit_grid.empty else [grid_gdf(planning_unit_grid)])
             break
 
         # 2 All Conservation Features Files
@@ -1032,12 +1849,175 @@ def project_gdfs(gdfs: list[gpd.GeoDataFrame], crs) -> list[gpd.GeoDataFrame]:
             print_info(f"Projecting {name} to {crs}")
             projected_gdfs.append(gdf.to_crs(crs))
         else:
-            projected_gdfs.append(gdf.copy(deep=True))
+            # layers already in the CRS, such as layers loaded from the layer cache, are not copied
+            projected_gdfs.append(gdf.copy(deep=False))
         if hasattr(gdf, "name"):
             projected_gdfs[-1].name = gdf.name
     return projected_gdfs
 
 
+def grid_extent(planning_grid: PlanningGrid | gpd.GeoDataFrame = None) -> gpd.GeoSeries | None:
+    """Get the extent of the planning grid as a polygon that can be transformed to other CRSs.
+    The edges are densified so the transformed polygon still covers the grid when they curve.
+
+    :param planning_grid: The planning grid, defaults to None.
+    :type planning_grid: PlanningGrid | gpd.GeoDataFrame, optional
+    :return: The extent of the grid in its CRS, or None if there is no grid.
+    :rtype: gpd.GeoSeries | None
+    """
+    if planning_grid is None or planning_grid.empty:
+        return None
+    bounds = planning_grid.total_bounds
+    extent = shapely.segmentize(shapely.box(*bounds), max(bounds[2] - bounds[0], bounds[3] - bounds[1]) / 100)
+    return gpd.GeoSeries([extent], crs=planning_grid.crs)
+
+
+def prune_gdfs(gdfs: list[gpd.GeoDataFrame], extent: gpd.GeoSeries) -> list[gpd.GeoDataFrame]:
+    """Drop the features that do not intersect the extent, such as conservation features loaded
+    before the planning grid was created that are outside of it. The kept rows are the same
+    objects as in the original layers so a filtered layer stays a row subset of its base layer.
+
+    :param gdfs: The layers to prune.
+    :type gdfs: list[gpd.GeoDataFrame]
+    :param extent: The area to keep, from :func:`~grid_extent`.
+    :type extent: gpd.GeoSeries
+    :return: The pruned layers.
+    :rtype: list[gpd.GeoDataFrame]
+    """
+    pruned_gdfs = []
+    for gdf in gdfs:
+        if gdf.empty or extent is None:
+            pruned_gdfs.append(gdf)
+            continue
+        area = extent.to_crs(gdf.crs).iloc[0] if gdf.crs else extent.iloc[0]
+        pruned = gdf.iloc[np.sort(gdf.sindex.query(area, predicate="intersects"))]
+        if hasattr(gdf, "name"):
+            pruned.name = gdf.name
+        if verbose and len(pruned) < len(gdf):
+            print_info(f"Dropped {len(gdf) - len(pruned)} features of {getattr(gdf, 'name', '')} outside the planning grid")
+        pruned_gdfs.append(pruned)
+    return pruned_gdfs
+
+
+def grid_layers(
+    planning_grid: PlanningGrid | gpd.GeoDataFrame, base_layers: list[gpd.GeoDataFrame], layers: list[gpd.GeoDataFrame]
+) -> tuple[list[gpd.GeoDataFrame], list[gpd.GeoDataFrame]]:
+    """Prune the loaded and filtered conservation layers to the planning grid with :func:`~prune_gdfs`
+    and project them to its CRS for an overlap calculation. The loaded layers are left whole, so
+    the features outside one grid are still there for the next grid. A filtered layer that is a
+    row subset of a loaded layer is taken from the pruned loaded layer, so it stays a row filter
+    of it, see :func:`~overlap.layer_filters`.
+
+    :param planning_grid: The planning grid.
+    :type planning_grid: PlanningGrid | gpd.GeoDataFrame
+    :param base_layers: The loaded conservation layers.
+    :type base_layers: list[gpd.GeoDataFrame]
+    :param layers: The filtered conservation layers.
+    :type layers: list[gpd.GeoDataFrame]
+    :return: The pruned loaded layers and the pruned filtered layers.
+    :rtype: tuple[list[gpd.GeoDataFrame], list[gpd.GeoDataFrame]]
+    """
+    if planning_grid.empty:
+        return (base_layers, layers)
+    extent = grid_extent(planning_grid)
+    pruned_base = project_gdfs(prune_gdfs(base_layers, extent), planning_grid.crs)
+    pruned_layers = []
+    for layer in layers:
+        for base, pruned in zip(base_layers, pruned_base):
+            if layer_rows(base, layer) is not None:
+                pruned_layers.append(pruned[pruned.index.isin(layer.index)])
+                if hasattr(layer, "name"):
+                    pruned_layers[-1].name = layer.name
+                break
+        else:
+            pruned_layers.extend(project_gdfs(prune_gdfs([layer], extent), planning_grid.crs))
+    return (pruned_base, pruned_layers)
+
+
+# %% Manage the on-disk caches
+def manage_caches(overlap_cache: OverlapCache, layer_cache: DiskCache = None) -> None:
+    """Display the cache menu, showing the size of the on-disk overlap cache or clearing it,
+    clearing the checkpoints of interrupted overlap calculations, or showing or clearing the
+    cache of projected conservation layers.
+
+    :param overlap_cache: The session overlap cache.
+    :type overlap_cache: OverlapCache
+    :param layer_cache: The cache of projected conservation layers, defaults to None.
+    :type layer_cache: DiskCache, optional
+    """
+    layer_cache = layer_cache or DiskCache(LAYER_CACHE_DIR, LAYER_CACHE_MAX_BYTES)
+    title = bu("Manage Caches:")
+    while True:
+        selection = input(
+            f"""
+    {title}
+       [1] Show Overlap Cache
+        2  Clear Overlap Cache
+        3  Clear Overlap Checkpoints
+        4  Show Layer Cache
+        5  Clear Layer Cache
+        9  Return to Main Menu
+    >>> """
+        )
+
+        if selection == DEFAULT_INPUT:
+            selection = DEFAULT_CACHE_INPUT
+            print(f"\t{selection}")
+        try:
+            selection = int(selection)
+        except ValueError:
+            print_warning_msg(msg_value_error)
+            continue
+
+        # 1 Show Overlap Cache
+        if selection == 1:
+            info = overlap_cache.disk.info()
+            print_info(f"Overlap cache: {info['directory']}")
+            print_info(
+                f"{info['files']} cached layer results using {info['bytes'] / 1024**2:.1f} MB "
+                f"of {info['max_bytes'] / 1024**2:.0f} MB"
+            )
+            continue
+
+        # 2 Clear Overlap Cache
+        elif selection == 2:
+            removed = overlap_cache.disk.clear()
+            overlap_cache.clear()
+            print_info_complete(f"Removed {removed} cached layer results")
+            continue
+
+        # 3 Clear Overlap Checkpoints
+        elif selection == 3:
+            shutil.rmtree(os.path.expanduser(OVERLAP_CHECKPOINT_DIR), ignore_errors=True)
+            print_info_complete("Removed the checkpoints of interrupted overlap calculations")
+            continue
+
+        # 4 Show Layer Cache
+        elif selection == 4:
+            info = layer_cache.info()
+            print_info(f"Layer cache: {info['directory']}")
+            print_info(
+                f"{info['files']} cached projected layers using {info['bytes'] / 1024**2:.1f} MB "
+                f"of {info['max_bytes'] / 1024**2:.0f} MB"
+            )
+            continue
+
+        # 5 Clear Layer Cache
+        elif selection == 5:
+            removed = layer_cache.clear()
+            print_info_complete(f"Removed {removed} cached projected layers")
+            continue
+
+        # 9 Return to Main Menu
+        elif selection == 9:
+            break
+
+        else:
+            print_warning_msg(msg_value_error)
+            continue
+    return
+
+
 # %% Main
 def main():
     """Main function. Calls main_menu() which will runs until user enters 9 to exit
@@ -1057,10 +2037,17 @@ def main():
         # filtered_planning_unit_grid = gpd.GeoDataFrame()  # this is the planning unit grid after filtering, now obsolete
         conserv_layers = []  # list of conservation feature layers gdfs, name will change to conservation_features
         filtered_conserv_layers = []  # this is list of conservation_features gdfs after filtering
-        intersections_gdf = []  # list of gdfs of planning unit / conservation feature intersections
+        overlap_layers = None  # the loaded and filtered layers pruned to the planning grid, see grid_layers
         intersections_df = (
             pd.DataFrame()
         )  # dataframe of planning unit / conservation feature intersections, used to easy csv export
+        overlap_pool = OverlapPool()  # session workers that keep the grid and layers between overlap runs
+        overlap_cache = OverlapCache(
+            DiskCache(OVERLAP_CACHE_DIR, OVERLAP_CACHE_MAX_BYTES)
+        )  # session and on-disk cache of the overlap of each conservation feature
+        layer_cache = (
+            DiskCache(LAYER_CACHE_DIR, LAYER_CACHE_MAX_BYTES) if LAYER_CACHE else None
+        )  # on-disk cache of the conservation layers projected to the target CRS
 
 
         if intro:
@@ -1080,6 +2067,7 @@ def main():
         4  View Layers
         5  Calculate Overlap
         6  Save Results
+        7  Manage Caches
         9  Quit
     >>> """
                     )
@@ -1091,9 +2079,8 @@ def main():
             # 1 Create Planning Unit GridFeatures
             if selection == 1:
                 planning_unit_grid = create_planning_unit_grid()
-                if not planning_unit_grid.empty:
-                    conserv_layers = project_gdfs(conserv_layers, planning_unit_grid.crs)
-                    filtered_conserv_layers = project_gdfs(filtered_conserv_layers, planning_unit_grid.crs)
+                overlap_pool.close()
+                overlap_layers = None
                 continue
 
                 # 2 Select Planning Units
@@ -1104,9 +2091,14 @@ def main():
 
             # 2 Load Conservation Features Files
             elif selection == 2:
-                conserv_layers = load_convservation_layers()
+                conserv_layers = load_convservation_layers(planning_unit_grid, layer_cache)
+                overlap_pool.close()
+                overlap_layers = None
+                # the loaded layers stay resident, every query starts again from them and the overlap
+                # workers hold them as the base layers the filtered layers are row selections of, the
+                # unfiltered layers are shallow copies that share their data
                 for layer in conserv_layers:
-                    filtered_conserv_layers.append(layer.copy(deep=True))
+                    filtered_conserv_layers.append(layer.copy(deep=False))
                 for i in range(len(conserv_layers)):
                     filtered_conserv_layers[i].name = (
                         conserv_layers[i].name if hasattr(conserv_layers[i], "name") else ""
@@ -1116,6 +2108,7 @@ def main():
             # 3 Select conservation features
             elif selection == 3:
                 filtered_conserv_layers = query_conservation_layers(conserv_layers)
+                overlap_layers = None
                 continue
 
             # 4 View Layers
@@ -1125,10 +2118,19 @@ def main():
 
             # 5 Calculate Overlap
             elif selection == 5:
-                work_saved = False
-                intersections_gdf = calculate_overlap(planning_unit_grid, filtered_conserv_layers)
-                if len(intersections_gdf):
-                    intersections_df = pd.DataFrame(gpd.GeoDataFrame(pd.concat(intersections_gdf, ignore_index=True)))
+                # features outside the grid are only left out of the calculations, not out of the loaded
+                # layers, so they are still there when another grid is created
+                if overlap_layers is None:
+                    overlap_layers = grid_layers(planning_unit_grid, conserv_layers, filtered_conserv_layers)
+                try:
+                    results = calculate_overlap_menu(
+                        planning_unit_grid, overlap_layers[1], overlap_layers[0], overlap_pool, overlap_cache
+                    )
+                    if results is not None:
+                        intersections_df = results
+                        work_saved = False
+                except KeyboardInterrupt:
+                    print_warning_msg("Overlap Calculation Aborted, the next calculation resumes from the finished chunks\n")
                 continue
 
             # 6 Save Results
@@ -1158,8 +2160,11 @@ def main():
                                 if hasattr(filtered_conserv_layers[i], "name")
                                 else "conservation_layer" + str(i)
                             )
+                            # save every attribute of the layer, not only the columns that were loaded
+                            layer = filtered_conserv_layers[i].copy(deep=False)
+                            load_columns([layer], layer.attrs.get("fields", []), verbose)
                             if not save_gdf(
-                                filtered_conserv_layers[i],
+                                layer,
                                 title="Save filtered conservation feature layer to file",
                                 initialfile=initial_file,
                                 verbose=verbose,
@@ -1177,15 +2182,22 @@ def main():
                     file_name = get_save_file_name(
                         title="Save results to csv", f_types=ft_csv, initialfile=DEFAULT_RESULTS_FILE_NAME
                     )
+                    # approximate results keep the bound on the error of each amount next to it
+                    extra = [MAX_ERROR] if MAX_ERROR in intersections_df.columns else []
                     intersections_df.to_csv(
                         file_name,
-                        header=[SPECIES, PU, AMOUNT],
-                        columns=[ID, PUID, AMOUNT],
+                        header=[SPECIES, PU, AMOUNT] + extra,
+                        columns=[ID, PUID, AMOUNT] + extra,
                         index=False,
                     )
                     work_saved = True
                 continue
 
+            # 7 Manage Caches
+            elif selection == 7:
+                manage_caches(overlap_cache, layer_cache)
+                continue
+
             # 9 Quit
             elif selection == 9:
                 quit = "y"
@@ -1195,6 +2207,7 @@ def main():
                 if quit == "":
                     quit = DEFAULT_QUIT
                 if quit == "y":
+                    overlap_pool.close()
                     break
                 continue
             else:
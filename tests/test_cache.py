@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+test_cache.py
+
+Checks the size bound of the on-disk cache and the file signatures its keys are made of.
+Run with python -m pytest from the project directory.
+"""
+
+# import modules
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cache import DiskCache, file_signature
+
+
+def write_bytes(size: int):
+    """Get a writer of a file of size bytes for DiskCache.put."""
+
+    def write(file_name: str) -> None:
+        with open(file_name, "wb") as file:
+            file.write(b"x" * size)
+
+    return write
+
+
+def test_least_recently_used_files_evicted(tmp_path):
+    # user-014: the cache stays under its size cap by removing the files used longest ago
+    cache = DiskCache(str(tmp_path), 250)
+    for number, key in enumerate("abc"):
+        cache.put(key, ".bin", write_bytes(100))
+        os.utime(cache.path(key, ".bin"), (number, number))
+    assert cache.get("a", ".bin") is None
+    assert cache.size() <= 250
+
+    # reading a file marks it as used, so the other file is removed first
+    assert cache.get("b", ".bin") is not None
+    cache.put("d", ".bin", write_bytes(100))
+    assert [cache.get(key, ".bin") is not None for key in "bcd"] == [True, False, True]
+
+
+def test_file_signature_changes_with_file(tmp_path):
+    # user-025: a cached layer is keyed by the contents of its file and of the files beside it
+    layer = tmp_path / "layer.shp"
+    layer.write_bytes(b"shape")
+    (tmp_path / "layer.dbf").write_bytes(b"attributes")
+    signature = file_signature(str(layer))
+    assert file_signature(str(layer)) == signature
+
+    (tmp_path / "layer.dbf").write_bytes(b"edited attributes")
+    assert file_signature(str(layer)) != signature
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+test_hexgrid.py
+
+Checks generated planning grids against the original per cell grid code, and their
+analytic lattice index against brute force tests on the hexagon polygons. Run with python -m pytest from the project directory.
+"""
+
+# import modules
+import os
+import sys
+from math import ceil, cos, radians, sin, sqrt
+
+import numpy as np
+import shapely
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from defs import *
+from hexgrid import PlanningGrid, build_hexgrid
+from overlap import candidate_pairs
+
+BOUNDS = (1000.0, -2000.0, 61000.0, 38000.0)
+HEX_AREA = 2.5e7
+
+
+@pytest.fixture(params=["full", "clipped"])
+def grid(request) -> PlanningGrid:
+    shapes = None
+    if request.param == "clipped":
+        # a grid clipped to a shape keeps only some hexagons, renumbered from 1
+        shapes = np.array([shapely.Point(31000, 18000).buffer(17000)])
+    return PlanningGrid.from_bounds(BOUNDS, HEX_AREA, TARGET_CRS, shapes)
+
+
+def legacy_hexgrid(bbx, area) -> tuple[np.ndarray, float]:
+    """The per cell hexagon grid the planning grids were first built with, kept as the reference
+    of the vectorized grid.
+    Source: https://gis.stackexchange.com/questions/341218/creating-a-hexagonal-grid-of-regular-hexagons-of-definite-area-anywhere-on-the-g
+    """
+    side = sqrt(area / (1.5 * sqrt(3)))
+    v_step = sqrt(3) * side
+    h_step = 1.5 * side
+    x_min, x_max = min(bbx[0], bbx[2]), max(bbx[0], bbx[2])
+    y_min, y_max = min(bbx[1], bbx[3]), max(bbx[1], bbx[3])
+    h_skip = ceil(x_min / h_step) - 1
+    h_start = h_skip * h_step
+    v_start = (ceil(y_min / v_step) - 1) * v_step
+    h_end = x_max + h_step
+    v_end = y_max + v_step
+    if v_start - (v_step / 2.0) < y_min:
+        v_start_array = [v_start + (v_step / 2.0), v_start]
+    else:
+        v_start_array = [v_start - (v_step / 2.0), v_start]
+    v_start_idx = int(abs(h_skip) % 2)
+
+    hexagons = []
+    c_x = h_start
+    c_y = v_start_array[v_start_idx]
+    v_start_idx = (v_start_idx + 1) % 2
+    while c_x < h_end:
+        while c_y < v_end:
+            corners = [[c_x + cos(radians(angle)) * side, c_y + sin(radians(angle)) * side] for angle in range(0, 360, 60)]
+            hexagons.append(shapely.Polygon(corners))
+            c_y += v_step
+        c_x += h_step
+        c_y = v_start_array[v_start_idx]
+        v_start_idx = (v_start_idx + 1) % 2
+    return (np.array(hexagons, dtype=object), side)
+
+
+@pytest.mark.parametrize("bbx", [BOUNDS, (-61000.0, -38000.0, -1000.0, 2000.0), (1234567.0, 7654321.0, 1434567.0, 7754321.0)])
+def test_build_hexgrid_matches_legacy(bbx):
+    # user-001: the vectorized grid has the same hexagons in the same GRID_ID order as the per cell loop
+    legacy, side = legacy_hexgrid(bbx, HEX_AREA)
+    hexgrid = build_hexgrid(bbx, HEX_AREA, TARGET_CRS)
+
+    assert len(hexgrid) == len(legacy)
+    assert hexgrid[PUID].tolist() == list(range(1, len(legacy) + 1))
+    assert shapely.equals_exact(np.asarray(hexgrid.geometry.values), legacy, tolerance=side * 1e-9).all()
+
+
+def test_point_to_grid_id(grid):
+    # user-004: a point maps to the GRID_ID of the hexagon that contains it, 0 outside the grid
+    rng = np.random.default_rng(4)
+    xmin, ymin, xmax, ymax = grid.total_bounds
+    x = rng.uniform(xmin - 5000, xmax + 5000, 5000)
+    y = rng.uniform(ymin - 5000, ymax + 5000, 5000)
+    hexes = grid.geometry()
+    inside = shapely.contains_xy(hexes[:, None], x[None, :], y[None, :])
+    expected = np.where(inside.any(axis=0), inside.argmax(axis=0) + 1, 0)
+
+    assert np.array_equal(grid.lattice.point_to_grid_id(x, y), expected)
+    assert np.array_equal(grid.lattice.point_to_grid_id(grid.x, grid.y), grid.puids)
+
+
+def test_query(grid):
+    # user-004: a geometry maps to the GRID_IDs of every hexagon whose bounding box it overlaps
+    rng = np.random.default_rng(5)
+    xmin, ymin, xmax, ymax = grid.total_bounds
+    x, y = rng.uniform(xmin - 3000, xmax, 200), rng.uniform(ymin - 3000, ymax, 200)
+    boxes = shapely.box(x, y, x + rng.uniform(10, 9000, 200), y + rng.uniform(10, 9000, 200))
+    envelopes = shapely.envelope(grid.geometry())
+    expected = np.argwhere(shapely.intersects(boxes[:, None], envelopes[None, :]))
+
+    box_idx, grid_ids = grid.lattice.query(boxes)
+    assert sorted(zip(box_idx, grid_ids)) == sorted(zip(expected[:, 0], expected[:, 1] + 1))
+
+
+def test_candidate_pairs_match_strtree(grid):
+    # user-004: the lattice lookup finds the same intersecting pairs as an STRtree over the hexagons
+    rng = np.random.default_rng(6)
+    xmin, ymin, xmax, ymax = grid.total_bounds
+    features = shapely.buffer(shapely.points(rng.uniform(xmin, xmax, 50), rng.uniform(ymin, ymax, 50)), rng.uniform(100, 8000, 50))
+    positions = np.arange(0, len(grid), 2)
+    hexes = grid.geometry()[positions]
+
+    lattice_pairs = candidate_pairs(hexes, features, grid.lattice, positions + 1)
+    tree_pairs = candidate_pairs(hexes, features)
+    assert sorted(zip(*lattice_pairs)) == sorted(zip(*tree_pairs))
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+test_overlap.py
+
+Checks the overlap calculation against geopandas on the Report4 sample layers and on
+generated layers, and the overlap caches and checkpoints. Run with python -m pytest from
+the project directory.
+"""
+
+# import modules
+import os
+import sys
+from glob import glob
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import overlap
+import planning
+from cache import DiskCache
+from defs import *
+from hexgrid import PlanningGrid, grid_gdf
+from overlap import OverlapCache, intersect_layer, layer_rows
+from util import load_files
+
+LAYER_FILES = sorted(glob(os.path.join(ROOT, "Report4_Data", "MultiOverlap", "Input", "ConservationLayers", "*.shp")))
+HEX_AREA = 2.5e8
+
+KEY = [ID, PUID]
+ROW = [ID, PUID, AMOUNT]
+
+
+@pytest.fixture(scope="module")
+def layers() -> list[gpd.GeoDataFrame]:
+    if not LAYER_FILES:
+        pytest.skip("the Report4 sample layers are not available")
+    planning.verbose = False
+    return planning.project_gdfs(load_files(LAYER_FILES, False), TARGET_CRS)
+
+
+@pytest.fixture(scope="module")
+def grid(layers) -> PlanningGrid:
+    return PlanningGrid.from_bounds(layers[0].total_bounds, HEX_AREA, TARGET_CRS)
+
+
+@pytest.fixture(scope="module")
+def expected(grid, layers) -> np.ndarray:
+    return overlay_rows(grid, layers)
+
+
+@pytest.fixture
+def small_grid() -> PlanningGrid:
+    return PlanningGrid.from_bounds((0, 0, 20000, 20000), 1e7, TARGET_CRS)
+
+
+@pytest.fixture
+def small_layer() -> gpd.GeoDataFrame:
+    rng = np.random.default_rng(13)
+    centers = shapely.points(rng.uniform(0, 20000, (40, 2)))
+    return gpd.GeoDataFrame(
+        {ID: np.arange(40) % 7 + 1}, geometry=shapely.buffer(centers, rng.uniform(200, 3000, 40)), crs=TARGET_CRS
+    )
+
+
+@pytest.fixture
+def quiet(monkeypatch) -> None:
+    """Run the calculations silently on two cores without checkpoints."""
+    monkeypatch.setattr(planning, "verbose", False)
+    monkeypatch.setattr(planning, "OVERLAP_CHECKPOINT", False)
+    monkeypatch.setattr(planning, "CORES", 2)
+
+
+def rows(frame: pd.DataFrame) -> np.ndarray:
+    """Sort the ID, GRID_ID and amount of each overlap, leaving out the slivers whose area rounds
+    to 0, which depend on the order of the floating point operations."""
+    frame = frame[frame[AMOUNT] > 0]
+    return frame.sort_values(ROW)[ROW].to_numpy(np.int64)
+
+
+def overlay_rows(grid: PlanningGrid, layers: list[gpd.GeoDataFrame]) -> np.ndarray:
+    """The overlap of every feature and planning unit from gpd.overlay, see :func:`rows`."""
+    hexes = grid_gdf(grid)
+    frames = []
+    for layer in layers:
+        intersection = gpd.overlay(hexes, layer, how="intersection")
+        frames.append(pd.DataFrame({ID: intersection[ID], PUID: intersection[PUID], AMOUNT: np.round(intersection.area)}))
+    return rows(pd.concat(frames, ignore_index=True))
+
+
+def spy_run_overlap(monkeypatch) -> list[list[tuple[int, np.ndarray]]]:
+    """Record the layer filters of every run_overlap call of planning."""
+    calls = []
+    run_overlap = planning.run_overlap
+
+    def record(planning_grid, base_layers, filters, *args, **kwargs):
+        calls.append(filters)
+        return run_overlap(planning_grid, base_layers, filters, *args, **kwargs)
+
+    monkeypatch.setattr(planning, "run_overlap", record)
+    return calls
+
+
+@pytest.mark.parametrize("lattice", [True, False])
+@pytest.mark.parametrize("backend", ["serial", "thread", "process"])
+def test_calculate_overlap_matches_overlay(monkeypatch, quiet, grid, layers, expected, backend, lattice):
+    # user-006: every overlap of every feature matches the overlay of the original calculate()
+    monkeypatch.setattr(planning, "OVERLAP_LATTICE", lattice)
+    result = planning.calculate_overlap(grid, layers, backend=backend)
+    assert np.array_equal(rows(result), expected)
+
+
+def test_raster_overlap_within_max_error(grid, layers):
+    # user-019: every estimated amount is within its error bound of the exact amount
+    planning.verbose = False
+    exact = planning.calculate_overlap(grid, layers, backend="serial")
+    estimate = planning.calculate_raster_overlap(grid, layers)
+    merged = estimate.merge(exact, on=KEY, how="left", suffixes=("", "_exact")).fillna({f"{AMOUNT}_exact": 0})
+
+    assert (estimate[AMOUNT] > 0).all()
+    assert (np.abs(merged[AMOUNT] - merged[f"{AMOUNT}_exact"]) <= merged[MAX_ERROR]).all()
+
+
+@pytest.mark.parametrize("lattice", [True, False])
+@pytest.mark.parametrize("backend", ["serial", "thread", "process"])
+def test_invalid_feature_matches_overlay(monkeypatch, quiet, small_grid, backend, lattice):
+    # user-006: a self-intersecting ring is made valid before the containment test and intersection
+    monkeypatch.setattr(planning, "OVERLAP_LATTICE", lattice)
+    bowtie = shapely.Polygon([(0, 0), (20000, 20000), (20000, 0), (0, 20000), (0, 0)])
+    layer = gpd.GeoDataFrame({ID: [7, 8]}, geometry=[bowtie, shapely.box(5000, 5000, 9000, 9000)], crs=TARGET_CRS)
+    assert not layer.is_valid.all()
+    expected = overlay_rows(small_grid, [layer])
+
+    assert np.array_equal(rows(planning.calculate_overlap(small_grid, [layer], backend=backend)), expected)
+    # the intersection geometries of the single layer path used by the tile workers
+    assert np.array_equal(rows(intersect_layer(grid_gdf(small_grid), layer)), expected)
+
+
+def test_overlap_cache_calculates_new_rows_only(monkeypatch, quiet, small_grid, small_layer):
+    # user-013: a new filter of a layer only calculates the rows no earlier filter calculated
+    calls = spy_run_overlap(monkeypatch)
+    cache = OverlapCache()
+
+    def calculate(planning_grid, layer):
+        return planning.calculate_overlap(planning_grid, [layer], backend="serial", base_layers=[small_layer], cache=cache)
+
+    calculate(small_grid, small_layer.iloc[:25])
+    result = calculate(small_grid, small_layer.iloc[10:])
+    assert [filters[0][1].tolist() for filters in calls] == [list(range(25)), list(range(25, 40))]
+    assert np.array_equal(rows(result), overlay_rows(small_grid, [small_layer.iloc[10:]]))
+
+    # every row is cached now
+    calculate(small_grid, small_layer.iloc[::3])
+    assert len(calls) == 2
+    # a changed layer and a new grid are calculated again
+    moved = small_layer.set_geometry(small_layer.translate(1000, 0))
+    planning.calculate_overlap(small_grid, [moved], backend="serial", cache=cache)
+    other_grid = PlanningGrid.from_bounds((0, 0, 20000, 20000), 2e7, TARGET_CRS)
+    calculate(other_grid, small_layer.iloc[:5])
+    assert calls[2][0][1] is None
+    assert calls[3][0][1].tolist() == list(range(5))
+
+
+def test_disk_cache_shared_across_sessions(monkeypatch, quiet, tmp_path, small_grid, small_layer):
+    # user-014: the overlap saved by one session is read by the next, but not by another engine version
+    calls = spy_run_overlap(monkeypatch)
+    disk = DiskCache(str(tmp_path), 10**8)
+    expected = planning.calculate_overlap(small_grid, [small_layer], backend="serial", cache=OverlapCache(disk))
+    result = planning.calculate_overlap(small_grid, [small_layer.copy()], backend="serial", cache=OverlapCache(disk))
+    assert len(calls) == 1
+    assert np.array_equal(rows(result), rows(expected))
+
+    monkeypatch.setattr(overlap, "OVERLAP_ENGINE_VERSION", "another engine")
+    cache = OverlapCache(disk)
+    cache.use_grid(small_grid)
+    assert len(cache.missing(small_layer)) == len(small_layer)
+
+
+def test_checkpoint_resumes_unfinished_chunks(monkeypatch, quiet, tmp_path, small_grid, small_layer):
+    # user-015: an interrupted calculation only calculates the chunks missing from its checkpoint
+    monkeypatch.setattr(planning, "OVERLAP_CHECKPOINT", True)
+    monkeypatch.setattr(planning, "OVERLAP_CHECKPOINT_DIR", str(tmp_path))
+    monkeypatch.setattr(planning, "OVERLAP_CHECKPOINT_MIN_WORK", 0)
+    expected = rows(planning.calculate_overlap(small_grid, [small_layer], backend="serial"))
+
+    save_checkpoint_chunk = planning.save_checkpoint_chunk
+    saved = []
+
+    def interrupt(directory, chunk, results):
+        if len(saved) == 3:
+            raise KeyboardInterrupt
+        saved.append(chunk)
+        save_checkpoint_chunk(directory, chunk, results)
+
+    monkeypatch.setattr(planning, "save_checkpoint_chunk", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        planning.calculate_overlap(small_grid, [small_layer], backend="serial")
+    monkeypatch.setattr(planning, "save_checkpoint_chunk", save_checkpoint_chunk)
+
+    calculated = []
+    calculate_chunk = planning.calculate_chunk
+    monkeypatch.setattr(planning, "calculate_chunk", lambda task: calculated.append(task[0]) or calculate_chunk(task))
+    result = planning.calculate_overlap(small_grid, [small_layer], backend="serial")
+    assert calculated and not set(calculated) & set(saved)
+    assert np.array_equal(rows(result), expected)
+    # the checkpoint is removed once every chunk has finished
+    assert os.listdir(tmp_path) == []
+
+
+def test_grid_layers_keep_the_loaded_layers(quiet, small_layer):
+    # user-023: the features outside one planning grid are still there for the next grid
+    filtered = small_layer.iloc[::2]
+    small = PlanningGrid.from_bounds((0, 0, 8000, 8000), 1e7, TARGET_CRS)
+    base, layers = planning.grid_layers(small, [small_layer], [filtered])
+    assert len(base[0]) < len(small_layer)
+    assert layer_rows(base[0], layers[0]) is not None
+
+    large = PlanningGrid.from_bounds((-5000, -5000, 25000, 25000), 1e7, TARGET_CRS)
+    base, layers = planning.grid_layers(large, [small_layer], [filtered])
+    assert len(base[0]) == len(small_layer) and len(layers[0]) == len(filtered)
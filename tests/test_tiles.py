@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+test_tiles.py
+
+Checks the tile manifest mode against the overlap of the whole planning grid, and the
+claims of the tile workers. Run with python -m pytest from the project directory.
+"""
+
+# import modules
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from defs import *
+from hexgrid import PlanningGrid, grid_gdf
+from overlap import intersect_layer
+from tiles import CLAIMS_DIR, claim_owner, claim_tile, manifest_status, merge_shards, prepare_manifest, run_worker, tile_name
+
+N_TILES = 6
+
+
+@pytest.fixture
+def inputs(tmp_path) -> tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    grid = grid_gdf(PlanningGrid.from_bounds((0, 0, 20000, 20000), 1e7, TARGET_CRS))
+    rng = np.random.default_rng(16)
+    centers = shapely.points(rng.uniform(0, 20000, (30, 2)))
+    layer = gpd.GeoDataFrame(
+        {ID: np.arange(30) % 5 + 1}, geometry=shapely.buffer(centers, rng.uniform(200, 4000, 30)), crs=TARGET_CRS
+    )
+    grid.to_file(tmp_path / "grid.gpkg")
+    layer.to_file(tmp_path / "layer.gpkg")
+    return (grid, layer)
+
+
+@pytest.fixture
+def manifest(tmp_path, inputs) -> str:
+    directory = str(tmp_path / "manifest")
+    prepare_manifest(str(tmp_path / "grid.gpkg"), [str(tmp_path / "layer.gpkg")], directory, N_TILES)
+    return directory
+
+
+def test_merged_tiles_match_whole_grid(tmp_path, inputs, manifest):
+    # user-016: the shards of every tile merge into the overlap of the whole grid
+    grid, layer = inputs
+    assert run_worker(manifest, verbose=False) == N_TILES
+    results = merge_shards(manifest, str(tmp_path / "results.csv"))
+
+    expected = intersect_layer(grid, layer)
+    expected = expected.sort_values([PUID, ID, AMOUNT])[[ID, PUID, AMOUNT]].to_numpy(np.int64)
+    assert np.array_equal(results.sort_values([PUID, ID, AMOUNT])[[ID, PUID, AMOUNT]].to_numpy(np.int64), expected)
+    assert pd.read_csv(tmp_path / "results.csv").columns.tolist() == [SPECIES, PU, AMOUNT]
+
+
+def test_claim_tile_once(manifest):
+    # user-016: a tile is claimed by one worker, and a claim that is no longer refreshed is taken over
+    token = claim_tile(manifest, 0)
+    assert token is not None and claim_owner(manifest, 0) == token
+    assert claim_tile(manifest, 0) is None
+    assert claim_tile(manifest, 0, stale=3600) is None
+
+    os.utime(os.path.join(manifest, CLAIMS_DIR, tile_name(0)), (0, 0))
+    taken = claim_tile(manifest, 0, stale=3600)
+    assert taken not in (None, token)
+    assert claim_owner(manifest, 0) == taken
+
+
+def test_merge_waits_for_every_tile(tmp_path, manifest):
+    # user-016: the shards are only merged once every tile has finished
+    claim_tile(manifest, 0)
+    assert run_worker(manifest, verbose=False) == N_TILES - 1
+    assert manifest_status(manifest)["claimed"] == [0]
+    with pytest.raises(RuntimeError):
+        merge_shards(manifest, str(tmp_path / "results.csv"))
+
+    # a worker that takes over the claim of a dead worker finishes the tile
+    assert run_worker(manifest, stale=0, verbose=False) == 1
+    assert len(merge_shards(manifest, str(tmp_path / "results.csv"))) > 0
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+test_util.py
+
+Checks the attribute filters of the conservation layers, read from memory and pushed
+down to the layer reader. Run with python -m pytest from the project directory.
+"""
+
+# import modules
+import os
+import sys
+
+import pandas as pd
+import geopandas as gpd
+import shapely
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cache import DiskCache
+from defs import *
+from util import load_files, attribute_values, select_by_attribute, where_clause
+
+
+@pytest.fixture(params=["gpkg", "shp"])
+def layer_file(request, tmp_path) -> str:
+    layer = gpd.GeoDataFrame(
+        {
+            ID: [1, 2, 3, 4],
+            "FLAG": [True, False, True, False],
+            "DAY": pd.to_datetime(["2020-01-01", "2021-06-30", "2020-01-01", "2022-02-28"]),
+            NAME: ["a", "O'Brien", "c", "a"],
+        },
+        geometry=[shapely.box(i, 0, i + 1, 1) for i in range(4)],
+        crs=TARGET_CRS,
+    )
+    if request.param == "shp":
+        # shapefiles have no date and time fields
+        layer = layer.drop(columns="DAY")
+    file_name = str(tmp_path / f"layer.{request.param}")
+    layer.to_file(file_name)
+    return file_name
+
+
+@pytest.mark.parametrize("column", [ID, "FLAG", "DAY", NAME])
+def test_select_by_attribute(layer_file, column):
+    # user-024: the values listed to the user are strings, each column type parses them
+    full = load_files(layer_file, False)
+    if column not in full.columns:
+        pytest.skip(f"{column} is not stored in {layer_file}")
+    lazy = load_files(layer_file, False, [ID])
+    assert column == ID or column not in lazy.columns
+
+    for value in attribute_values(lazy, column):
+        expected = full[full[column] == value][ID].tolist()
+        for layer in (full, lazy):
+            assert select_by_attribute(layer, column, [str(value)])[ID].tolist() == expected
+    assert select_by_attribute(lazy, column, ["not a value"]).empty
+
+
+def test_select_false_on_bool_column(layer_file):
+    # user-024: "False" is not a truthy string for a boolean column
+    for layer in (load_files(layer_file, False), load_files(layer_file, False, [ID])):
+        assert select_by_attribute(layer, "FLAG", ["False"])[ID].tolist() == [2, 4]
+        assert select_by_attribute(layer, "FLAG", ["True", "False"])[ID].tolist() == [1, 2, 3, 4]
+
+
+def test_where_clause():
+    # user-024: only numeric and string columns are filtered by the reader
+    assert where_clause(NAME, ["O'Brien", "a"], "object") == "\"NAME\" IN ('O''Brien', 'a')"
+    assert where_clause(ID, ["1", "x", "2.5"], "int64") == '"ID" IN (1, 2.5)'
+    assert where_clause(ID, ["x"], "int64") is None
+    with pytest.raises(ValueError):
+        where_clause("FLAG", ["False"], "bool")
+
+
+def test_load_files_reads_extent(layer_file, tmp_path):
+    # user-023: only the features that meet the extent are read, also through the layer cache
+    extent = gpd.GeoSeries([shapely.box(0.2, 0.2, 1.5, 0.8)], crs=TARGET_CRS)
+    assert load_files(layer_file, False, [ID], extent)[ID].tolist() == [1, 2]
+
+    cache = DiskCache(str(tmp_path / "cache"), 10**8)
+    for _ in range(2):
+        assert load_files(layer_file, False, [ID], extent, TARGET_CRS, cache)[ID].tolist() == [1, 2]
+        assert load_files(layer_file, False, [ID], None, TARGET_CRS, cache)[ID].tolist() == [1, 2, 3, 4]
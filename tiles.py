@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+tiles.py
+
+This file contains the tile manifest mode used to spread an overlap calculation
+of the planning.py script across several machines. A manifest splits the planning
+grid into tiles, any number of workers on any machine with access to the manifest
+directory claim and calculate tiles, and the results shards are merged into the
+marxan results csv. No scheduler is needed, the workers claim tiles with files
+that can only be created once.
+
+    python tiles.py prepare GRID LAYER [LAYER ...] --dir DIR [--tiles N]
+    python tiles.py work DIR [--stale SECONDS]
+    python tiles.py status DIR
+    python tiles.py merge DIR [--out FILE]
+"""
+
+# import modules
+from defs import *
+from hexgrid import grid_centers
+from overlap import partition_grid, layer_subset, intersect_layer
+import os
+import sys
+import json
+import socket
+import argparse
+import threading
+import uuid
+from time import time
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyogrio
+import shapely
+
+MANIFEST_FILE = "manifest.json"
+TILES_FILE = "tiles.npz"
+CLAIMS_DIR = "claims"
+SHARDS_DIR = "shards"
+
+
+def prepare_manifest(grid_file: str, layer_files: list[str], directory: str, n_tiles: int = 64) -> dict:
+    """Split a planning grid into spatially compact tiles and write the tile manifest. The grid
+    and layer files are referenced by their absolute path, so they must be on storage shared
+    by every worker.
+
+    :param grid_file: The planning unit grid file with the GRID_ID column.
+    :type grid_file: str
+    :param layer_files: The conservation layer files with the ID column.
+    :type layer_files: list[str]
+    :param directory: The manifest directory, created if needed.
+    :type directory: str
+    :param n_tiles: The number of tiles, defaults to 64.
+    :type n_tiles: int, optional
+    :return: The manifest.
+    :rtype: dict
+    """
+    grid = gpd.read_file(grid_file)
+    if PUID not in grid.columns:
+        raise ValueError(f"Planning unit grid {grid_file} has no {PUID} column")
+    x, y = grid_centers(grid)
+    tiles = [tile for tile in partition_grid(x, y, n_tiles) if len(tile)]
+    hexes = grid.geometry.values
+
+    os.makedirs(os.path.join(directory, CLAIMS_DIR), exist_ok=True)
+    os.makedirs(os.path.join(directory, SHARDS_DIR), exist_ok=True)
+    # the workers read each tile by its bounds and keep its planning units by GRID_ID
+    np.savez(
+        os.path.join(directory, TILES_FILE),
+        puids=grid[PUID].to_numpy().astype(str)[np.concatenate(tiles)],
+        offsets=np.cumsum([0] + [len(tile) for tile in tiles]),
+        bounds=np.array([shapely.total_bounds(hexes[tile]) for tile in tiles]),
+    )
+    manifest = {
+        "grid": os.path.abspath(grid_file),
+        "layers": [os.path.abspath(file) for file in layer_files],
+        "crs": grid.crs.to_string(),
+        "tiles": len(tiles),
+        "planning_units": len(grid),
+        "engine_version": OVERLAP_ENGINE_VERSION,
+    }
+    with open(os.path.join(directory, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def load_manifest(directory: str) -> tuple[dict, list[tuple[np.ndarray, np.ndarray]]]:
+    """Read the tile manifest and the planning units and bounds of each tile.
+
+    :param directory: The manifest directory.
+    :type directory: str
+    :return: The manifest and the GRID_IDs, as strings, and the bounds of each tile.
+    :rtype: tuple[dict, list[tuple[np.ndarray, np.ndarray]]]
+    """
+    with open(os.path.join(directory, MANIFEST_FILE)) as file:
+        manifest = json.load(file)
+    with np.load(os.path.join(directory, TILES_FILE)) as data:
+        puids, offsets, bounds = data["puids"], data["offsets"], data["bounds"]
+    return (manifest, [(puids[start:stop], bounds[tile]) for tile, (start, stop) in enumerate(zip(offsets[:-1], offsets[1:]))])
+
+
+def tile_name(tile: int) -> str:
+    """Get the file name stem of a tile."""
+    return f"tile_{tile:05d}"
+
+
+def claim_owner(directory: str, tile: int) -> str:
+    """Read the owner token of a tile claim, an empty string if the tile is not claimed."""
+    try:
+        with open(os.path.join(directory, CLAIMS_DIR, tile_name(tile))) as file:
+            return file.read().strip()
+    except OSError:
+        return ""
+
+
+def claim_tile(directory: str, tile: int, stale: float = None) -> str:
+    """Claim a tile for this worker. The claim file can only be created by one worker and holds
+    a token unique to the claim, so two workers never calculate the same tile. The worker
+    refreshes its claim every TILE_HEARTBEAT seconds with :func:`~refresh_claim`, so a claim older
+    than stale seconds without a shard is assumed to belong to a worker that died and is taken
+    over. Two workers can both find the same claim stale, so a claim is only owned while it
+    still holds the worker's token, see :func:`~claim_owner`.
+
+    :param directory: The manifest directory.
+    :type directory: str
+    :param tile: The tile number.
+    :type tile: int
+    :param stale: The age in seconds after which an unfinished claim is taken over, defaults to
+                  None which never takes over a claim.
+    :type stale: float, optional
+    :return: The token of the claim if this worker now owns the tile, otherwise None.
+    :rtype: str
+    """
+    claim = os.path.join(directory, CLAIMS_DIR, tile_name(tile))
+    try:
+        handle = os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        if stale is None:
+            return None
+        try:
+            if time() - os.path.getmtime(claim) < stale:
+                return None
+            # only one worker wins the rename of a stale claim
+            os.rename(claim, f"{claim}.{uuid.uuid4().hex}.stale")
+        except OSError:
+            return None
+        return claim_tile(directory, tile)
+    token = f"{socket.gethostname()} {os.getpid()} {uuid.uuid4().hex}"
+    with os.fdopen(handle, "w") as file:
+        file.write(token + "\n")
+    # a worker that found this claim stale before it was written can have renamed it away
+    return token if claim_owner(directory, tile) == token else None
+
+
+def refresh_claim(directory: str, tile: int, token: str, stop: threading.Event, interval: float = TILE_HEARTBEAT) -> None:
+    """Touch the claim of a tile every interval seconds until stop is set, so the claim of a
+    worker that is still calculating a long tile never looks stale to the other workers. The
+    refreshes end once the claim was taken over by another worker.
+
+    :param directory: The manifest directory.
+    :type directory: str
+    :param tile: The tile number.
+    :type tile: int
+    :param token: The token of this worker's claim.
+    :type token: str
+    :param stop: Set once the tile is finished.
+    :type stop: threading.Event
+    :param interval: The seconds between refreshes, defaults to TILE_HEARTBEAT.
+    :type interval: float, optional
+    """
+    claim = os.path.join(directory, CLAIMS_DIR, tile_name(tile))
+    while not stop.wait(interval):
+        if claim_owner(directory, tile) != token:
+            return
+        try:
+            os.utime(claim)
+        except OSError:
+            return
+    return
+
+
+def read_tile(manifest: dict, puids: np.ndarray, bounds: np.ndarray, layer_crs: dict) -> tuple[gpd.GeoDataFrame, list[gpd.GeoDataFrame]]:
+    """Read the planning units of one tile and the conservation features within its bounds,
+    so a worker never holds more of the inputs than the tile it calculates.
+
+    :param manifest: The manifest.
+    :type manifest: dict
+    :param puids: The GRID_IDs of the planning units of the tile, as strings.
+    :type puids: np.ndarray
+    :param bounds: The bounds of the tile in the manifest CRS.
+    :type bounds: np.ndarray
+    :param layer_crs: The CRS of each layer file, filled in on the first read.
+    :type layer_crs: dict
+    :return: The planning units of the tile and the conservation layers in the manifest CRS.
+    :rtype: tuple[gpd.GeoDataFrame, list[gpd.GeoDataFrame]]
+    """
+    grid = gpd.read_file(manifest["grid"], bbox=tuple(bounds), columns=[PUID])
+    # the bounding box also reads the planning units of the neighbouring tiles
+    tile = grid[np.isin(grid[PUID].to_numpy().astype(str), puids)]
+    extent = gpd.GeoSeries([shapely.box(*bounds)], crs=manifest["crs"])
+    layers = []
+    for file in manifest["layers"]:
+        if file not in layer_crs:
+            layer_crs[file] = pyogrio.read_info(file)["crs"]
+        bbox = tuple(extent.to_crs(layer_crs[file]).total_bounds)
+        layers.append(gpd.read_file(file, bbox=bbox, columns=[ID]).to_crs(manifest["crs"]))
+    return (tile.reset_index(drop=True), layers)
+
+
+def calculate_tile(tile: gpd.GeoDataFrame, layers: list[gpd.GeoDataFrame]) -> pd.DataFrame:
+    """Calculate the overlap of one tile of the planning grid with :func:`~overlap.intersect_layer`,
+    keeping only the columns written to the marxan results.
+
+    :param tile: The planning units of the tile.
+    :type tile: gpd.GeoDataFrame
+    :param layers: The conservation layers.
+    :type layers: list[gpd.GeoDataFrame]
+    :return: The ID, GRID_ID and AMOUNT of every overlap in the tile.
+    :rtype: pd.DataFrame
+    """
+    bounds = tile.total_bounds
+    subsets = [layer_subset(layer, bounds) for layer in layers]
+    intersections = [intersect_layer(tile, subset) for subset in subsets if not subset.empty]
+    if not intersections:
+        return pd.DataFrame(columns=[ID, PUID, AMOUNT])
+    return pd.concat([pd.DataFrame(intersection[[ID, PUID, AMOUNT]]) for intersection in intersections], ignore_index=True)
+
+
+def run_worker(directory: str, stale: float = None, verbose: bool = True) -> int:
+    """Claim and calculate tiles of a manifest until none are left, writing the results shard of
+    each tile to the shards directory. Any number of workers can run at once on any machine
+    that shares the manifest directory and the input files.
+
+    :param directory: The manifest directory.
+    :type directory: str
+    :param stale: The age in seconds after which an unfinished claim is taken over, defaults to None.
+    :type stale: float, optional
+    :param verbose: Print the progress of each tile, defaults to True.
+    :type verbose: bool, optional
+    :return: The number of tiles calculated by this worker.
+    :rtype: int
+    """
+    manifest, tiles = load_manifest(directory)
+    layer_crs = {}
+    done = 0
+    for tile in range(len(tiles)):
+        shard = os.path.join(directory, SHARDS_DIR, tile_name(tile) + ".csv")
+        if os.path.exists(shard):
+            continue
+        token = claim_tile(directory, tile, stale)
+        if token is None:
+            continue
+        start_time = time()
+        # keep the claim fresh while the tile is read and calculated
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=refresh_claim, args=(directory, tile, token, stop), daemon=True)
+        heartbeat.start()
+        try:
+            # only the tile's extent of the inputs is read, a late worker reads nothing
+            results = calculate_tile(*read_tile(manifest, *tiles[tile], layer_crs))
+            # a worker whose claim was taken over leaves the shard to the new owner
+            if claim_owner(directory, tile) != token:
+                continue
+            temp_name = os.path.join(directory, SHARDS_DIR, f".{tile_name(tile)}.{uuid.uuid4().hex}.tmp")
+            results.to_csv(temp_name, index=False)
+            os.replace(temp_name, shard)
+        finally:
+            stop.set()
+            heartbeat.join()
+        done += 1
+        if verbose:
+            print(f"{tile_name(tile)}: {len(results)} overlaps in {time() - start_time:.2f} seconds")
+    return done
+
+
+def manifest_status(directory: str) -> dict:
+    """Count the finished, claimed and waiting tiles of a manifest.
+
+    :param directory: The manifest directory.
+    :type directory: str
+    :return: The number of tiles, and the tile numbers that are finished, claimed but not
+             finished, and waiting.
+    :rtype: dict
+    """
+    manifest, _ = load_manifest(directory)
+    finished, claimed, waiting = [], [], []
+    for tile in range(manifest["tiles"]):
+        if os.path.exists(os.path.join(directory, SHARDS_DIR, tile_name(tile) + ".csv")):
+            finished.append(tile)
+        elif os.path.exists(os.path.join(directory, CLAIMS_DIR, tile_name(tile))):
+            claimed.append(tile)
+        else:
+            waiting.append(tile)
+    return {"tiles": manifest["tiles"], "finished": finished, "claimed": claimed, "waiting": waiting}
+
+
+def merge_shards(directory: str, file_name: str = DEFAULT_RESULTS_FILE_NAME + ".csv") -> pd.DataFrame:
+    """Merge the results shards of every tile into the marxan results csv, in the same format
+    as the results saved from the main menu.
+
+    :param directory: The manifest directory.
+    :type directory: str
+    :param file_name: The results csv file, defaults to DEFAULT_RESULTS_FILE_NAME.csv.
+    :type file_name: str, optional
+    :raises RuntimeError: If any tile has not finished.
+    :return: The merged results.
+    :rtype: pd.DataFrame
+    """
+    status = manifest_status(directory)
+    if len(status["finished"]) != status["tiles"]:
+        missing = status["claimed"] + status["waiting"]
+        raise RuntimeError(f"{len(missing)} of {status['tiles']} tiles have not finished: {missing[:10]}")
+    shards = [
+        pd.read_csv(os.path.join(directory, SHARDS_DIR, tile_name(tile) + ".csv")) for tile in range(status["tiles"])
+    ]
+    results = pd.concat(shards, ignore_index=True).sort_values([PUID, ID], kind="stable", ignore_index=True)
+    results.to_csv(file_name, header=[SPECIES, PU, AMOUNT], columns=[ID, PUID, AMOUNT], index=False)
+    return results
+
+
+def main(argv: list[str] = None) -> int:
+    """Command line entry point of the tile manifest mode.
+
+    :param argv: The command line arguments, defaults to None which uses sys.argv.
+    :type argv: list[str], optional
+    :return: The exit status.
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(description="Spread an overlap calculation across machines with a tile manifest.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    prepare = commands.add_parser("prepare", help="split a planning grid into a tile manifest")
+    prepare.add_argument("grid", help="planning unit grid file with a GRID_ID column")
+    prepare.add_argument("layers", nargs="+", help="conservation layer files with an ID column")
+    prepare.add_argument("--dir", required=True, help="manifest directory on shared storage")
+    prepare.add_argument("--tiles", type=int, default=64, help="number of tiles (default 64)")
+
+    work = commands.add_parser("work", help="claim and calculate tiles until none are left")
+    work.add_argument("dir", help="manifest directory")
+    work.add_argument(
+        "--stale",
+        type=float,
+        default=None,
+        help=f"take over unfinished claims older than this many seconds, claims are refreshed every {TILE_HEARTBEAT} seconds",
+    )
+    work.add_argument("--quiet", action="store_true", help="do not print the progress of each tile")
+
+    status = commands.add_parser("status", help="show the progress of a manifest")
+    status.add_argument("dir", help="manifest directory")
+
+    merge = commands.add_parser("merge", help="merge the results shards into the marxan results csv")
+    merge.add_argument("dir", help="manifest directory")
+    merge.add_argument("--out", default=DEFAULT_RESULTS_FILE_NAME + ".csv", help="results csv file")
+
+    args = parser.parse_args(argv)
+    if args.command == "prepare":
+        manifest = prepare_manifest(args.grid, args.layers, args.dir, args.tiles)
+        print(f"Split {manifest['planning_units']} planning units into {manifest['tiles']} tiles in {args.dir}")
+    elif args.command == "work":
+        done = run_worker(args.dir, args.stale, not args.quiet)
+        print(f"Calculated {done} tiles")
+    elif args.command == "status":
+        info = manifest_status(args.dir)
+        print(
+            f"{len(info['finished'])} finished, {len(info['claimed'])} claimed, "
+            f"{len(info['waiting'])} waiting of {info['tiles']} tiles"
+        )
+    elif args.command == "merge":
+        try:
+            results = merge_shards(args.dir, args.out)
+        except RuntimeError as e:
+            print(e)
+            return 1
+        print(f"Saved {len(results)} overlaps to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
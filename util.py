@@ -25,11 +25,20 @@ environ["USE_PYGEOS"] = "0"
 import tkinter.filedialog
 from tkinter import Tk, Frame, Listbox, Scrollbar, Button
 from tkinter.constants import *
-from typing import List
+from typing import List, Iterator
 from glob import glob
 import threading
-from time import sleep
+from time import sleep, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import geopandas as gpd
+import pandas as pd
+import pyogrio
+from pyproj import CRS
+from cache import DiskCache, file_signature
+from importlib.util import find_spec
+
+# read through Arrow when pyarrow is installed
+ARROW = find_spec("pyarrow") is not None
 
 # globals
 stop_progress = False  # bollean to stop the progress thread
@@ -243,7 +252,8 @@ def save_gdf(
 ) -> None:
     """Save a GeoDataFrame to a file. The user is prompted to select a file name and
     file type. The file type is determined by the file extension. The supported file
-    types are shapefile and geopackage.
+    types are shapefile and geopackage. Objects that provide iter_chunks(), such as a
+    PlanningGrid, are written one chunk at a time.
     Author: Mitch Albert
 
     :param gdf: The GeoDataFrame to save.
@@ -260,11 +270,16 @@ def save_gdf(
         file_name = get_save_file_name(title=title, f_types=ft_standard, initialfile=initialfile)
         if file_name:
             ext = file_name.split(".")[-1].lower()
+            # a compact planning grid is written in chunks so the polygons are never
+            # all held in memory at once
+            chunks = gdf.iter_chunks() if hasattr(gdf, "iter_chunks") else [gdf]
             if ext == SHAPE_DRIVER:
-                gdf.to_file(file_name)
+                for i, chunk in enumerate(chunks):
+                    chunk.to_file(file_name, mode="a" if i else "w")
                 saved = True
             elif ext == GPKG_DRIVER.lower():
-                gdf.to_file(file_name, driver=GPKG_DRIVER)
+                for i, chunk in enumerate(chunks):
+                    chunk.to_file(file_name, driver=GPKG_DRIVER, mode="a" if i else "w")
                 saved = True
             else:
                 print_warning_msg("Skipping file save. File type not supported.")
@@ -283,55 +298,328 @@ def save_gdf(
 
 
 def load_files(
-    files: list[str] | str, verbose: str = True
+    files: list[str] | str,
+    verbose: str = True,
+    columns: list[str] = None,
+    extent: gpd.GeoSeries = None,
+    crs=None,
+    cache: DiskCache = None,
 ) -> list[gpd.GeoDataFrame] | gpd.GeoDataFrame:
     """Load a list of files into a list of GeoDataFrames. If a single file name is
     passed that is not is a list, the function will return a single GeoDataFrame
     not inside a list. If a list of files is passed, even if it only contains
     1 file, the function will return a list.
+    The files are read concurrently on up to LOAD_THREADS threads, the readers release the
+    GIL while reading, and the layers are returned in the order of the files. A file that
+    fails to load is reported and skipped without holding up the others.
+    When columns are given only those attribute columns are read, through Arrow when pyarrow is
+    installed, and the layer is indexed by feature id so more columns can be added later with
+    :func:`~load_columns`. Every layer keeps its file name in attrs["source"] and the names of all
+    of its attribute columns in attrs["fields"].
     Author: Mitch Albert
 
     :param files: The list of file names to load, or a single file name.
     :type files: list[str] | str
     :param verbose: Controls whether the function prints progress messages and file information, defaults to True.
     :type verbose: str, optional
+    :param columns: The attribute columns to read, defaults to None which reads every column.
+    :type columns: list[str], optional
+    :param extent: Only read the features whose bounding box intersects this area, such as the
+                   extent of the planning grid. It is transformed to each file's own CRS and
+                   passed to the reader, so the other features are never read. Defaults to None
+                   which reads every feature.
+    :type extent: gpd.GeoSeries, optional
+    :param crs: The CRS to project the layers to, defaults to None which keeps the CRS of each file.
+    :type crs: any, optional
+    :param cache: A cache of layers read with columns and projected to crs, kept as GeoParquet
+                  and keyed by the file's signature from :func:`~cache.file_signature`, the CRS
+                  the columns and the extent. A cached layer is memory-mapped instead of read and
+                  projected again. Defaults to None which does not cache the layers.
+    :type cache: DiskCache, optional
     :return: A list of geodataframes if a list was passed in or a single geodataframe
             if a single file name was passed in.
     :rtype: list[gpd.GeoDataFrame] | gpd.GeoDataFrame
     """
-    if verbose:
-        print_info("Loading file(s)...")
-
-    gdfs = []
     single_file = False
-
     if not isinstance(files, list):
         files = [files]
         single_file = True
 
-    for file in files:
-        loaded = False
-        try:
+    if verbose:
+        print_info(f"Loading {len(files)} file(s)...")
+
+    def load(file: str) -> tuple[gpd.GeoDataFrame, float, bool]:
+        """Read one file, returning the layer, the time it took and whether it was cached."""
+        start_time = time()
+        info = pyogrio.read_info(file)
+        fields = list(info["fields"])
+        read_columns = None if columns is None else [col for col in fields if col in columns]
+        bbox = None
+        if extent is not None:
+            # the bbox filter is applied by the reader in the file's own CRS
+            bounds = extent.to_crs(info["crs"]).total_bounds if info["crs"] else extent.total_bounds
+            bbox = tuple(float(bound) for bound in bounds)
+        gdf = None
+        key = None
+        if cache is not None and crs is not None and read_columns is not None and ARROW:
+            key = DiskCache.key(file_signature(file), CRS.from_user_input(crs).to_wkt(), read_columns, bbox)
+            cached = cache.get(key, ".parquet")
+            if cached is not None:
+                gdf = gpd.read_parquet(cached, memory_map=True)
+        from_cache = gdf is not None
+        if gdf is None:
+            options = {} if bbox is None else {"bbox": bbox}
+            if read_columns is None:
+                gdf = gpd.read_file(file, **options)
+            else:
+                gdf = gpd.read_file(file, columns=read_columns, use_arrow=ARROW, fid_as_index=True, **options)
+            if crs is not None and gdf.crs != crs:
+                gdf = gdf.to_crs(crs)
+            if key is not None:
+                try:
+                    # the feature ids are written as a column so the cached layer keeps them
+                    cache.put(key, ".parquet", lambda temp: gdf.to_parquet(temp, index=True))
+                except Exception as e:
+                    print_warning_msg(f"Could not cache {file}: {e}")
+        gdf.name = file.split("/")[-1]
+        gdf.attrs["source"] = file
+        gdf.attrs["fields"] = fields
+        # the index holds the feature ids of the file, see select_by_attribute()
+        gdf.attrs["fid_index"] = columns is not None
+        return (gdf, time() - start_time, from_cache)
+
+    start_time = time()
+    gdfs = [None] * len(files)
+    with ThreadPoolExecutor(max(1, min(LOAD_THREADS, len(files)))) as executor:
+        futures = {executor.submit(load, file): i for i, file in enumerate(files)}
+        for done, future in enumerate(as_completed(futures), 1):
+            file = files[futures[future]]
+            try:
+                gdf, seconds, from_cache = future.result()
+            except Exception as e:
+                print_error_msg(f"[{done}/{len(files)}] Error loading file: {file}\n")
+                print(e)
+                continue
+            gdfs[futures[future]] = gdf
             if verbose:
-                print_info(f"Loading {file}")
-                progress = print_progress_start("Loading", dots=10, time=1)
-            gdf = gpd.read_file(file)
-            gdf.name = file.split("/")[-1]
-            gdfs.append(gdf)
-        except Exception as e:
-            print_error_msg(f"Error loading file: {file}\n")
-            print(e)
+                print_info_complete(
+                    f"[{done}/{len(files)}] Loading {gdf.name} {'from cache ' if from_cache else ''}"
+                    f"complete in {seconds:.2f} seconds"
+                )
+                print_info(f"CRS: {gdf.crs}")
+                print_info(f"Shape: {gdf.shape[0]} Rows, {gdf.shape[1]} Columns")
+                print_info("Columns: " + ", ".join(str(col) for col in gdf.columns))
+
+    gdfs = [gdf for gdf in gdfs if gdf is not None]
+    if verbose:
+        print_info_complete(f"Loaded {len(gdfs)} of {len(files)} file(s) in {(time() - start_time):.2f} seconds")
+    if single_file:
+        return gdfs[0] if gdfs else gpd.GeoDataFrame()
+    return gdfs
+
+
+def load_columns(gdfs: list[gpd.GeoDataFrame], columns: list[str] | str, verbose: bool = True) -> None:
+    """Add attribute columns that were not loaded by :func:`~load_files` to the layers, reading
+    only those columns of the layers' source files without their geometry. The rows are matched
+    by feature id so layers that were projected or filtered since they were loaded still line up.
+    Layers that already have the columns, or whose file does not have them, are left as they are.
+
+    :param gdfs: The layers loaded with columns by :func:`~load_files`.
+    :type gdfs: list[gpd.GeoDataFrame]
+    :param columns: The columns to add, or a single column.
+    :type columns: list[str] | str
+    :param verbose: Controls whether the function prints progress messages, defaults to True.
+    :type verbose: bool, optional
+    """
+    columns = [columns] if isinstance(columns, str) else columns
+    for gdf in gdfs:
+        missing = [col for col in columns if col not in gdf.columns and col in gdf.attrs.get("fields", [])]
+        if not missing or "source" not in gdf.attrs:
             continue
-        finally:
-            if verbose:
-                print_progress_stop(progress)
-                if loaded:
-                    print_info_complete(f"Loading {file.split('/')[-1]} complete")
-                    print_info(f"CRS: {gdf.crs}")
-                    print_info(f"Shape: {gdf.shape[0]} Rows, {gdf.shape[1]} Columns")
-                    print_info("Columns: " + ", ".join(str(col) for col in gdf.columns))
-
-    return gdfs[0] if single_file else gdfs
+        if verbose:
+            print_info(f"Loading {', '.join(missing)} of {gdf.attrs['source'].split('/')[-1]}")
+        values = gpd.read_file(
+            gdf.attrs["source"], columns=missing, read_geometry=False, use_arrow=ARROW, fid_as_index=True
+        )
+        for col in missing:
+            # keep the geometry as the last column like a layer loaded with every column
+            gdf.insert(len(gdf.columns) - 1, col, values[col].reindex(gdf.index).to_numpy())
+
+
+def attribute_values(gdf: gpd.GeoDataFrame, column: str) -> list:
+    """Get the distinct values of an attribute of a layer. A loaded column is read from memory,
+    otherwise the values are read from the layer's source file with SELECT DISTINCT so neither the
+    column nor the geometry has to be loaded. Missing values are left out.
+
+    :param gdf: The layer.
+    :type gdf: gpd.GeoDataFrame
+    :param column: The attribute column.
+    :type column: str
+    :return: The distinct values of the attribute, or an empty list if the layer does not have it.
+    :rtype: list
+    """
+    if column in gdf.columns:
+        return list(gdf[column].dropna().unique())
+    if column not in gdf.attrs.get("fields", []) or "source" not in gdf.attrs:
+        return []
+    source = gdf.attrs["source"]
+    layer = pyogrio.read_info(source)["layer_name"]
+    values = pyogrio.read_dataframe(source, sql=f'SELECT DISTINCT "{column}" FROM "{layer}"', read_geometry=False)
+    return list(values[column].dropna())
+
+
+def reader_filterable(dtype: str) -> bool:
+    """Check if the reader can filter a column of a file by a where-clause from :func:`~where_clause`.
+    Only numeric and string columns are, the literals of other types such as booleans and dates
+    differ between file formats.
+
+    :param dtype: The numpy dtype of the column in the file, such as "int64" or "object".
+    :type dtype: str
+    :return: True if the column can be filtered by the reader.
+    :rtype: bool
+    """
+    return dtype.startswith(("int", "uint", "float")) or dtype in ("object", "str", "string")
+
+
+def where_clause(column: str, values: list, dtype: str) -> str | None:
+    """Compile a selection of attribute values into a SQL where-clause that the reader applies to
+    the features of a file. Values of a numeric column are written as numbers, values of a string
+    column as quoted strings, and values that can not be written for the column type are left out.
+
+    :param column: The attribute column.
+    :type column: str
+    :param values: The values to keep, as they are listed to the user.
+    :type values: list
+    :param dtype: The numpy dtype of the column in the file, such as "int64" or "object".
+    :type dtype: str
+    :raises ValueError: If the column is not numeric or string, see :func:`~reader_filterable`.
+    :return: The where-clause, or None if none of the values can be written.
+    :rtype: str | None
+    """
+    if not reader_filterable(dtype):
+        raise ValueError(f"Can not filter {column} of type {dtype} with a where-clause")
+    literals = []
+    for value in values:
+        if dtype.startswith(("int", "uint", "float")):
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                continue
+            if number != number:
+                continue
+            literals.append(repr(int(number)) if number.is_integer() else repr(number))
+        else:
+            literals.append("'" + str(value).replace("'", "''") + "'")
+    if not literals:
+        return None
+    return f'"{column}" IN ({", ".join(dict.fromkeys(literals))})'
+
+
+def attribute_matches(series: pd.Series, values: list) -> pd.Series:
+    """Find the rows of an attribute column whose value is one of the values. The values, which
+    are usually the strings listed to the user, are parsed for the type of the column: true and
+    false or 1 and 0 for booleans, dates and times for datetimes and numbers for numeric columns.
+    Values that do not parse are left out. Columns of other types are compared as strings.
+
+    :param series: The attribute column.
+    :type series: pd.Series
+    :param values: The values to keep.
+    :type values: list
+    :return: True for each row whose value is one of the values.
+    :rtype: pd.Series
+    """
+    if pd.api.types.is_bool_dtype(series.dtype):
+        booleans = {"true": True, "1": True, "false": False, "0": False}
+        keep = {booleans.get(str(value).strip().lower()) for value in values} - {None}
+        return series.isin(list(keep))
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        keep = []
+        for value in values:
+            stamp = pd.to_datetime(str(value).strip(), errors="coerce")
+            if pd.isna(stamp):
+                continue
+            # compare in the time zone of the column
+            if series.dt.tz is not None:
+                stamp = stamp.tz_localize(series.dt.tz) if stamp.tz is None else stamp.tz_convert(series.dt.tz)
+            elif stamp.tz is not None:
+                stamp = stamp.tz_convert(None)
+            keep.append(stamp)
+        return series.isin(keep)
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        keep = pd.to_numeric(pd.Series(values, dtype=object).astype(str), errors="coerce").dropna()
+        return series.isin(keep)
+    return series.astype(str).isin([str(value) for value in values])
+
+
+def select_by_attribute(gdf: gpd.GeoDataFrame, column: str, values: list) -> gpd.GeoDataFrame:
+    """Select the features of a layer whose attribute is one of the values. For a layer loaded by
+    :func:`~load_files` with columns that does not have the column loaded, the feature ids of the
+    matching features are read from the layer's source file. A numeric or string column is filtered
+    by the reader with a where-clause from :func:`~where_clause`, a column of another type is read
+    without the geometry and matched by :func:`~attribute_matches`. The selection is then taken from
+    the layer by feature id, so it shares the rows of the layer instead of copying them and the
+    column does not have to be loaded. Layers with the column are matched in memory by
+    :func:`~attribute_matches`.
+
+    :param gdf: The layer.
+    :type gdf: gpd.GeoDataFrame
+    :param column: The attribute column.
+    :type column: str
+    :param values: The values to keep, as they are listed to the user.
+    :type values: list
+    :return: The selected features.
+    :rtype: gpd.GeoDataFrame
+    """
+    fields = gdf.attrs.get("fields", [])
+    if gdf.attrs.get("fid_index") and "source" in gdf.attrs and column in fields and column not in gdf.columns:
+        info = pyogrio.read_info(gdf.attrs["source"])
+        dtype = str(info["dtypes"][list(info["fields"]).index(column)])
+        if reader_filterable(dtype):
+            where = where_clause(column, values, dtype)
+            if where is None:
+                return gdf.iloc[:0]
+            fids = pyogrio.read_dataframe(
+                gdf.attrs["source"], columns=[column], read_geometry=False, where=where, fid_as_index=True
+            ).index
+        else:
+            series = pyogrio.read_dataframe(
+                gdf.attrs["source"], columns=[column], read_geometry=False, fid_as_index=True
+            )[column]
+            fids = series.index[attribute_matches(series, values).to_numpy()]
+        return gdf[gdf.index.isin(fids)]
+    if column not in gdf.columns:
+        return gdf.iloc[:0]
+    return gdf[attribute_matches(gdf[column], values).to_numpy()]
+
+
+def iter_file_batches(file: str, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[gpd.GeoDataFrame]:
+    """Read a file a batch of features at a time, so a layer larger than memory can be processed
+    one batch after another. Only one batch is held in memory at a time. The file is opened once
+    and read front to back as an Arrow stream when pyarrow is installed, otherwise the feature ids
+    are read first, without any attributes or geometry, and each batch is read by its ids.
+
+    :param file: The file name to read.
+    :type file: str
+    :param batch_size: The most features in a batch, defaults to STREAM_BATCH_SIZE.
+    :type batch_size: int, optional
+    :yield: The features of the file, batch_size at a time, with the file name in the name attribute.
+    :rtype: Iterator[gpd.GeoDataFrame]
+    """
+    name = file.split("/")[-1]
+    if not ARROW:
+        fids = pyogrio.raw.read(file, columns=[], read_geometry=False, return_fids=True)[1]
+        for start in range(0, len(fids), batch_size):
+            gdf = gpd.read_file(file, fids=fids[start : start + batch_size])
+            gdf.name = name
+            yield gdf
+        return
+    with pyogrio.raw.open_arrow(file, batch_size=batch_size, use_pyarrow=True) as (meta, reader):
+        for batch in reader:
+            gdf = gpd.GeoDataFrame.from_arrow(batch)
+            # name the geometry column like read_file does
+            gdf = gdf.rename_geometry("geometry")
+            gdf.name = name
+            yield gdf
 
 
 def get_file(